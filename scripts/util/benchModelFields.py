@@ -0,0 +1,124 @@
+#!/usr/bin/python2.7
+#! -*- encoding: utf-8 -*-
+'''
+Micro-benchmark of the attribute writes on the dispatcher models.
+
+Compares the number of writes per second handled by the current Model.__setattr__ and by the previous
+implementation (lookup of the old value with hasattr/getattr and walk of the mro for each change event),
+for changed field values, unchanged field values and attributes which are not fields.
+Must be run with the dispatcher sources in the PYTHONPATH.
+'''
+
+import argparse
+import time
+
+from octopus.dispatcher.model.models import Model, IntegerField, StringField, FloatField
+
+
+class LegacyLayer(object):
+    '''
+    Previous implementation of Model.__setattr__ and Model.fireChangeEvent.
+    '''
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name) and getattr(self, name) == value:
+            return
+        oldvalue = getattr(self, name, None)
+        object.__setattr__(self, name, value)
+        if name in self.FIELDS:
+            self.fireChangeEvent(self, name, oldvalue, value)
+
+    @classmethod
+    def fireChangeEvent(cls, obj, field, oldvalue, newvalue):
+        if not hasattr(obj, "_changeReady") or not obj._changeReady:
+            return
+        for base in obj.__class__.__mro__:
+            if hasattr(base, 'changeListeners'):
+                for changeListener in base.changeListeners:
+                    changeListener.onChangeEvent(obj, field, oldvalue, newvalue)
+        for changeListener in obj.changeListeners:
+            changeListener.onChangeEvent(obj, field, oldvalue, newvalue)
+
+
+class CountingListener(object):
+
+    def __init__(self):
+        self.events = 0
+
+    def onCreationEvent(self, obj):
+        pass
+
+    def onChangeEvent(self, obj, field, oldvalue, newvalue):
+        self.events += 1
+
+
+class BenchNode(Model):
+    name = StringField()
+    status = IntegerField()
+    completion = FloatField()
+
+
+class BenchTask(BenchNode):
+    priority = IntegerField()
+
+
+class LegacyBenchTask(LegacyLayer, BenchTask):
+    pass
+
+
+def writeChanged(obj, count):
+    for i in xrange(count):
+        obj.status = i
+
+
+def writeUnchanged(obj, count):
+    for i in xrange(count):
+        obj.status = 1
+
+
+def writeOther(obj, count):
+    for i in xrange(count):
+        obj.readyCommandCount = i
+
+
+def writeMixed(obj, count):
+    # a typical update of a command: the status and the name do not change, the completion does
+    for i in xrange(count):
+        obj.status = 1
+        obj.name = "frame"
+        obj.completion = i / float(count)
+        obj.readyCommandCount = i
+
+
+SCENARIOS = [("changed field", writeChanged, 1),
+             ("unchanged field", writeUnchanged, 1),
+             ("non-field attribute", writeOther, 1),
+             ("mixed", writeMixed, 4)]
+
+
+def run(cls, function, count, repeat):
+    obj = cls(name="frame", status=1, completion=0., priority=0)
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        function(obj, count)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+parser = argparse.ArgumentParser(description='Puli - Benchmark of the model attribute writes.')
+parser.add_argument('-n', '--count', type=int, default=200000, help='number of writes per run')
+parser.add_argument('-r', '--repeat', type=int, default=5, help='number of runs, the best run is kept')
+args = parser.parse_args()
+
+listener = CountingListener()
+BenchNode.changeListeners.append(listener)
+
+print "%-20s %15s %15s %8s" % ("scenario", "old writes/s", "new writes/s", "speedup")
+for (name, function, writesPerLoop) in SCENARIOS:
+    writes = args.count * writesPerLoop
+    old = run(LegacyBenchTask, function, args.count, args.repeat)
+    new = run(BenchTask, function, args.count, args.repeat)
+    print "%-20s %15d %15d %7.2fx" % (name, writes / old, writes / new, old / new)
@@ -0,0 +1,123 @@
+#!/usr/bin/python2.7
+#! -*- encoding: utf-8 -*-
+'''
+Micro-benchmark of the dispatch strategies of the folder nodes.
+
+Compares the time of a dispatch cycle over a folder with many children for the previous strategies (the children
+are sorted with a cmp function at each cycle) and for the current ones (the children are kept sorted between
+the cycles and only the children whose key changed are repositioned). Each cycle updates the strategy, walks
+the children in the order of the dispatch until some assignments are made and, for the priority strategy,
+changes the priority of a few children.
+Must be run with the dispatcher sources in the PYTHONPATH.
+'''
+
+import argparse
+import random
+import time
+from collections import defaultdict
+
+from octopus.dispatcher.model.models import Model, IntegerField, ModelField
+from octopus.dispatcher.strategies import FifoStrategy, FairStrategy, PriorityStrategy
+
+
+class LegacyFifoStrategy(object):
+
+    def update(self, folder, ep):
+        folder.children.sort(key=lambda child: child.id)
+
+    def iterChildren(self, folder):
+        return folder.children
+
+    def on_assignment(self, folder, task, node):
+        pass
+
+
+class LegacyFairStrategy(LegacyFifoStrategy):
+
+    def __init__(self):
+        self.assignment_counts = defaultdict(int)
+
+    def update(self, folder, ep):
+        folder.children.sort(self.cmp)
+
+    def cmp(self, x, y):
+        countx = self.assignment_counts[x]
+        county = self.assignment_counts[y]
+        val = cmp(countx, county)
+        if val == 0:
+            return cmp(x.id, y.id)
+        else:
+            return val
+
+    def on_assignment(self, folder, task, node):
+        self.assignment_counts[task] += 1
+
+
+class LegacyPriorityStrategy(LegacyFifoStrategy):
+
+    def update(self, folder, ep):
+        folder.children.sort(self.cmp)
+
+    def cmp(self, x, y):
+        priocmp = cmp(y.priority, x.priority)
+        if priocmp:
+            return priocmp
+        else:
+            return cmp(x.id, y.id)
+
+
+class BenchFolder(Model):
+    priority = IntegerField()
+
+    def __init__(self):
+        Model.__init__(self, id=0, priority=0)
+        self.children = []
+
+
+class BenchChild(Model):
+    parent = ModelField(allow_null=True)
+    priority = IntegerField()
+
+    def __init__(self, id, parent, priority):
+        Model.__init__(self, id=id, priority=priority)
+        self.parent = parent
+        parent.children.append(self)
+
+
+STRATEGIES = [("fifo", LegacyFifoStrategy, FifoStrategy),
+              ("fair", LegacyFairStrategy, FairStrategy),
+              ("priority", LegacyPriorityStrategy, PriorityStrategy)]
+
+
+def run(strategyClass, children, cycles, assignments, changes):
+    random.seed(0)
+    folder = BenchFolder()
+    nodes = [BenchChild(id, folder, random.randint(0, 100)) for id in random.sample(xrange(children), children)]
+    strategy = strategyClass()
+    # first sort of the children
+    strategy.update(folder, folder)
+    start = time.time()
+    for cycle in xrange(cycles):
+        if strategyClass.__name__.endswith("PriorityStrategy"):
+            for node in random.sample(nodes, changes):
+                node.priority = random.randint(0, 100)
+        strategy.update(folder, folder)
+        for (i, child) in enumerate(strategy.iterChildren(folder)):
+            if i == assignments:
+                break
+            strategy.on_assignment(folder, child, None)
+    return (time.time() - start) / cycles
+
+
+parser = argparse.ArgumentParser(description='Puli - Benchmark of the dispatch strategies.')
+parser.add_argument('-n', '--children', type=int, default=10000, help='number of children of the folder')
+parser.add_argument('-c', '--cycles', type=int, default=50, help='number of dispatch cycles per run')
+parser.add_argument('-a', '--assignments', type=int, default=20, help='number of assignments per cycle')
+parser.add_argument('-p', '--changes', type=int, default=10, help='number of priority changes per cycle')
+args = parser.parse_args()
+
+print "%-10s %15s %15s %8s" % ("strategy", "old ms/cycle", "new ms/cycle", "speedup")
+for (name, legacyClass, strategyClass) in STRATEGIES:
+    old = run(legacyClass, args.children, args.cycles, args.assignments, args.changes)
+    new = run(strategyClass, args.children, args.cycles, args.assignments, args.changes)
+    print "%-10s %15.3f %15.3f %7.1fx" % (name, old * 1000, new * 1000, old / new)
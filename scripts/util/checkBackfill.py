@@ -0,0 +1,182 @@
+#!/usr/bin/python2.7
+#! -*- encoding: utf-8 -*-
+'''
+Check of the backfill of the dispatcher (Dispatcher.backfill) on a synthetic pool of big and small render nodes.
+
+The pool mixes big render nodes (a lot of memory and the 'bigmem' caracteristic) and small ones. Three jobs wait:
+  - "big", with the highest dispatch key, whose commands require the big render nodes and outnumber them,
+  - "capped", whose maxRN of 1 has been set by a user,
+  - "small", with no maxRN set by a user and more commands than the small render nodes.
+The assignments are computed as in a cycle of the dispatcher (Dispatcher.computeAssignments): the maxRN computed
+from the dispatch keys give most of the pool to "big", so the dispatch of the entry points leaves most of the small
+render nodes idle, and the backfill which follows is expected to give them to "small". The script checks that:
+  - the commands of "big" only run on big render nodes, and every render node of the pool is working,
+  - "capped" never exceeds its maxRN,
+  - "small" gets its computed maxRN from the dispatch of the entry points and the other render nodes from the
+    backfill, which only assigns render nodes left idle by the dispatch,
+  - the bookkeeping of the dispatch is consistent: allocatedRN of the poolshares, readyCommandCount of the nodes
+    and ready commands of the ready task index,
+  - a second computation of the assignments does not assign anything more.
+The exit status is 1 if a check fails. Must be run with the dispatcher sources in the PYTHONPATH. The settings are
+read from the config.ini of the dispatcher, the one of the sources (etc/puli/config.ini) if it is not installed,
+the backfill is enabled and the preemption and the fair share are disabled whatever the settings.
+'''
+
+import argparse
+import os
+import sys
+import time
+from Queue import Queue
+
+from octopus.core import singletonconfig
+from octopus.core.enums.command import CMD_READY
+from octopus.core.enums.rendernode import RN_IDLE
+from octopus.dispatcher import settings
+from octopus.dispatcher.dispatcher import Dispatcher
+from octopus.dispatcher.model import DispatchTree, FolderNode, TaskNode, Task, Command, RenderNode, Pool, PoolShare
+from octopus.dispatcher.model.node import BaseNode
+from octopus.dispatcher.model.jobindex import JOBS_FOLDER_ID
+from octopus.dispatcher.strategies import FifoStrategy
+
+BIG_RAM = 64000
+SMALL_RAM = 8000
+
+# config of the installed dispatcher, else the one of the sources
+DEFAULT_CONFIG = os.path.join(settings.CONFDIR, "config.ini")
+if not os.path.exists(DEFAULT_CONFIG):
+    DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "etc", "puli", "config.ini")
+
+
+def createDispatcher():
+    '''
+    Returns a dispatcher holding an empty dispatch tree, without database, webservice nor worker client, and the
+    folder of the jobs.
+    '''
+    dispatcher = Dispatcher.__new__(Dispatcher, None)
+    dispatcher.init = True
+    # no framework: the assignments are computed as by a main loop run from the IOLoop
+    dispatcher.framework = None
+    dispatcher.licenseManager = None
+    dispatcher.queue = Queue()
+    BaseNode.dispatcher = dispatcher
+    dispatcher.dispatchTree = DispatchTree()
+    dispatcher.dispatchTree.registerModelListeners()
+    graphs = FolderNode(JOBS_FOLDER_ID, "graphs", dispatcher.dispatchTree.root, "root", 0, 0, 0, FifoStrategy())
+    return dispatcher, graphs
+
+
+def createJob(graphs, name, dispatchKey, requirements, nbCommands, ramUse=0):
+    job = FolderNode(None, name, graphs, "user", 0, dispatchKey, 0, FifoStrategy())
+    task = Task(None, name, None, "user", 0, 0, dispatchKey, "runner", {}, "", [], requirements, 1, 0, ramUse, {})
+    for i in xrange(nbCommands):
+        task.commands.append(Command(None, "%s_%d" % (name, i), task, {}))
+    taskNode = TaskNode(None, name, job, "user", 0, 0, 0, task)
+    task.nodes['graph_rule'] = taskNode
+    return job, task, taskNode
+
+
+def check(errors, condition, message):
+    if not condition:
+        errors.append(message)
+    print "%-4s %s" % ("ok" if condition else "FAIL", message)
+
+
+def checkBookkeeping(errors, tree, jobs):
+    allocated = {}
+    for rendernode in tree.renderNodes.values():
+        if rendernode.currentpoolshare is not None:
+            allocated[rendernode.currentpoolshare] = allocated.get(rendernode.currentpoolshare, 0) + 1
+    for (job, task, taskNode) in jobs:
+        poolShare = job.mainPoolShare()
+        ready = len([command for command in task.commands if command.status == CMD_READY])
+        check(errors, poolShare.allocatedRN == allocated.get(poolShare, 0),
+              "job %s: allocatedRN %d, %d render nodes working for it" % (job.name, poolShare.allocatedRN, allocated.get(poolShare, 0)))
+        check(errors, taskNode.readyCommandCount == ready and job.readyCommandCount == ready,
+              "job %s: readyCommandCount %d (task node %d), %d ready commands" % (job.name, job.readyCommandCount, taskNode.readyCommandCount, ready))
+        check(errors, tree.readyTasks.readyCount(task) == ready,
+              "job %s: %d ready commands in the ready task index" % (job.name, tree.readyTasks.readyCount(task)))
+
+
+def run(args):
+    dispatcher, graphs = createDispatcher()
+    tree = dispatcher.dispatchTree
+    pool = Pool(None, "pool")
+    bigNodes, smallNodes = [], []
+    for i in xrange(args.big + args.small):
+        big = i < args.big
+        rendernode = RenderNode(None, "rn%d:8000" % i, args.cores, 2.0, "rn%d" % i, 8000, BIG_RAM if big else SMALL_RAM,
+                                {'bigmem': big}, performance=float(i))
+        rendernode.isRegistered = True
+        rendernode.status = RN_IDLE
+        rendernode.lastAliveTime = time.time()
+        pool.addRenderNode(rendernode)
+        (bigNodes if big else smallNodes).append(rendernode)
+
+    big = createJob(graphs, "big", 10, {'bigmem': True}, 2 * args.big, ramUse=BIG_RAM / 2)
+    capped = createJob(graphs, "capped", 7, {}, args.small)
+    small = createJob(graphs, "small", 5, {}, 2 * args.small)
+    jobs = [big, capped, small]
+    # the maxRN computed from the dispatch keys leave the render nodes of the pool to the first job
+    for (job, task, taskNode) in (big, small):
+        PoolShare(None, pool, job, 0).userDefinedMaxRN = False
+    PoolShare(None, pool, capped[0], 1)
+    tree.updateCompletionAndStatus()
+
+    # the assignments of the backfill, to tell them from the ones of the dispatch of the entry points
+    backfilled = []
+    backfill = dispatcher.backfill
+
+    def recordBackfill():
+        assignments = backfill()
+        backfilled.extend(assignments)
+        return assignments
+    dispatcher.backfill = recordBackfill
+
+    assignments = [(rendernode, command) for (rendernode, commands) in dispatcher.computeAssignments() for command in commands]
+    byJob, backfilledByJob = {}, {}
+    for (rendernode, command) in assignments:
+        byJob.setdefault(command.task.name, []).append(rendernode)
+    for (rendernode, command) in backfilled:
+        backfilledByJob.setdefault(command.task.name, []).append(rendernode)
+    for (job, task, taskNode) in jobs:
+        rendernodes = byJob.get(job.name, [])
+        print "%-8s maxRN %2d, %2d render nodes (%2d backfilled): %s" % (job.name, job.mainPoolShare().maxRN, len(rendernodes),
+                                                                      len(backfilledByJob.get(job.name, [])),
+                                                                      " ".join(sorted(rn.name for rn in rendernodes)))
+
+    errors = []
+    check(errors, all(rendernode in bigNodes for rendernode in byJob.get("big", [])),
+          "the commands of the big job only run on big render nodes")
+    working = [rendernode for rendernode in bigNodes + smallNodes if rendernode.commands]
+    check(errors, len(working) == len(bigNodes) + len(smallNodes),
+          "%d of the %d render nodes are working" % (len(working), len(bigNodes) + len(smallNodes)))
+    check(errors, len(byJob.get("capped", [])) == 1,
+          "the capped job keeps its maxRN of 1 (%d render nodes)" % len(byJob.get("capped", [])))
+    smallMaxRN = small[0].mainPoolShare().maxRN
+    check(errors, len(byJob.get("small", [])) - len(backfilledByJob.get("small", [])) == smallMaxRN,
+          "the dispatch of the entry points gives its maxRN of %d to the small job" % smallMaxRN)
+    idleAfterDispatch = len(bigNodes) + len(smallNodes) - (len(assignments) - len(backfilled))
+    check(errors, len(backfilledByJob.get("small", [])) == idleAfterDispatch,
+          "the backfill gives the %d render nodes left idle to the small job" % len(backfilledByJob.get("small", [])))
+    check(errors, len(backfilled) == len(backfilledByJob.get("small", [])), "the backfill only assigns commands of the small job")
+    checkBookkeeping(errors, tree, jobs)
+    check(errors, dispatcher.computeAssignments() == [], "a second computation of the assignments assigns nothing")
+    return errors
+
+parser = argparse.ArgumentParser(description='Puli - Check of the backfill on a pool of big and small render nodes.')
+parser.add_argument('--big', type=int, default=4, help='number of big render nodes')
+parser.add_argument('--small', type=int, default=12, help='number of small render nodes')
+parser.add_argument('--cores', type=int, default=8, help='number of cores of each render node')
+parser.add_argument('--config', default=DEFAULT_CONFIG, help='config file of the dispatcher')
+args = parser.parse_args()
+if not os.path.exists(args.config):
+    parser.error("no config file %s" % args.config)
+
+singletonconfig.load(args.config)
+singletonconfig.conf['CORE'].update(BACKFILL=True, PREEMPTION=False, FAIRSHARE=False)
+
+errors = run(args)
+if errors:
+    print "%d checks failed" % len(errors)
+    sys.exit(1)
+print "all checks passed"
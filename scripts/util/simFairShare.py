@@ -0,0 +1,95 @@
+#!/usr/bin/python2.7
+#! -*- encoding: utf-8 -*-
+'''
+Deterministic simulation of the hierarchical fair share of the dispatcher (octopus.dispatcher.model.fairshare).
+
+A pool of render nodes is shared by three users of two prods, each user having a single job with more ready
+commands than the pool can run. The first user runs alone during the night, then the three users compete for
+the pool during the day. At each cycle the render nodes are split with FairShare.computeTargets and the free
+render nodes are given to the jobs below their target, the commands are never interrupted.
+The decayed usage of the users is printed every few hours and is expected to converge to their configured
+shares (i.e. the prod shares times the user shares within each prod), the exit status is 1 if it does not.
+Must be run with the dispatcher sources in the PYTHONPATH.
+'''
+
+import argparse
+import sys
+
+from octopus.dispatcher.model.fairshare import FairShare
+
+# (prod, user) of each job
+JOBS = [("prodA", "night"), ("prodA", "alice"), ("prodB", "bob")]
+PROD_SHARES = {"prodA": 1, "prodB": 1}
+USER_SHARES = {"night": 1, "alice": 3, "bob": 1}
+
+
+def expectedShares():
+    shares = {}
+    for (prod, user) in JOBS:
+        prodUsers = [u for (p, u) in JOBS if p == prod]
+        prodShare = PROD_SHARES[prod] / float(sum(PROD_SHARES.values()))
+        shares[user] = prodShare * USER_SHARES[user] / float(sum(USER_SHARES[u] for u in prodUsers))
+    return shares
+
+
+def simulate(args):
+    fairShare = FairShare(args.half_life, PROD_SHARES, USER_SHARES)
+    paths = dict((user, ("pool", prod, user, jobId)) for (jobId, (prod, user)) in enumerate(JOBS))
+    # (end time, command id, user) of the running commands
+    running = []
+    nextCommandId = 0
+    shares = expectedShares()
+    now = 0.0
+    end = (args.night + args.day) * 3600
+    error = None
+    print "%6s  %s" % ("hour", "  ".join("%-22s" % ("%s (share %.2f)" % (user, shares[user])) for (prod, user) in JOBS))
+    while now < end:
+        # the users of the day arrive in the morning
+        users = [user for (prod, user) in JOBS if user == "night" or now >= args.night * 3600]
+        for (endTime, commandId, user) in [item for item in running if item[0] <= now]:
+            fairShare.stop(commandId, endTime)
+            running.remove((endTime, commandId, user))
+        allocated = dict((user, 0) for user in users)
+        for (endTime, commandId, user) in running:
+            allocated[user] = allocated.get(user, 0) + 1
+        jobs = [(paths[user], 1, args.nodes) for user in users]
+        targets = fairShare.computeTargets(jobs, args.nodes, now)
+        free = args.nodes - len(running)
+        # the free render nodes go to the jobs the furthest below their target
+        while free > 0:
+            user = min(users, key=lambda u: (allocated[u] - targets[paths[u]], u))
+            if allocated[user] >= targets[paths[user]]:
+                break
+            # the duration of the commands varies from one to four cycles
+            duration = args.cycle * (1 + nextCommandId % 4)
+            running.append((now + duration, nextCommandId, user))
+            fairShare.start(nextCommandId, paths[user], 1, now)
+            nextCommandId += 1
+            allocated[user] += 1
+            free -= 1
+        now += args.cycle
+        if now % (args.report * 3600) == 0:
+            usages = dict((user, fairShare.getUsage(paths[user], now)) for (prod, user) in JOBS)
+            total = sum(usages[user] for user in users) or 1.0
+            fractions = dict((user, usages[user] / total) for user in users)
+            if now > args.night * 3600:
+                error = max(abs(fractions[user] - shares[user]) for user in users)
+            print "%6d  %s" % (now / 3600, "  ".join("%-22s" % ("%3d rn, usage %.3f" % (allocated.get(user, 0), fractions.get(user, 0))) for (prod, user) in JOBS))
+    return error
+
+
+parser = argparse.ArgumentParser(description='Puli - Simulation of the hierarchical fair share.')
+parser.add_argument('-n', '--nodes', type=int, default=100, help='number of render nodes of the pool')
+parser.add_argument('-c', '--cycle', type=int, default=60, help='duration of a dispatch cycle in seconds')
+parser.add_argument('--night', type=int, default=10, help='hours during which the first user is alone')
+parser.add_argument('--day', type=int, default=24, help='hours during which all the users compete')
+parser.add_argument('--half-life', type=float, default=4 * 3600, help='half-life of the usage in seconds')
+parser.add_argument('--report', type=int, default=2, help='hours between two reports')
+parser.add_argument('--tolerance', type=float, default=0.02, help='max difference between the usage and the share')
+args = parser.parse_args()
+
+error = simulate(args)
+print "max difference between the usage and the share at the end: %.4f" % error
+if error > args.tolerance:
+    print "the usages did not converge to the shares"
+    sys.exit(1)
@@ -1,6 +1,11 @@
 import tornado
+import tornado.ioloop
+import tornado.web
 import logging
 import httplib
+import itertools
+import sys
+from threading import currentThread
 try:
     import simplejson as json
 except ImportError:
@@ -18,13 +23,58 @@ __all__ += ['Controller', 'ControllerError', 'ResourceNotFoundErro', 'BaseResour
 
 logger = logging.getLogger('main.dispatcher.webservice')
 
+# size of the buffers flushed by BaseResource.writeStream (in bytes)
+STREAM_BUFFER_SIZE = 64 * 1024
+
 
 def queue(func):
+    '''
+    Marks a handler as mutating the application model. When the framework runs its main loop in a
+    scheduler thread, the handler body is handed over to that thread and the request is finished
+    asynchronously once it has been applied. Otherwise the handler is simply called inline.
+    '''
     def queued_func(self, *args, **kwargs):
-        return self.queueAndWait(func, self, *args, **kwargs)
+        if self.framework.scheduler is None:
+            return func(self, *args, **kwargs)
+        return self.queueAndFinish(func, self, *args, **kwargs)
     return queued_func
 
 
+def snapshot(func):
+    '''
+    Marks a handler as reading the application model. When the framework runs its main loop in a
+    scheduler thread, the handler is run by the IOLoop the next time the scheduler thread hands the
+    model over (@see SchedulerThread.requestModel), at a safe point of an iteration or between two
+    iterations: its response is built from the last committed state of the model, which does not
+    change while the handler runs, without waiting for the end of the iteration. A request modifying
+    the model is answered once its change is committed, so a client reading the model after that
+    sees it. Otherwise the handler is simply called inline. In both cases the request is flagged as
+    read-only, even if it is not a GET.
+    '''
+    def snapshot_func(self, *args):
+        self.readOnly = True
+        if self.framework.scheduler is None:
+            return func(self, *args)
+        return self.runWithModel(func, self, *args)
+    return snapshot_func
+
+
+def iterJSONList(items, encode=None):
+    '''
+    Yields the JSON representation of a list piece by piece (one piece per item), so that the whole
+    representation is never held in memory. If given, encode converts each item into a serializable value.
+    '''
+    yield '['
+    for (i, item) in enumerate(items):
+        if encode is not None:
+            item = encode(item)
+        if i:
+            yield ', ' + json.dumps(item)
+        else:
+            yield json.dumps(item)
+    yield ']'
+
+
 class ControllerError(Exception):
     """
     Raised by a controller to report a problem. Subclass at will.
@@ -59,9 +109,27 @@ class Controller(object):
 
 
 class BaseResource(tornado.web.RequestHandler):
+    # iterator on the chunks of a streamed response (@see writeStream)
+    streamedChunks = None
+    # set for the requests that do not modify the model (@see snapshot)
+    readOnly = False
+
     def initialize(self, framework):
         self.framework = framework
 
+    def inScheduler(self):
+        '''Returns True if called by the scheduler thread (i.e. from a queued handler).'''
+        scheduler = getattr(self.framework, 'scheduler', None)
+        return scheduler is not None and currentThread() is scheduler
+
+    def finish(self, chunk=None):
+        if self.inScheduler():
+            # the IOLoop finishes the request once the handler has been applied (@see finishWorkload)
+            if chunk is not None:
+                self.write(chunk)
+            return
+        tornado.web.RequestHandler.finish(self, chunk)
+
     def getDispatchTree(self):
         return self.framework.application.dispatchTree
 
@@ -97,8 +165,114 @@ class BaseResource(tornado.web.RequestHandler):
         self.framework.application.queueWorkload(workload)
         return workload.wait()
 
+    def queueAndFinish(self, func, *args, **options):
+        '''
+        Queues func on the application without blocking the IOLoop. The request is kept open and
+        finished from the IOLoop thread when the scheduler has processed the workload.
+        The readOnly option tells the application that func does not modify the model.
+        '''
+        self._auto_finish = False
+        ioloop = tornado.ioloop.IOLoop.instance()
+        workload = Workload(lambda: func(*args), callback=lambda w: ioloop.add_callback(lambda: self.finishWorkload(w)),
+                            readOnly=options.get('readOnly', False))
+        self.framework.application.queueWorkload(workload)
+
+    def finishWorkload(self, workload):
+        self.finishHandler(workload.result, workload.error)
+
+    def runWithModel(self, func, *args):
+        '''
+        Runs func from the IOLoop the next time the scheduler thread hands the model over, without
+        blocking the IOLoop meanwhile. The request is kept open and finished once func has returned,
+        unless the handler is asynchronous (e.g. the response is streamed).
+        '''
+        autoFinish = self._auto_finish
+        self._auto_finish = False
+
+        def run():
+            if self._finished:
+                return
+            try:
+                result = func(*args)
+            except Exception:
+                self.finishHandler(None, sys.exc_info())
+                return
+            if autoFinish or isinstance(result, tornado.web.HTTPError):
+                self.finishHandler(result, None)
+        self.framework.scheduler.requestModel(run)
+
+    def finishHandler(self, result, error):
+        '''
+        Finishes a request whose handler has been run apart from tornado (@see queueAndFinish and
+        runWithModel), with the result or the exc_info tuple of the error of the handler.
+        '''
+        if self._finished:
+            return
+        if error is not None:
+            exception = error[1]
+            if isinstance(exception, tornado.web.HTTPError):
+                self.send_error(exception.status_code, exception=exception)
+            else:
+                logger.error("Request %s %s failed", self.request.method, self.request.uri, exc_info=error)
+                self.send_error(500)
+        elif isinstance(result, tornado.web.HTTPError):
+            self.send_error(result.status_code, exception=result)
+        elif self.streamedChunks is not None:
+            self.writeNextBuffer()
+        else:
+            self.finish()
+
     def writeCallback(self, chunk):
         data = self.request.arguments
         if 'callback' in data:
             chunk = ('%s(%s);' % (data['callback'][0], chunk))
         self.write(chunk)
+
+    def writeStream(self, chunks):
+        '''
+        Writes the strings yielded by chunks and finishes the request, the handler must be asynchronous.
+        The response is sent in buffers of STREAM_BUFFER_SIZE bytes and the next buffer is only generated
+        once the previous one has been written to the socket: the memory used stays bounded and the IOLoop
+        serves the other requests between two buffers. When the main loop runs in a scheduler thread, each
+        buffer is generated while the model is handed over to the IOLoop (@see runWithModel).
+        From a queued handler, the chunks are all generated at once (the model may change as soon as the
+        handler returns) and sent in buffers from the IOLoop.
+        '''
+        data = self.request.arguments
+        if 'callback' in data:
+            chunks = itertools.chain(['%s(' % data['callback'][0]], chunks, [');'])
+        if self.inScheduler():
+            self.streamedChunks = iter(list(chunks))
+            return
+        self.streamedChunks = iter(chunks)
+        self.writeNextBuffer()
+
+    def requestNextBuffer(self):
+        scheduler = getattr(self.framework, 'scheduler', None)
+        if scheduler is None:
+            self.writeNextBuffer()
+        else:
+            scheduler.requestModel(self.writeNextBuffer)
+
+    def writeNextBuffer(self):
+        if self._finished:
+            return
+        if self.request.connection.stream.closed():
+            logger.warning("Client closed the connection before the end of the response to %s %s", self.request.method, self.request.uri)
+            return
+        size = 0
+        try:
+            for chunk in self.streamedChunks:
+                self.write(chunk)
+                size += len(chunk)
+                if size >= STREAM_BUFFER_SIZE:
+                    break
+            else:
+                self.finish()
+                return
+        except Exception:
+            # once the first buffer is flushed the response can only be cut short
+            logger.exception("Error while streaming the response to %s %s", self.request.method, self.request.uri)
+            self.send_error(500)
+            return
+        self.flush(callback=self.requestNextBuffer)
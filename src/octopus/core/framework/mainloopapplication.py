@@ -10,6 +10,7 @@
 #
 ####################################################################################################
 
+import time
 import logging
 LOGGER = logging.getLogger("main.framework.application")
 
@@ -35,5 +36,26 @@ class MainLoopApplication(object):
     def prepare(self):
         raise NotImplementedError
 
+    ## Called by the scheduler thread between two iterations of the main loop.
+    #
+    # @param timeout the maximum time in seconds to spend before returning
+    #
+    def idle(self, timeout):
+        time.sleep(timeout)
+
+    ## Called by the scheduler thread before handing the model over to the IOLoop, publishes the changes
+    # made since the previous call (@see SchedulerThread.yieldModel).
+    #
+    def publish(self):
+        pass
+
+    ## Safe point of an iteration: hands the model over to the IOLoop if it is waiting for it. Does nothing
+    # if the main loop is run by the IOLoop or without framework.
+    #
+    def yieldModel(self):
+        scheduler = self.framework.scheduler if self.framework is not None else None
+        if scheduler is not None:
+            scheduler.yieldModel()
+
     def stop(self):
         pass
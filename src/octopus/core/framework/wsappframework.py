@@ -18,6 +18,7 @@ import logging
 
 from octopus.core.framework.mainloopapplication import MainLoopApplication
 from octopus.core.framework.ticket import Ticket
+from octopus.core.tools import Workload
 from tornado.web import Application
 from tornado.ioloop import IOLoop
 from threading import Thread
@@ -37,6 +38,7 @@ class WSAppFramework(object):
     #
     def __init__(self, applicationClass=MainLoopApplication, webServiceClass=Application, port=8000):
         self.port = port
+        self.scheduler = None
         self.application = applicationClass(self)
         self.webService = webServiceClass(self, port)
         self.stopFlag = False
@@ -77,7 +79,21 @@ class WSAppFramework(object):
         for ticket in tickets:
             del self.tickets[ticket.id]
 
+    ## Runs the application's main loop in a dedicated thread instead of the IOLoop.
+    #
+    # @param interval the delay in milliseconds between the start of two iterations
+    #
+    def startScheduler(self, interval):
+        self.scheduler = SchedulerThread(self, interval)
+        self.scheduler.start()
+
+    def stopScheduler(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler.join()
+
     def stop(self):
+        self.stopScheduler()
         PuliTornadoServer().stop()
         self.stopFlag = True
         self.application.stop()
@@ -124,3 +140,81 @@ class PuliTornadoServer(Thread):
 
     def stop(self):
         IOLoop.instance().stop()
+
+
+## Calls the framework loop periodically from its own thread.
+#
+# Between two iterations, the thread is handed to the application's idle() method which can
+# process pending work (i.e. requests queued by the webservice) until the next iteration is due.
+#
+# The IOLoop reads the model through requestModel(): the functions are run by the IOLoop the next
+# time the scheduler thread hands the model over, i.e. when the application calls yieldModel() at a
+# safe point of an iteration (e.g. between two steps) or while it is idle. The application publishes
+# its changes (e.g. commits a new version of the model) and waits until the IOLoop has run the
+# functions, so they see a committed state of the model that does not change while they run.
+#
+class SchedulerThread(Thread):
+    def __init__(self, framework, interval):
+        Thread.__init__(self, name="scheduler")
+        self.setDaemon(True)
+        self.framework = framework
+        self.interval = interval / 1000.0
+        self.stopEvent = threading.Event()
+        # functions of the IOLoop waiting for the model
+        self.modelRequests = []
+        self.requestsLock = threading.Lock()
+        # set by the IOLoop once it has run the functions
+        self.released = threading.Event()
+
+    def run(self):
+        log = logging.getLogger('main.framework')
+        nextCycle = time.time()
+        while not self.stopEvent.isSet():
+            now = time.time()
+            if now < nextCycle:
+                self.framework.application.idle(nextCycle - now)
+                continue
+            nextCycle = now + self.interval
+            try:
+                self.framework.loop()
+            except Exception:
+                log.exception("Unexpected error in scheduler loop")
+
+    def stop(self):
+        self.stopEvent.set()
+
+    ## Runs func from the IOLoop the next time the model is handed over, called by the IOLoop.
+    #
+    def requestModel(self, func):
+        with self.requestsLock:
+            self.modelRequests.append(func)
+            first = len(self.modelRequests) == 1
+        if first:
+            # wakes up the application if it is idle (@see Dispatcher.idle)
+            self.framework.application.queueWorkload(Workload(self.yieldModel, readOnly=True))
+
+    ## Hands the model over to the IOLoop if some functions are waiting for it, called by the scheduler
+    # thread at the safe points of the application. Returns once the IOLoop has run them.
+    #
+    def yieldModel(self):
+        if not self.modelRequests or self.stopEvent.isSet():
+            return
+        self.framework.application.publish()
+        self.released.clear()
+        IOLoop.instance().add_callback(self.runModelRequests)
+        # the IOLoop may be stopped before it runs the functions
+        while not self.released.wait(1.0):
+            if self.stopEvent.isSet():
+                return
+
+    def runModelRequests(self):
+        with self.requestsLock:
+            requests, self.modelRequests = self.modelRequests, []
+        try:
+            for func in requests:
+                try:
+                    func()
+                except Exception:
+                    logging.getLogger('main.framework').exception("Unexpected error while reading the model")
+        finally:
+            self.released.set()
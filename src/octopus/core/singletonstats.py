@@ -49,6 +49,7 @@ class DispatcherStats():
     cycleDate = 0.0
 
     cycleTimers = {
+        'apply_queue': 0.0,
         'update_tree': 0.0,
         'update_rn': 0.0,
         'update_dependencies': 0.0,
@@ -74,6 +75,8 @@ class DispatcherStats():
     assignmentTimers = {
         'update_max_rn': 0.0,
         'dispatch_command': 0.0,
+        'backfill': 0.0,
+        'preemption': 0.0,
     }
 
     accumulationBuffer = []
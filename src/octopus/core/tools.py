@@ -7,9 +7,12 @@ from threading import Event
 
 class Workload(object):
 
-    def __init__(self, job):
+    def __init__(self, job, callback=None, readOnly=False):
         self.event = Event()
         self.job = job
+        self.callback = callback
+        # the job only reads the model, the application does not need to record a new version of it
+        self.readOnly = readOnly
         self.result = None
         self.error = None
 
@@ -21,6 +24,8 @@ class Workload(object):
 
     def submit(self):
         self.event.set()
+        if self.callback is not None:
+            self.callback(self)
 
     def wait(self):
         self.event.wait()
@@ -0,0 +1,256 @@
+"""
+Local checkpoints of the dispatch tree.
+
+A checkpoint holds the rows of the elements of the tree, as they are stored in the tables read by
+PuliDB.restoreStateFromDb. The batches of rows written to the database after a checkpoint (i.e. returned by
+PuliDB.getRows) are appended to a delta journal. At startup the delta journals are applied to the rows of the
+last checkpoint and the tree is rebuilt from these rows instead of querying each table of the database.
+The deltas are synced to disk before the batches are written to the database, so that a crash never loads a
+checkpoint older than the database.
+
+A checkpoint file starts with a fixed size header (magic, format version, length of a json header), followed
+by the json header and the rows of each table, pickled as (columns, list of value tuples).
+"""
+
+from __future__ import with_statement
+
+import cPickle
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+from threading import Thread
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from octopus.dispatcher.db.pulidb import Dependencies, Rules, POOLS_RENDER_NODES
+from octopus.dispatcher.db.writebehind import Journal
+
+
+LOGGER = logging.getLogger('main.dispatcher')
+
+MAGIC = 'PULICKPT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>8sII')
+
+CHECKPOINT_FILE = 'dispatchtree.checkpoint'
+DELTA_FILE = 'dispatchtree.%d.delta'
+DELTA_FILE_PATTERN = re.compile(r'^dispatchtree\.(\d+)\.delta$')
+
+# columns identifying the rows of the tables without id
+KEY_COLUMNS = {Dependencies.sqlmeta.table: (Dependencies.q.toNodeId.fieldName,
+                                            Dependencies.q.taskNodes.fieldName,
+                                            Dependencies.q.folderNodes.fieldName),
+               POOLS_RENDER_NODES: ('pools_id', 'render_nodes_id')}
+
+
+class DatabaseImage(object):
+    '''
+    Rows of the tables of the database, as dicts indexed by table and by id (or key columns).
+    '''
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.tables = {}
+
+    def getKey(self, table, fields):
+        if table in KEY_COLUMNS:
+            return tuple(fields.get(column) for column in KEY_COLUMNS[table])
+        return fields['id']
+
+    def addRow(self, table, fields):
+        if table == Rules.sqlmeta.table:
+            return
+        self.tables.setdefault(table, {})[self.getKey(table, fields)] = fields
+
+    def addTuples(self, table, columns, rows):
+        nbRows = 0
+        for row in rows:
+            self.addRow(table, dict(zip(columns, row)))
+            nbRows += 1
+        return nbRows
+
+    ## Applies a batch of rows returned by PuliDB.getRows, as PuliDB.writeRows does on the database.
+    #
+    def applyRows(self, rows):
+        inserts, updates, pools, archives = rows
+        for (table, items) in inserts:
+            self.addRow(table, dict(items))
+        for (table, columns, params) in updates:
+            row = self.tables.get(table, {}).get(params[-1])
+            if row is not None:
+                row.update(zip(columns, params[:-1]))
+        poolsRenderNodes = self.tables.setdefault(POOLS_RENDER_NODES, {})
+        for (poolId, renderNodeIds) in pools:
+            for key in [key for key in poolsRenderNodes if key[0] == poolId]:
+                del poolsRenderNodes[key]
+            for renderNodeId in renderNodeIds:
+                poolsRenderNodes[(poolId, renderNodeId)] = {'pools_id': poolId, 'render_nodes_id': renderNodeId}
+        for (name, statRows, deletes) in archives:
+            for (table, conditions) in deletes:
+                if table == Rules.sqlmeta.table:
+                    continue
+                self.tables.get(table, {}).pop(self.getKey(table, dict(conditions)), None)
+
+    def iterRows(self, table):
+        return self.tables.get(table, {}).itervalues()
+
+    ## Yields the rows of a table as tuples of the given columns.
+    # @param ids only yield the rows with these ids
+    #
+    def iterTuples(self, table, columns, ids=None):
+        for fields in self.iterRows(table):
+            if ids is None or fields['id'] in ids:
+                yield tuple(fields.get(column) for column in columns)
+
+    def getMaxId(self, table):
+        return max(self.tables.get(table) or [0])
+
+    def getCount(self, table):
+        return len(self.tables.get(table, ()))
+
+
+class CheckpointManager(object):
+    '''
+    Writes the checkpoints and the delta journals in a local directory and loads them at startup.
+    The files of a checkpoint are written by a thread, the rows are read from the model by the calling thread.
+    '''
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.lastCheckpointTime = 0
+        self.writer = None
+        self.generation = max(self.getDeltaGenerations() or [0])
+        self.delta = Journal(self.getDeltaPath(self.generation))
+
+    def getCheckpointPath(self):
+        return os.path.join(self.directory, CHECKPOINT_FILE)
+
+    def getDeltaPath(self, generation):
+        return os.path.join(self.directory, DELTA_FILE % generation)
+
+    def getDeltaGenerations(self):
+        generations = []
+        for filename in os.listdir(self.directory):
+            match = DELTA_FILE_PATTERN.match(filename)
+            if match:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+    ## Appends a batch of rows to the current delta journal, synced to disk before the rows are written to the
+    # database: the database never holds changes missing from the deltas (the checks at load only see the
+    # created and archived rows, not the updates of the existing rows).
+    #
+    def record(self, rows):
+        if any(rows):
+            self.delta.append(rows)
+
+    def isDue(self):
+        if self.writer is not None and self.writer.isAlive():
+            return False
+        return time.time() - self.lastCheckpointTime >= self.interval
+
+    ## Starts a new checkpoint with the given rows, the rows written to the database from now on are recorded
+    # in a new delta journal. The previous delta journals are removed once the checkpoint is written.
+    # @param rows the (table, fields) rows of the elements of the tree (@see PuliDB.getTreeRows)
+    #
+    def write(self, rows):
+        tables = {}
+        for (table, fields) in rows:
+            if table not in tables:
+                tables[table] = (tuple(sorted(fields)), [])
+            columns, values = tables[table]
+            values.append(tuple(fields[column] for column in columns))
+        self.generation += 1
+        self.delta.close()
+        self.delta = Journal(self.getDeltaPath(self.generation))
+        self.lastCheckpointTime = time.time()
+        self.writer = Thread(target=self.writeFile, args=(self.generation, tables), name='CheckpointWriter')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def writeFile(self, generation, tables):
+        prevTimer = time.time()
+        path = self.getCheckpointPath()
+        try:
+            header = json.dumps({'generation': generation,
+                                 'time': prevTimer,
+                                 'counts': dict((table, len(values)) for (table, (columns, values)) in tables.iteritems())})
+            with open(path + '.tmp', 'wb') as checkpointFile:
+                checkpointFile.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(header)))
+                checkpointFile.write(header)
+                cPickle.dump(tables, checkpointFile, cPickle.HIGHEST_PROTOCOL)
+                checkpointFile.flush()
+                os.fsync(checkpointFile.fileno())
+            os.rename(path + '.tmp', path)
+            for previousGeneration in self.getDeltaGenerations():
+                if previousGeneration < generation:
+                    os.remove(self.getDeltaPath(previousGeneration))
+        except Exception:
+            LOGGER.exception("Failed to write checkpoint %d" % generation)
+            return
+        LOGGER.info("Checkpoint %d written in %.3f s" % (generation, time.time() - prevTimer))
+
+    ## Returns the DatabaseImage of the last checkpoint with the delta journals applied, or None if there is
+    # no checkpoint or if it cannot be read.
+    #
+    def load(self):
+        path = self.getCheckpointPath()
+        if not os.path.exists(path):
+            LOGGER.warning("  - no checkpoint found in %s" % self.directory)
+            return None
+        try:
+            with open(path, 'rb') as checkpointFile:
+                data = mmap.mmap(checkpointFile.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    magic, version, headerLength = HEADER.unpack_from(data)
+                    if magic != MAGIC or version != FORMAT_VERSION:
+                        LOGGER.warning("  - ignoring checkpoint %s, unsupported format version %r" % (path, version))
+                        return None
+                    header = json.loads(data[HEADER.size:HEADER.size + headerLength])
+                    tables = cPickle.loads(data[HEADER.size + headerLength:])
+                finally:
+                    data.close()
+        except Exception:
+            LOGGER.exception("Failed to read checkpoint %s" % path)
+            return None
+
+        image = DatabaseImage(header['generation'])
+        for (table, (columns, values)) in tables.iteritems():
+            image.addTuples(table, columns, values)
+        nbBatches = 0
+        for generation in self.getDeltaGenerations():
+            if generation < image.generation:
+                continue
+            delta = Journal(self.getDeltaPath(generation), sync=False)
+            for rows in delta.read():
+                image.applyRows(rows)
+                nbBatches += 1
+            delta.close()
+        LOGGER.warning("  - checkpoint %d of %s, %d batches written since" % (image.generation, time.ctime(header['time']), nbBatches))
+        return image
+
+    ## Removes the checkpoint and the delta journals, used when the checkpoint does not match the database.
+    #
+    def reset(self):
+        if self.writer is not None:
+            self.writer.join()
+        self.delta.close()
+        if os.path.exists(self.getCheckpointPath()):
+            os.remove(self.getCheckpointPath())
+        for generation in self.getDeltaGenerations():
+            os.remove(self.getDeltaPath(generation))
+        self.delta = Journal(self.getDeltaPath(self.generation))
+        self.lastCheckpointTime = 0
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.join()
+        self.delta.close()
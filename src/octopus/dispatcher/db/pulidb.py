@@ -10,14 +10,19 @@
 #
 ####################################################################################################
 
+from __future__ import with_statement
+
 from sqlobject import (SQLObject, UnicodeCol, IntCol, FloatCol, DateTimeCol,
                        BoolCol, MultipleJoin, RelatedJoin, connectionForURI,
                        ForeignKey, sqlhub)
 # from sqlobject.sqlbuilder import *
-from sqlobject.sqlbuilder import Insert, Update, IN, Select, Table, AND, INNERJOINOn, Delete
+from sqlobject.sqlbuilder import Insert, Update, IN, Select, Table, AND, OR, Delete, func
 from sqlobject.dberrors import DuplicateEntryError
 
 from collections import defaultdict
+from itertools import chain
+from Queue import Queue
+from threading import Lock, Thread
 import datetime
 import logging
 import time
@@ -199,6 +204,186 @@ class RenderNodes(SQLObject):
     performance = FloatCol()
 
 
+POOLS_RENDER_NODES = 'pools_render_nodes'
+
+# tables in which the rows of the created elements are inserted
+INSERTION_ORDER = [FolderNodes.sqlmeta.table,
+                   TaskNodes.sqlmeta.table,
+                   Dependencies.sqlmeta.table,
+                   TaskGroups.sqlmeta.table,
+                   Tasks.sqlmeta.table,
+                   Rules.sqlmeta.table,
+                   Commands.sqlmeta.table,
+                   RenderNodes.sqlmeta.table,
+                   Pools.sqlmeta.table,
+                   POOLS_RENDER_NODES,
+                   PoolShares.sqlmeta.table]
+
+# placeholder used in raw queries, depending on the paramstyle of the DB-API module
+PARAM_MARKERS = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}
+
+# columns read for each table when restoring the state of the dispatcher, in the order of the restored rows
+RESTORE_FIELDS = {Pools.sqlmeta.table: [Pools.q.id,
+                                        Pools.q.name],
+                  RenderNodes.sqlmeta.table: [RenderNodes.q.id,
+                                              RenderNodes.q.name,
+                                              RenderNodes.q.coresNumber,
+                                              RenderNodes.q.speed,
+                                              RenderNodes.q.ip,
+                                              RenderNodes.q.port,
+                                              RenderNodes.q.ramSize,
+                                              RenderNodes.q.caracteristics,
+                                              RenderNodes.q.performance],
+                  POOLS_RENDER_NODES: [Table(POOLS_RENDER_NODES).pools_id,
+                                       Table(POOLS_RENDER_NODES).render_nodes_id],
+                  FolderNodes.sqlmeta.table: [FolderNodes.q.id,
+                                              FolderNodes.q.name,
+                                              FolderNodes.q.parentId,
+                                              FolderNodes.q.user,
+                                              FolderNodes.q.priority,
+                                              FolderNodes.q.dispatchKey,
+                                              FolderNodes.q.maxRN,
+                                              FolderNodes.q.taskGroupId,
+                                              FolderNodes.q.strategy,
+                                              FolderNodes.q.creationTime,
+                                              FolderNodes.q.startTime,
+                                              FolderNodes.q.updateTime,
+                                              FolderNodes.q.endTime],
+                  TaskNodes.sqlmeta.table: [TaskNodes.q.id,
+                                            TaskNodes.q.name,
+                                            TaskNodes.q.parentId,
+                                            TaskNodes.q.user,
+                                            TaskNodes.q.priority,
+                                            TaskNodes.q.dispatchKey,
+                                            TaskNodes.q.maxRN,
+                                            TaskNodes.q.taskId,
+                                            TaskNodes.q.creationTime,
+                                            TaskNodes.q.startTime,
+                                            TaskNodes.q.updateTime,
+                                            TaskNodes.q.endTime,
+                                            TaskNodes.q.maxAttempt],
+                  Dependencies.sqlmeta.table: [Dependencies.q.toNodeId,
+                                               Dependencies.q.statusList,
+                                               Dependencies.q.folderNodes,
+                                               Dependencies.q.taskNodes],
+                  PoolShares.sqlmeta.table: [PoolShares.q.id,
+                                             PoolShares.q.poolId,
+                                             PoolShares.q.nodeId,
+                                             PoolShares.q.maxRN],
+                  Commands.sqlmeta.table: [Commands.q.id,
+                                           Commands.q.description,
+                                           Commands.q.taskId,
+                                           Commands.q.status,
+                                           Commands.q.completion,
+                                           Commands.q.creationTime,
+                                           Commands.q.startTime,
+                                           Commands.q.updateTime,
+                                           Commands.q.endTime,
+                                           Commands.q.assignedRNId,
+                                           Commands.q.message,
+                                           Commands.q.stats,
+                                           Commands.q.args,
+                                           Commands.q.attempt,
+                                           Commands.q.runnerPackages,
+                                           Commands.q.watcherPackages],
+                  Tasks.sqlmeta.table: [Tasks.q.id,
+                                        Tasks.q.name,
+                                        Tasks.q.parentId,
+                                        Tasks.q.user,
+                                        Tasks.q.priority,
+                                        Tasks.q.dispatchKey,
+                                        Tasks.q.maxRN,
+                                        Tasks.q.runner,
+                                        Tasks.q.environment,
+                                        Tasks.q.requirements,
+                                        Tasks.q.minNbCores,
+                                        Tasks.q.maxNbCores,
+                                        Tasks.q.ramUse,
+                                        Tasks.q.licence,
+                                        Tasks.q.tags,
+                                        Tasks.q.validationExpression,
+                                        Tasks.q.args,
+                                        Tasks.q.maxAttempt,
+                                        Tasks.q.runnerPackages,
+                                        Tasks.q.watcherPackages],
+                  TaskGroups.sqlmeta.table: [TaskGroups.q.id,
+                                             TaskGroups.q.name,
+                                             TaskGroups.q.parentId,
+                                             TaskGroups.q.user,
+                                             TaskGroups.q.priority,
+                                             TaskGroups.q.dispatchKey,
+                                             TaskGroups.q.maxRN,
+                                             TaskGroups.q.environment,
+                                             TaskGroups.q.requirements,
+                                             TaskGroups.q.tags,
+                                             TaskGroups.q.strategy,
+                                             TaskGroups.q.args]}
+
+# tables whose max id and number of rows are compared to a checkpoint before using it, the rows created
+# after the checkpoint are read from the database. The number of rows of the tasks and task groups is not
+# compared since only the ones used by a node are restored.
+# (table, filter on archived rows, compare the number of rows)
+CHECKPOINT_CHECKS = [(Pools, True, True),
+                     (RenderNodes, False, True),
+                     (FolderNodes, True, True),
+                     (TaskNodes, True, True),
+                     (PoolShares, True, True),
+                     (Commands, True, True),
+                     (Tasks, True, False),
+                     (TaskGroups, True, False)]
+
+
+## Runs a select query in a dedicated thread and queues the fetched rows by batches of fetchSize rows.
+# Iterating over the reader yields the rows, an error of the query is raised again in the iterating thread.
+# A server-side cursor is used with MySQL so that the result set is streamed instead of being loaded at once.
+#
+class RowReader(Thread):
+    def __init__(self, conn, query, fetchSize, queueSize=4):
+        Thread.__init__(self, name='RowReader')
+        self.daemon = True
+        self.conn = conn
+        self.query = query
+        self.fetchSize = fetchSize
+        self.batches = Queue(queueSize)
+        self.start()
+
+    def createCursor(self, rawConn):
+        if self.conn.dbName == 'mysql':
+            from MySQLdb.cursors import SSCursor
+            return rawConn.cursor(SSCursor)
+        return rawConn.cursor()
+
+    def run(self):
+        try:
+            rawConn = self.conn.getConnection()
+            try:
+                cursor = self.createCursor(rawConn)
+                try:
+                    cursor.execute(self.query)
+                    while True:
+                        rows = cursor.fetchmany(self.fetchSize)
+                        if not rows:
+                            break
+                        self.batches.put(rows)
+                finally:
+                    cursor.close()
+            finally:
+                self.conn.releaseConnection(rawConn)
+            self.batches.put(None)
+        except Exception, e:
+            self.batches.put(e)
+
+    def __iter__(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            for row in batch:
+                yield row
+
+
 def createTables():
     FolderNodes.createTable(ifNotExists=True)
     TaskNodes.createTable(ifNotExists=True)
@@ -226,7 +411,7 @@ def dropTables():
 
 
 class PuliDB(object):
-    def __init__(self, cleanDB, licManager=None):
+    def __init__(self, cleanDB, licManager=None, journal=None, checkpoints=None):
         from octopus.dispatcher import settings
         # init the connection
         sqlhub.processConnection = connectionForURI(settings.DB_URL)
@@ -238,6 +423,14 @@ class PuliDB(object):
         LOGGER.warning("creating database tables")
         createTables()
         self.licenseManager = licManager
+        # journal of the write-behind mode, @see writebehind.py
+        self.journal = journal
+        if cleanDB and journal is not None:
+            journal.truncate()
+        # local checkpoints of the database rows, @see checkpoint.py
+        self.checkpoints = checkpoints
+        if cleanDB and checkpoints is not None:
+            checkpoints.reset()
 
     def dropPoolsAndRnsTables(self):
         Pools.dropTable(ifExists=True)
@@ -245,346 +438,454 @@ class PuliDB(object):
         Pools.createTable(ifNotExists=True)
         RenderNodes.createTable(ifNotExists=True)
 
+    ## Creates, updates and archives the provided elements.
+    # @param toCreate the elements to create
+    # @param toModify the elements to update
+    # @param toArchive the elements to archive
+    #
+    def saveElements(self, toCreate, toModify, toArchive):
+        self.writeRows(self.getRows(toCreate, toModify, toArchive))
+
     ## Creates the provided elements in the database.
     # @param elements the elements to create
     #
     def createElements(self, elements):
-        elements.sort(key=lambda element: element.__class__)
-        for element in elements:
-            # LOGGER.info("            ----> Creating elem = %s" % element )
-            # /////////////// Handling of the TaskNode
-            if isinstance(element, TaskNode):
-                conn = TaskNodes._connection
-                fields = {TaskNodes.q.id.fieldName: element.id,
-                          TaskNodes.q.name.fieldName: element.name,
-                          TaskNodes.q.parentId.fieldName: element.parent.id,
-                          TaskNodes.q.user.fieldName: element.user,
-                          TaskNodes.q.priority.fieldName: element.priority,
-                          TaskNodes.q.dispatchKey.fieldName: element.dispatchKey,
-                          TaskNodes.q.maxRN.fieldName: element.maxRN,
-                          TaskNodes.q.taskId.fieldName: element.task.id,
-                          TaskNodes.q.creationTime.fieldName: self.getDateFromTimeStamp(element.creationTime),
-                          TaskNodes.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
-                          TaskNodes.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
-                          TaskNodes.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime),
-                          TaskNodes.q.maxAttempt.fieldName: element.maxAttempt,
-                          TaskNodes.q.archived.fieldName: False}
-                conn.query(conn.sqlrepr(Insert(TaskNodes.q, values=fields)))
-                conn.cache.clear()
-                if element.dependencies:
-                    conn = Dependencies._connection
-                    for (toNode, statusList) in element.dependencies:
-                        statusStringList = [str(i) for i in statusList]
-                        fields = {Dependencies.q.toNodeId.fieldName: toNode.id,
-                                  Dependencies.q.statusList.fieldName: ','.join(statusStringList),
-                                  Dependencies.q.taskNodes.fieldName: element.id,
-                                  Dependencies.q.folderNodes.fieldName: None,
-                                  Dependencies.q.archived.fieldName: False}
-                        conn.query(conn.sqlrepr(Insert(Dependencies.q, values=fields)))
-                        conn.cache.clear()
-
-            # /////////////// Handling of the FolderNode
-            elif isinstance(element, FolderNode):
-                conn = FolderNodes._connection
-                fields = {FolderNodes.q.id.fieldName: element.id,
-                          FolderNodes.q.name.fieldName: element.name,
-                          FolderNodes.q.parentId.fieldName: element.parent.id,
-                          FolderNodes.q.user.fieldName: element.user,
-                          FolderNodes.q.priority.fieldName: element.priority,
-                          FolderNodes.q.dispatchKey.fieldName: element.dispatchKey,
-                          FolderNodes.q.maxRN.fieldName: element.maxRN,
-                          FolderNodes.q.taskGroupId.fieldName: element.taskGroup.id if element.taskGroup else None,
-                          FolderNodes.q.strategy.fieldName: element.strategy.getClassName(),
-                          FolderNodes.q.creationTime.fieldName: self.getDateFromTimeStamp(element.creationTime),
-                          FolderNodes.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
-                          FolderNodes.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
-                          FolderNodes.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime),
-                          FolderNodes.q.archived.fieldName: False}
-                conn.query(conn.sqlrepr(Insert(FolderNodes.q, values=fields)))
-                conn.cache.clear()
-                if element.dependencies:
-                    conn = Dependencies._connection
-                    for (toNode, statusList) in element.dependencies:
-                        statusStringList = [str(i) for i in statusList]
-                        fields = {Dependencies.q.toNodeId.fieldName: toNode.id,
-                                  Dependencies.q.statusList.fieldName: ','.join(statusStringList),
-                                  Dependencies.q.taskNodes.fieldName: None,
-                                  Dependencies.q.folderNodes.fieldName: element.id,
-                                  Dependencies.q.archived.fieldName: False}
-                        conn.query(conn.sqlrepr(Insert(Dependencies.q, values=fields)))
-                        conn.cache.clear()
-
-            # /////////////// Handling of the TaskGroup
-            elif isinstance(element, TaskGroup):
-                for (rule, node) in element.nodes.iteritems():
-                    conn = Rules._connection
-                    fields = {Rules.q.name.fieldName: rule,
-                              Rules.q.taskNodeId.fieldName: None,
-                              Rules.q.folderNodeId.fieldName: node.id}
-                    conn.query(conn.sqlrepr(Insert(Rules.q, values=fields)))
-                    conn.cache.clear()
-                conn = TaskGroups._connection
-                fields = {TaskGroups.q.id.fieldName: element.id,
-                          TaskGroups.q.name.fieldName: element.name,
-                          TaskGroups.q.parentId.fieldName: element.parent.id if element.parent else None,
-                          TaskGroups.q.user.fieldName: element.user,
-                          TaskGroups.q.priority.fieldName: element.priority,
-                          TaskGroups.q.dispatchKey.fieldName: element.dispatchKey,
-                          TaskGroups.q.maxRN.fieldName: element.maxRN,
-                          TaskGroups.q.environment.fieldName: json.dumps(element.environment),
-                          TaskGroups.q.requirements.fieldName: json.dumps(element.requirements),
-                          TaskGroups.q.tags.fieldName: json.dumps(element.tags),
-                          TaskGroups.q.strategy.fieldName: element.strategy.getClassName(),
-                          TaskGroups.q.archived.fieldName: False,
-                          TaskGroups.q.args.fieldName: str(element.arguments)}
-                conn.query(conn.sqlrepr(Insert(TaskGroups.q, values=fields)))
-                conn.cache.clear()
-
-            # /////////////// Handling of the Task
-            elif isinstance(element, Task):
-                for (rule, node) in element.nodes.iteritems():
-                    conn = Rules._connection
-                    fields = {Rules.q.name.fieldName: rule,
-                              Rules.q.taskNodeId.fieldName: node.id,
-                              Rules.q.folderNodeId.fieldName: None}
-                    conn.query(conn.sqlrepr(Insert(Rules.q, values=fields)))
-                    conn.cache.clear()
-                conn = Tasks._connection
-                fields = {Tasks.q.id.fieldName: element.id,
-                          Tasks.q.name.fieldName: element.name,
-                          Tasks.q.parentId.fieldName: element.parent.id if element.parent else None,
-                          Tasks.q.user.fieldName: element.user,
-                          Tasks.q.priority.fieldName: element.priority,
-                          Tasks.q.dispatchKey.fieldName: element.dispatchKey,
-                          Tasks.q.maxRN.fieldName: element.maxRN,
-                          Tasks.q.runner.fieldName: element.runner,
-                          Tasks.q.environment.fieldName: json.dumps(element.environment),
-                          Tasks.q.requirements.fieldName: json.dumps(element.requirements),
-                          Tasks.q.minNbCores.fieldName: element.minNbCores,
-                          Tasks.q.maxNbCores.fieldName: element.maxNbCores,
-                          Tasks.q.ramUse.fieldName: element.ramUse,
-                          Tasks.q.licence.fieldName: element.lic,
-                          Tasks.q.tags.fieldName: json.dumps(element.tags),
-                          Tasks.q.validationExpression.fieldName: element.validationExpression,
-                          Tasks.q.archived.fieldName: False,
-                          Tasks.q.args.fieldName: str(element.arguments),
-                          Tasks.q.maxAttempt.fieldName: element.maxAttempt,
-                          Tasks.q.runnerPackages.fieldName: json.dumps(element.runnerPackages),
-                          Tasks.q.watcherPackages.fieldName: json.dumps(element.watcherPackages)
-                          }
-                conn.query(conn.sqlrepr(Insert(Tasks.q, values=fields)))
-                conn.cache.clear()
-
-            # /////////////// Handling of the Command
-            elif isinstance(element, Command):
-                conn = Commands._connection
-                fields = {Commands.q.id.fieldName: element.id,
-                          Commands.q.description.fieldName: element.description,
-                          Commands.q.taskId.fieldName: element.task.id,
-                          Commands.q.status.fieldName: element.status,
-                          Commands.q.completion.fieldName: element.completion,
-                          Commands.q.creationTime.fieldName: self.getDateFromTimeStamp(element.creationTime),
-                          Commands.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
-                          Commands.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
-                          Commands.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime),
-                          Commands.q.assignedRNId.fieldName: element.renderNode.id if element.renderNode else None,
-                          Commands.q.message.fieldName: element.message,
-                          Commands.q.stats.fieldName: str(element.stats),
-                          Commands.q.archived.fieldName: False,
-                          Commands.q.args.fieldName: str(element.arguments),
-                          Commands.q.attempt.fieldName: str(element.attempt),
-                          Commands.q.runnerPackages.fieldName: json.dumps(element.runnerPackages),
-                          Commands.q.watcherPackages.fieldName: json.dumps(element.watcherPackages)
-                          }
-                conn.query(conn.sqlrepr(Insert(Commands.q, values=fields)))
-                conn.cache.clear()
-
-            # /////////////// Handling of the RenderNode
-            elif isinstance(element, RenderNode):
-                conn = RenderNodes._connection
-                fields = {RenderNodes.q.id.fieldName: element.id,
-                          RenderNodes.q.name.fieldName: element.name,
-                          RenderNodes.q.coresNumber.fieldName: element.coresNumber,
-                          RenderNodes.q.speed.fieldName: element.speed,
-                          RenderNodes.q.ip.fieldName: element.host,
-                          RenderNodes.q.port.fieldName: element.port,
-                          RenderNodes.q.ramSize.fieldName: element.ramSize,
-                          RenderNodes.q.caracteristics.fieldName: json.dumps(element.caracteristics),
-                          RenderNodes.q.performance.fieldName: element.performance}
-                conn.query(conn.sqlrepr(Insert(RenderNodes.q, values=fields)))
-                conn.cache.clear()
-
-            # /////////////// Handling of the Pool
-            elif isinstance(element, Pool):
-                conn = Pools._connection
-                fields = {Pools.q.id.fieldName: element.id,
-                          Pools.q.name.fieldName: element.name,
-                          Pools.q.archived.fieldName: False}
-                conn.query(conn.sqlrepr(Insert(Pools.q, values=fields)))
-                conn.cache.clear()
-                for renderNode in element.renderNodes:
-                    conn.query(conn.sqlrepr(Insert('pools_render_nodes', values={'pools_id': element.id, 'render_nodes_id': renderNode.id})))
-                    conn.cache.clear()
-
-            # /////////////// Handling of the PoolShare
-            elif isinstance(element, PoolShare):
-                conn = PoolShares._connection
-                fields = {PoolShares.q.id.fieldName: element.id,
-                          PoolShares.q.poolId.fieldName: element.pool.id,
-                          PoolShares.q.nodeId.fieldName: element.node.id,
-                          PoolShares.q.maxRN.fieldName: element.maxRN,
-                          PoolShares.q.archived.fieldName: False}
-                conn.query(conn.sqlrepr(Insert(PoolShares.q, values=fields)))
-                conn.cache.clear()
+        self.writeRows(self.getRows(elements, (), ()))
 
     ## Updates the provided elements to the database.
     # @param elements the elements to update
     #
     def updateElements(self, elements):
-        for element in elements:
-            # LOGGER.info("            ----> Updating elem = %s" % element )
-            if isinstance(element, Command) or isinstance(element, TaskNode) or isinstance(element, FolderNode):
-                startTime = self.getDateFromTimeStamp(element.startTime)
-                endTime = self.getDateFromTimeStamp(element.endTime)
-                updateTime = self.getDateFromTimeStamp(element.updateTime)
-
-            # /////////////// Handling of the Command
-            if isinstance(element, Command):
-                if element.id:
-                    conn = Commands._connection
-                    fields = {Commands.q.status.fieldName: element.status,
-                              Commands.q.completion.fieldName: element.completion,
-                              Commands.q.startTime.fieldName: startTime,
-                              Commands.q.updateTime.fieldName: updateTime,
-                              Commands.q.stats.fieldName: str(element.stats),
-                              Commands.q.attempt.fieldName: str(element.attempt),
-                              Commands.q.endTime.fieldName: endTime}
-                    if element.renderNode:
-                        fields[Commands.q.assignedRNId.fieldName] = element.renderNode.id
-                    conn.query(conn.sqlrepr(Update(Commands.q, values=fields, where=(Commands.q.id == element.id))))
-                    conn.cache.clear()
-
-            # /////////////// Handling of the TaskNode
-            elif isinstance(element, TaskNode):
-                if element.id:
-                    conn = TaskNodes._connection
-                    fields = {TaskNodes.q.startTime.fieldName: startTime,
-                              TaskNodes.q.updateTime.fieldName: updateTime,
-                              TaskNodes.q.endTime.fieldName: endTime,
-                              TaskNodes.q.maxAttempt.fieldName: str(element.maxAttempt)
-                              }
-                    conn.query(conn.sqlrepr(Update(TaskNodes.q, values=fields, where=(TaskNodes.q.id == element.id))))
-                    conn.cache.clear()
-
-            # /////////////// Handling of the FolderNode
-            elif isinstance(element, FolderNode):
-                if element.id:
-                    conn = FolderNodes._connection
-                    fields = {FolderNodes.q.startTime.fieldName: startTime,
-                              FolderNodes.q.updateTime.fieldName: updateTime,
-                              FolderNodes.q.endTime.fieldName: endTime}
-                    conn.query(conn.sqlrepr(Update(FolderNodes.q, values=fields, where=(FolderNodes.q.id == element.id))))
-                    conn.cache.clear()
-
-            # /////////////// Handling of the Pool
-            elif isinstance(element, Pool):
-                # TODO use sqlbuilder
-                if element.id:
-                    dbPool = Pools.get(element.id)
-                    oldids = [rn.id for rn in dbPool.renderNodes]
-                    newids = [rn.id for rn in element.renderNodes]
-                    for rn in dbPool.renderNodes:
-                        if rn.id not in newids:
-                            dbPool.removeRenderNodes(rn)  # pylint: disable-msg=E1103
-                    for rn in element.renderNodes:
-                        if rn.id not in oldids:
-                            dbPool.addRenderNodes(rn)  # pylint: disable-msg=E1103
-
-            # /////////////// Handling of the RenderNode
-            elif isinstance(element, RenderNode):
-                if element.id:
-                    conn = RenderNodes._connection
-                    # fields = {RenderNodes.q.speed.fieldName: element.speed,
-                              # RenderNodes.q.coresNumber.fieldName: element.coresNumber,
-                              # RenderNodes.q.ramSize.fieldName: element.ramSize}
-                              # RenderNodes.q.caracteristics.fieldName: json.dumps(element.caracteristics),
-                    fields = {RenderNodes.q.performance.fieldName: element.performance}
-                    conn.query(conn.sqlrepr(Update(RenderNodes.q, values=fields, where=(RenderNodes.q.id == element.id))))
-                    conn.cache.clear()
-
-            # /////////////// Handling of the Task
-            elif isinstance(element, Task):
-                # Simply update "tags" field to preserve comments in DB
-                # The model listener will only register this elem when "tags" field is updated
-                if element.id:
-                    conn = Tasks._connection
-                    fields = {Tasks.q.tags.fieldName: json.dumps(element.tags),
-                              Tasks.q.maxAttempt.fieldName: str(element.maxAttempt)}
-                    conn.query(conn.sqlrepr(Update(Tasks.q, values=fields, where=(Tasks.q.id == element.id))))
-                    conn.cache.clear()
-
-            # /////////////// Handling of the TaskGroup
-            elif isinstance(element, TaskGroup):
-                # Simply update "tags" field to preserve comments in DB
-                # The model listener will only register this elem when "tags" field is updated
-                if element.id:
-                    conn = TaskGroups._connection
-                    fields = {TaskGroups.q.tags.fieldName: json.dumps(element.tags)}
-                    conn.query(conn.sqlrepr(Update(TaskGroups.q, values=fields, where=(TaskGroups.q.id == element.id))))
-                    conn.cache.clear()
+        self.writeRows(self.getRows((), elements, ()))
 
     ## Mark the provided elements as archived.
     # @param elements the elements to archive
     #
-
-
     def archiveElements(self, elements):
-        if not len(elements):
+        self.writeRows(self.getRows((), (), elements))
+
+    ## Returns the rows to write for the provided elements. The rows only hold plain values, so that they can be
+    # written later, from another thread or after a restart (@see writebehind.py), without reading the model again.
+    # An element appearing several times in toModify is updated once, with its current values.
+    # @param toCreate the elements to create
+    # @param toModify the elements to update
+    # @param toArchive the elements to archive
+    # @return a tuple (inserts, updates, pools, archives)
+    #
+    def getRows(self, toCreate, toModify, toArchive):
+        inserts = []
+        for element in toCreate:
+            for (table, fields) in self.getCreationRows(element):
+                inserts.append((table, tuple(sorted(fields.iteritems()))))
+        updates = []
+        pools = []
+        updated = set()
+        for element in toModify:
+            if element in updated or not element.id:
+                continue
+            updated.add(element)
+            if isinstance(element, Pool):
+                pools.append((element.id, tuple(rn.id for rn in element.renderNodes)))
+                continue
+            row = self.getUpdateRow(element)
+            if row is not None:
+                table, fields = row
+                columns = tuple(sorted(fields))
+                updates.append((table, columns, tuple(fields[column] for column in columns) + (element.id,)))
+        archives = []
+        for element in toArchive:
+            statRows, deletes = self.getArchiveRows(element)
+            archives.append((str(element), tuple((table, tuple(sorted(fields.iteritems()))) for (table, fields) in statRows), tuple(deletes)))
+        return (tuple(inserts), tuple(updates), tuple(pools), tuple(archives))
+
+    ## Writes rows returned by getRows: inserts and updates are written within a single transaction,
+    # with one multi-row INSERT per table (and per BATCH_SIZE rows) and one executemany per kind of update.
+    # @param rows the rows to write
+    #
+    def writeRows(self, rows):
+        inserts, updates, pools, archives = rows
+        if inserts or updates:
+            self.runInTransaction(sqlhub.getConnection(), self.writeModifications, inserts, updates)
+        if pools:
+            self.updatePools(pools)
+        if archives:
+            self.writeArchives(archives)
+        sqlhub.getConnection().cache.clear()
+
+    ## Calls func with a new transaction of the given connection as first argument, the transaction is
+    # committed if func succeeds.
+    #
+    def runInTransaction(self, conn, func, *args):
+        trans = conn.transaction()
+        try:
+            func(trans, *args)
+        except:
+            trans.rollback()
+            # nothing left to commit, this only releases the connection of the transaction
+            trans.commit(close=True)
+            raise
+        trans.commit(close=True)
+
+    def writeModifications(self, trans, inserts, updates):
+        self.insertRows(trans, inserts)
+        self.executeUpdates(trans, updates)
+
+    def insertRows(self, trans, inserts):
+        rowsByTable = defaultdict(list)
+        for (table, items) in inserts:
+            rowsByTable[table].append(dict(items))
+        batchSize = singletonconfig.get('DB', 'BATCH_SIZE', default=500)
+        for table in INSERTION_ORDER:
+            rows = rowsByTable.get(table)
+            if not rows:
+                continue
+            for i in xrange(0, len(rows), batchSize):
+                trans.query(trans.sqlrepr(Insert(table, valueList=rows[i:i + batchSize])))
+
+    def executeUpdates(self, trans, updates):
+        if not updates:
             return
-        for element in elements:
+        paramsByQuery = defaultdict(list)
+        for (table, columns, params) in updates:
+            paramsByQuery[(table, columns)].append(params)
+        marker = PARAM_MARKERS.get(getattr(sqlhub.getConnection().module, 'paramstyle', None), '%s')
+        # executemany is not exposed by sqlobject, the cursor is taken from the raw connection of the transaction
+        cursor = trans._connection.cursor()
+        try:
+            for (table, columns), params in paramsByQuery.iteritems():
+                query = "UPDATE %s SET %s WHERE id = %s" % (table, ", ".join("%s = %s" % (column, marker) for column in columns), marker)
+                cursor.executemany(query, params)
+        finally:
+            cursor.close()
+
+    ## Updates the rendernodes of the pools.
+    # @param pools a list of (pool id, rendernode ids) tuples
+    #
+    def updatePools(self, pools):
+        # TODO use sqlbuilder
+        for (poolId, renderNodeIds) in pools:
+            dbPool = Pools.get(poolId)
+            oldids = [rn.id for rn in dbPool.renderNodes]
+            for rn in dbPool.renderNodes:
+                if rn.id not in renderNodeIds:
+                    dbPool.removeRenderNodes(rn)  # pylint: disable-msg=E1103
+            for rnId in renderNodeIds:
+                if rnId not in oldids:
+                    dbPool.addRenderNodes(rnId)  # pylint: disable-msg=E1103
+
+    ## Copies the rows of the archived elements to the stat DB and deletes them from the DB.
+    # @param archives a list of (element description, stat DB rows, deleted rows) tuples
+    #
+    def writeArchives(self, archives):
+        try:
+            self.writeArchiveBatch(archives)
+        except DuplicateEntryError:
+            # some elements are already in the stat DB, archive the elements one by one to skip them
+            for archive in archives:
+                try:
+                    self.writeArchiveBatch([archive])
+                except DuplicateEntryError:
+                    LOGGER.warning(archive[0] + " was not archived because it is already in the stat DB. Consider manual fix.")
+
+    ## Inserts the rows of the archived elements in the stat DB within a single transaction, then deletes
+    # them from the DB within a single transaction.
+    #
+    def writeArchiveBatch(self, archives):
+        statConn = StatDB.getConnection()
+        statRows = [row for (description, rows, deletes) in archives for row in rows]
+        self.runInTransaction(statConn, self.insertRows, statRows)
+        statConn.cache.clear()
+        deletes = [delete for (description, rows, deletes) in archives for delete in deletes]
+        self.runInTransaction(sqlhub.getConnection(), self.deleteRows, deletes)
+
+    ## Deletes rows given as (table name, ((column, value), ...)) tuples. Rows deleted by id are deleted with
+    # one query per table (and per BATCH_SIZE rows).
+    #
+    def deleteRows(self, trans, deletes):
+        idsByTable = defaultdict(list)
+        clausesByTable = defaultdict(list)
+        for (table, where) in deletes:
+            if len(where) == 1 and where[0][0] == 'id':
+                idsByTable[table].append(where[0][1])
+            else:
+                clausesByTable[table].append(AND(*[getattr(Table(table), column) == value for (column, value) in where]))
+        batchSize = singletonconfig.get('DB', 'BATCH_SIZE', default=500)
+        for (table, ids) in idsByTable.iteritems():
+            for i in xrange(0, len(ids), batchSize):
+                trans.query(trans.sqlrepr(Delete(table, where=IN(Table(table).id, ids[i:i + batchSize]))))
+        for (table, clauses) in clausesByTable.iteritems():
+            for i in xrange(0, len(clauses), batchSize):
+                trans.query(trans.sqlrepr(Delete(table, where=OR(*clauses[i:i + batchSize]))))
+
+    ## Returns the rows to insert to create the provided element, as a list of (table name, fields) tuples.
+    # The first row is the one of the element itself.
+    # @param element the element to create
+    #
+    def getCreationRows(self, element):
+        rows = []
+        # /////////////// Handling of the TaskNode
+        if isinstance(element, TaskNode):
+            fields = {TaskNodes.q.id.fieldName: element.id,
+                      TaskNodes.q.name.fieldName: element.name,
+                      TaskNodes.q.parentId.fieldName: element.parent.id if element.parent else None,
+                      TaskNodes.q.user.fieldName: element.user,
+                      TaskNodes.q.priority.fieldName: element.priority,
+                      TaskNodes.q.dispatchKey.fieldName: element.dispatchKey,
+                      TaskNodes.q.maxRN.fieldName: element.maxRN,
+                      TaskNodes.q.taskId.fieldName: element.task.id,
+                      TaskNodes.q.creationTime.fieldName: self.getDateFromTimeStamp(element.creationTime),
+                      TaskNodes.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
+                      TaskNodes.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
+                      TaskNodes.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime),
+                      TaskNodes.q.maxAttempt.fieldName: element.maxAttempt,
+                      TaskNodes.q.archived.fieldName: False}
+            rows.append((TaskNodes.sqlmeta.table, fields))
+            for (toNode, statusList) in element.dependencies:
+                statusStringList = [str(i) for i in statusList]
+                fields = {Dependencies.q.toNodeId.fieldName: toNode.id,
+                          Dependencies.q.statusList.fieldName: ','.join(statusStringList),
+                          Dependencies.q.taskNodes.fieldName: element.id,
+                          Dependencies.q.folderNodes.fieldName: None,
+                          Dependencies.q.archived.fieldName: False}
+                rows.append((Dependencies.sqlmeta.table, fields))
+
+        # /////////////// Handling of the FolderNode
+        elif isinstance(element, FolderNode):
+            fields = {FolderNodes.q.id.fieldName: element.id,
+                      FolderNodes.q.name.fieldName: element.name,
+                      FolderNodes.q.parentId.fieldName: element.parent.id if element.parent else None,
+                      FolderNodes.q.user.fieldName: element.user,
+                      FolderNodes.q.priority.fieldName: element.priority,
+                      FolderNodes.q.dispatchKey.fieldName: element.dispatchKey,
+                      FolderNodes.q.maxRN.fieldName: element.maxRN,
+                      FolderNodes.q.taskGroupId.fieldName: element.taskGroup.id if element.taskGroup else None,
+                      FolderNodes.q.strategy.fieldName: element.strategy.getClassName(),
+                      FolderNodes.q.creationTime.fieldName: self.getDateFromTimeStamp(element.creationTime),
+                      FolderNodes.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
+                      FolderNodes.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
+                      FolderNodes.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime),
+                      FolderNodes.q.archived.fieldName: False}
+            rows.append((FolderNodes.sqlmeta.table, fields))
+            for (toNode, statusList) in element.dependencies:
+                statusStringList = [str(i) for i in statusList]
+                fields = {Dependencies.q.toNodeId.fieldName: toNode.id,
+                          Dependencies.q.statusList.fieldName: ','.join(statusStringList),
+                          Dependencies.q.taskNodes.fieldName: None,
+                          Dependencies.q.folderNodes.fieldName: element.id,
+                          Dependencies.q.archived.fieldName: False}
+                rows.append((Dependencies.sqlmeta.table, fields))
+
+        # /////////////// Handling of the TaskGroup
+        elif isinstance(element, TaskGroup):
+            fields = {TaskGroups.q.id.fieldName: element.id,
+                      TaskGroups.q.name.fieldName: element.name,
+                      TaskGroups.q.parentId.fieldName: element.parent.id if element.parent else None,
+                      TaskGroups.q.user.fieldName: element.user,
+                      TaskGroups.q.priority.fieldName: element.priority,
+                      TaskGroups.q.dispatchKey.fieldName: element.dispatchKey,
+                      TaskGroups.q.maxRN.fieldName: element.maxRN,
+                      TaskGroups.q.environment.fieldName: json.dumps(element.environment),
+                      TaskGroups.q.requirements.fieldName: json.dumps(element.requirements),
+                      TaskGroups.q.tags.fieldName: json.dumps(element.tags),
+                      TaskGroups.q.strategy.fieldName: element.strategy.getClassName(),
+                      TaskGroups.q.archived.fieldName: False,
+                      TaskGroups.q.args.fieldName: str(element.arguments)}
+            rows.append((TaskGroups.sqlmeta.table, fields))
+            for (rule, node) in element.nodes.iteritems():
+                fields = {Rules.q.name.fieldName: rule,
+                          Rules.q.taskNodeId.fieldName: None,
+                          Rules.q.folderNodeId.fieldName: node.id}
+                rows.append((Rules.sqlmeta.table, fields))
+
+        # /////////////// Handling of the Task
+        elif isinstance(element, Task):
+            fields = {Tasks.q.id.fieldName: element.id,
+                      Tasks.q.name.fieldName: element.name,
+                      Tasks.q.parentId.fieldName: element.parent.id if element.parent else None,
+                      Tasks.q.user.fieldName: element.user,
+                      Tasks.q.priority.fieldName: element.priority,
+                      Tasks.q.dispatchKey.fieldName: element.dispatchKey,
+                      Tasks.q.maxRN.fieldName: element.maxRN,
+                      Tasks.q.runner.fieldName: element.runner,
+                      Tasks.q.environment.fieldName: json.dumps(element.environment),
+                      Tasks.q.requirements.fieldName: json.dumps(element.requirements),
+                      Tasks.q.minNbCores.fieldName: element.minNbCores,
+                      Tasks.q.maxNbCores.fieldName: element.maxNbCores,
+                      Tasks.q.ramUse.fieldName: element.ramUse,
+                      Tasks.q.licence.fieldName: element.lic,
+                      Tasks.q.tags.fieldName: json.dumps(element.tags),
+                      Tasks.q.validationExpression.fieldName: element.validationExpression,
+                      Tasks.q.archived.fieldName: False,
+                      Tasks.q.args.fieldName: str(element.arguments),
+                      Tasks.q.maxAttempt.fieldName: element.maxAttempt,
+                      Tasks.q.runnerPackages.fieldName: json.dumps(element.runnerPackages),
+                      Tasks.q.watcherPackages.fieldName: json.dumps(element.watcherPackages)
+                      }
+            rows.append((Tasks.sqlmeta.table, fields))
+            for (rule, node) in element.nodes.iteritems():
+                fields = {Rules.q.name.fieldName: rule,
+                          Rules.q.taskNodeId.fieldName: node.id,
+                          Rules.q.folderNodeId.fieldName: None}
+                rows.append((Rules.sqlmeta.table, fields))
+
+        # /////////////// Handling of the Command
+        elif isinstance(element, Command):
+            fields = {Commands.q.id.fieldName: element.id,
+                      Commands.q.description.fieldName: element.description,
+                      Commands.q.taskId.fieldName: element.task.id,
+                      Commands.q.status.fieldName: element.status,
+                      Commands.q.completion.fieldName: element.completion,
+                      Commands.q.creationTime.fieldName: self.getDateFromTimeStamp(element.creationTime),
+                      Commands.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
+                      Commands.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
+                      Commands.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime),
+                      Commands.q.assignedRNId.fieldName: element.renderNode.id if element.renderNode else None,
+                      Commands.q.message.fieldName: element.message,
+                      Commands.q.stats.fieldName: str(element.stats),
+                      Commands.q.archived.fieldName: False,
+                      Commands.q.args.fieldName: str(element.arguments),
+                      Commands.q.attempt.fieldName: str(element.attempt),
+                      Commands.q.runnerPackages.fieldName: json.dumps(element.runnerPackages),
+                      Commands.q.watcherPackages.fieldName: json.dumps(element.watcherPackages)
+                      }
+            rows.append((Commands.sqlmeta.table, fields))
+
+        # /////////////// Handling of the RenderNode
+        elif isinstance(element, RenderNode):
+            fields = {RenderNodes.q.id.fieldName: element.id,
+                      RenderNodes.q.name.fieldName: element.name,
+                      RenderNodes.q.coresNumber.fieldName: element.coresNumber,
+                      RenderNodes.q.speed.fieldName: element.speed,
+                      RenderNodes.q.ip.fieldName: element.host,
+                      RenderNodes.q.port.fieldName: element.port,
+                      RenderNodes.q.ramSize.fieldName: element.ramSize,
+                      RenderNodes.q.caracteristics.fieldName: json.dumps(element.caracteristics),
+                      RenderNodes.q.performance.fieldName: element.performance}
+            rows.append((RenderNodes.sqlmeta.table, fields))
+
+        # /////////////// Handling of the Pool
+        elif isinstance(element, Pool):
+            fields = {Pools.q.id.fieldName: element.id,
+                      Pools.q.name.fieldName: element.name,
+                      Pools.q.archived.fieldName: False}
+            rows.append((Pools.sqlmeta.table, fields))
+            for renderNode in element.renderNodes:
+                rows.append((POOLS_RENDER_NODES, {'pools_id': element.id, 'render_nodes_id': renderNode.id}))
+
+        # /////////////// Handling of the PoolShare
+        elif isinstance(element, PoolShare):
+            fields = {PoolShares.q.id.fieldName: element.id,
+                      PoolShares.q.poolId.fieldName: element.pool.id,
+                      PoolShares.q.nodeId.fieldName: element.node.id,
+                      PoolShares.q.maxRN.fieldName: element.maxRN,
+                      PoolShares.q.archived.fieldName: False}
+            rows.append((PoolShares.sqlmeta.table, fields))
+        return rows
+
+    ## Returns the row to update for the provided element, as a (table name, fields) tuple, or None.
+    # @param element the element to update
+    #
+    def getUpdateRow(self, element):
+        # /////////////// Handling of the Command
+        if isinstance(element, Command):
+            fields = {Commands.q.status.fieldName: element.status,
+                      Commands.q.completion.fieldName: element.completion,
+                      Commands.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
+                      Commands.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
+                      Commands.q.stats.fieldName: str(element.stats),
+                      Commands.q.attempt.fieldName: str(element.attempt),
+                      Commands.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime)}
+            if element.renderNode:
+                fields[Commands.q.assignedRNId.fieldName] = element.renderNode.id
+            return (Commands.sqlmeta.table, fields)
+
+        # /////////////// Handling of the TaskNode
+        elif isinstance(element, TaskNode):
+            fields = {TaskNodes.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
+                      TaskNodes.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
+                      TaskNodes.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime),
+                      TaskNodes.q.maxAttempt.fieldName: str(element.maxAttempt)
+                      }
+            return (TaskNodes.sqlmeta.table, fields)
+
+        # /////////////// Handling of the FolderNode
+        elif isinstance(element, FolderNode):
+            fields = {FolderNodes.q.startTime.fieldName: self.getDateFromTimeStamp(element.startTime),
+                      FolderNodes.q.updateTime.fieldName: self.getDateFromTimeStamp(element.updateTime),
+                      FolderNodes.q.endTime.fieldName: self.getDateFromTimeStamp(element.endTime)}
+            return (FolderNodes.sqlmeta.table, fields)
+
+        # /////////////// Handling of the RenderNode
+        elif isinstance(element, RenderNode):
+            # fields = {RenderNodes.q.speed.fieldName: element.speed,
+                      # RenderNodes.q.coresNumber.fieldName: element.coresNumber,
+                      # RenderNodes.q.ramSize.fieldName: element.ramSize}
+                      # RenderNodes.q.caracteristics.fieldName: json.dumps(element.caracteristics),
+            fields = {RenderNodes.q.performance.fieldName: element.performance}
+            return (RenderNodes.sqlmeta.table, fields)
+
+        # /////////////// Handling of the Task
+        elif isinstance(element, Task):
+            # Simply update "tags" field to preserve comments in DB
+            # The model listener will only register this elem when "tags" field is updated
+            fields = {Tasks.q.tags.fieldName: json.dumps(element.tags),
+                      Tasks.q.maxAttempt.fieldName: str(element.maxAttempt)}
+            return (Tasks.sqlmeta.table, fields)
+
+        # /////////////// Handling of the TaskGroup
+        elif isinstance(element, TaskGroup):
+            # Simply update "tags" field to preserve comments in DB
+            # The model listener will only register this elem when "tags" field is updated
+            fields = {TaskGroups.q.tags.fieldName: json.dumps(element.tags)}
+            return (TaskGroups.sqlmeta.table, fields)
+        return None
+
+    ## Returns the rows to copy to the stat DB and the rows to delete from the DB to archive the provided element,
+    # as a ([(table name, fields)], [(table name, ((column, value), ...))]) tuple.
+    # @param element the element to archive
+    #
+    def getArchiveRows(self, element):
+        statRows = self.getCreationRows(element)
+        if not statRows:
+            return ([], [])
+        # the first row is the element itself, other rows (dependencies, rules) are archived as they are
+        table, fields = statRows[0]
+        if 'archived' in fields:
+            fields['archived'] = True
+        deletes = [(table, (('id', element.id),))]
+        if isinstance(element, TaskNode):
+            for (toNode, statusList) in element.dependencies:
+                deletes.append((Dependencies.sqlmeta.table, ((Dependencies.q.toNodeId.fieldName, toNode.id),
+                                                             (Dependencies.q.taskNodes.fieldName, element.id),
+                                                             (Dependencies.q.folderNodes.fieldName, None))))
+        elif isinstance(element, FolderNode):
+            for (toNode, statusList) in element.dependencies:
+                deletes.append((Dependencies.sqlmeta.table, ((Dependencies.q.toNodeId.fieldName, toNode.id),
+                                                             (Dependencies.q.taskNodes.fieldName, None),
+                                                             (Dependencies.q.folderNodes.fieldName, element.id))))
+        elif isinstance(element, TaskGroup):
+            for node in element.nodes.itervalues():
+                deletes.append((Rules.sqlmeta.table, ((Rules.q.folderNodeId.fieldName, node.id),)))
+        elif isinstance(element, Task):
+            for node in element.nodes.itervalues():
+                deletes.append((Rules.sqlmeta.table, ((Rules.q.taskNodeId.fieldName, node.id),)))
+        return (statRows, deletes)
+
+    ## Writes the batches left in the journal of the write-behind mode by the previous run.
+    #
+    def replayJournal(self):
+        prevTimer = time.time()
+        nbBatches = 0
+        for rows in self.journal.read():
             try:
-                if isinstance(element, Task):
-                    StatDB.archiveTask(self, element)
-                    conn = Tasks._connection
-                    conn.query(conn.sqlrepr(Delete(Tasks.q, where=(Tasks.q.id==element.id))))
-                    conn.cache.clear()
-                elif isinstance(element, TaskGroup):
-                    StatDB.archiveTaskGroup(self, element)
-                    conn = TaskGroups._connection
-                    conn.query(conn.sqlrepr(Delete(TaskGroups.q, where=(TaskGroups.q.id == element.id))))
-                    conn.cache.clear()
-                elif isinstance(element, Command):
-                    StatDB.archiveCommand(self, element)
-                    conn = Commands._connection
-                    conn.query(conn.sqlrepr(Delete(Commands.q, where=(Commands.q.id == element.id))))
-                    conn.cache.clear()
-                elif isinstance(element, TaskNode):
-                    StatDB.archiveTaskNode(self, element)
-                    conn = TaskNodes._connection
-                    conn.query(conn.sqlrepr(Delete(TaskNodes.q, where=(TaskNodes.q.id == element.id))))
-                    conn.cache.clear()
-                elif isinstance(element, FolderNode):
-                    StatDB.archiveFolderNode(self, element)
-                    conn = FolderNodes._connection
-                    conn.query(conn.sqlrepr(Delete(FolderNodes.q, where=(FolderNodes.q.id == element.id))))
-                    conn.cache.clear()
-                elif isinstance(element, Pool):
-                    StatDB.archivePool(self, element)
-                    conn = Pools._connection
-                    conn.query(conn.sqlrepr(Delete(Pools.q, where=(Pools.q.id == element.id))))
-                    conn.cache.clear()
-                elif isinstance(element, PoolShare):
-                    StatDB.archivePoolShare(self, element)
-                    conn = PoolShares._connection
-                    conn.query(conn.sqlrepr(Delete(PoolShares.q, where=(PoolShares.q.id == element.id))))
-                    conn.cache.clear()
-                elif isinstance(element, RenderNode):
-                    StatDB.archiveRenderNode(self, element)
-                    conn = RenderNodes._connection
-                    conn.query(conn.sqlrepr(Delete(RenderNodes.q, where=(RenderNodes.q.id == element.id))))
-                    conn.cache.clear()
+                self.writeRows(rows)
             except DuplicateEntryError:
-                LOGGER.warning(str(element) + " was not archived because it is already in the stat DB. Consider manual fix.")
+                # the batch was committed but the journal was not truncated yet
+                LOGGER.warning("  - batch %d of the journal was already written" % nbBatches)
+            nbBatches += 1
+        self.journal.truncate()
+        if nbBatches:
+            LOGGER.warning("Replayed %d batches from journal %s in %s" % (nbBatches, self.journal.path, elapsedTimeToString(prevTimer)))
 
     def getDateFromTimeStamp(self, timeStamp):
         return datetime.datetime.fromtimestamp(timeStamp) if timeStamp else None
@@ -592,577 +893,470 @@ class PuliDB(object):
     def getTimeStampFromDate(self, date):
         return time.mktime(date.timetuple()) if date else None
 
+    ## Starts a RowReader for the given select query.
+    # @param conn the connection of the table
+    # @param select the Select statement
+    #
+    def readRows(self, conn, select):
+        return RowReader(conn, conn.sqlrepr(select), singletonconfig.get('DB', 'RESTORE_FETCH_SIZE', default=5000))
+
+    ## Returns the rows to restore for each table, read from the database.
+    # All the queries are started at once, each reader only fetches a few batches ahead of the object creation.
+    #
+    def getDatabaseSources(self, rnsAlreadyLoaded):
+        sources = {}
+        if not rnsAlreadyLoaded:
+            sources[Pools.sqlmeta.table] = self.readRows(Pools._connection, Select(RESTORE_FIELDS[Pools.sqlmeta.table],
+                                                                                   where=(Pools.q.archived == False)))
+            sources[RenderNodes.sqlmeta.table] = self.readRows(RenderNodes._connection, Select(RESTORE_FIELDS[RenderNodes.sqlmeta.table]))
+            sources[POOLS_RENDER_NODES] = self.readRows(Pools._connection, Select(RESTORE_FIELDS[POOLS_RENDER_NODES]))
+        for dbClass in (FolderNodes, TaskNodes, PoolShares, Commands):
+            sources[dbClass.sqlmeta.table] = self.readRows(dbClass._connection, Select(RESTORE_FIELDS[dbClass.sqlmeta.table],
+                                                                                     where=(dbClass.q.archived == False)))
+        sources[Dependencies.sqlmeta.table] = self.readRows(Dependencies._connection, Select(RESTORE_FIELDS[Dependencies.sqlmeta.table]))
+        sources[Tasks.sqlmeta.table] = self.readRows(Tasks._connection, Select(RESTORE_FIELDS[Tasks.sqlmeta.table],
+                                                                               where=IN(Tasks.q.id, Select(TaskNodes.q.taskId, where=(TaskNodes.q.archived == False)))))
+        sources[TaskGroups.sqlmeta.table] = self.readRows(TaskGroups._connection, Select(RESTORE_FIELDS[TaskGroups.sqlmeta.table],
+                                                                                         where=IN(TaskGroups.q.id, Select(FolderNodes.q.taskGroupId, where=(FolderNodes.q.archived == False)))))
+        return sources
+
+    ## Returns the rows to restore for each table, read from the last checkpoint, or None if there is no usable
+    # checkpoint. The rows written since the checkpoint are applied by the checkpoint manager, the checkpoint
+    # is then checked against the database (@see checkDatabaseImage).
+    #
+    def getCheckpointSources(self, rnsAlreadyLoaded):
+        LOGGER.warning("Loading checkpoint")
+        image = self.checkpoints.load()
+        if image is None or not self.checkDatabaseImage(image, rnsAlreadyLoaded):
+            # the delta journals are useless without checkpoint, a new checkpoint will be written after the restore
+            self.checkpoints.reset()
+            return None
+        LOGGER.warning("  - restoring from checkpoint %d instead of the database" % image.generation)
+        taskIds = set(row[TaskNodes.q.taskId.fieldName] for row in image.iterRows(TaskNodes.sqlmeta.table))
+        taskGroupIds = set(row[FolderNodes.q.taskGroupId.fieldName] for row in image.iterRows(FolderNodes.sqlmeta.table))
+        sources = {}
+        for (table, fields) in RESTORE_FIELDS.iteritems():
+            sources[table] = image.iterTuples(table, [field.fieldName for field in fields])
+        sources[Tasks.sqlmeta.table] = image.iterTuples(Tasks.sqlmeta.table, [field.fieldName for field in RESTORE_FIELDS[Tasks.sqlmeta.table]], taskIds)
+        sources[TaskGroups.sqlmeta.table] = image.iterTuples(TaskGroups.sqlmeta.table, [field.fieldName for field in RESTORE_FIELDS[TaskGroups.sqlmeta.table]], taskGroupIds)
+        return sources
+
+    ## Compares the max id (high-water mark) and the number of rows of the tables to the rows of a checkpoint.
+    # The rows created in the database after the high-water mark of the checkpoint are read and added to it.
+    # @param image the DatabaseImage of the checkpoint
+    # @return False if the checkpoint does not match the database
+    #
+    def checkDatabaseImage(self, image, rnsAlreadyLoaded):
+        for (dbClass, archivedFilter, compareCount) in CHECKPOINT_CHECKS:
+            table = dbClass.sqlmeta.table
+            if rnsAlreadyLoaded and dbClass in (Pools, RenderNodes):
+                continue
+            conn = dbClass._connection
+            where = (dbClass.q.archived == False) if archivedFilter else None
+            maxId, count = conn.queryOne(conn.sqlrepr(Select([func.MAX(dbClass.q.id), func.COUNT(dbClass.q.id)], where=where)))
+            highWaterMark = image.getMaxId(table)
+            if maxId and maxId > highWaterMark:
+                newRows = dbClass.q.id > highWaterMark
+                rows = self.readRows(conn, Select(RESTORE_FIELDS[table], where=AND(where, newRows) if archivedFilter else newRows))
+                nbRows = image.addTuples(table, [field.fieldName for field in RESTORE_FIELDS[table]], rows)
+                LOGGER.warning("  - read %d rows of %s created after the checkpoint" % (nbRows, table))
+            if compareCount and image.getCount(table) != count:
+                LOGGER.warning("  - checkpoint ignored: %d rows in %s, %d rows in the checkpoint" % (count, table, image.getCount(table)))
+                return False
+        return True
+
+    ## Yields the rows of the elements of the tree, as they are stored in the database (@see checkpoint.py).
+    # The root node is not stored, the rules are not restored.
+    #
+    def getTreeRows(self, tree):
+        elements = chain(tree.pools.itervalues(),
+                         tree.renderNodes.itervalues(),
+                         (node for node in tree.nodes.itervalues() if node is not tree.root),
+                         tree.tasks.itervalues(),
+                         (command for command in tree.commands.itervalues() if command.task is not None),
+                         tree.poolShares.itervalues())
+        for element in elements:
+            for (table, fields) in self.getCreationRows(element):
+                if table != Rules.sqlmeta.table:
+                    yield (table, fields)
+
     ## Restores the state of the dispatcher from the database.
+    # Each table is read by a single query and the relations (pools of the rendernodes, dependencies, commands
+    # of the tasks...) are resolved in memory. The queries run in reader threads so that the rows are fetched
+    # while the objects of the previous tables are created.
+    # The model listeners of the tree are unregistered while the objects are created, the elements are then
+    # registered at once (@see DispatchTree.registerRestoredElements).
     # @var tree the DispatchTree instance.
     #
     def restoreStateFromDb(self, tree, rnsAlreadyLoaded):
         begintime = time.time()
         refreshDelay = singletonconfig.get('DB', 'REFRESH_DELAY', default=5)
+        timers = []
+
+        if self.journal is not None:
+            prevTimer = time.time()
+            self.replayJournal()
+            timers.append(("journal", time.time() - prevTimer))
+
+        sources = None
+        if self.checkpoints is not None:
+            prevTimer = time.time()
+            sources = self.getCheckpointSources(rnsAlreadyLoaded)
+            timers.append(("checkpoint", time.time() - prevTimer))
+        if sources is None:
+            sources = self.getDatabaseSources(rnsAlreadyLoaded)
+
+        poolsById = {}
+        rnById = {}
+        nodesById = {}
+        taskNodeTaskIds = []
+        folderNodeTaskGroupIds = []
+        poolShares = []
+        cmdTaskIdList = defaultdict(list)
+        commands = []
+        realTasksList = {}
+        realTaskGroupsList = {}
 
-        # reload the pools and rns from the database
-        LOGGER.warning("1/9 Reloading pools")
-        prevTimer = time.time()
-        tmpTimer = prevTimer
-
-        if not rnsAlreadyLoaded:
-            ### recreate the pools
-            poolsById = {}
-            poolConn = Pools._connection
-            poolFields = [Pools.q.id,
-                          Pools.q.name]
-            pools = poolConn.queryAll(poolConn.sqlrepr(Select(poolFields, where=(Pools.q.archived == False))))
-            for num, dbPool in enumerate(pools):
-                id, name = dbPool
-                realPool = Pool(id=id,
-                                name=name)
-                poolsById[id] = realPool
-
-            ### recreate the rendernodes
-            rnById = {}
-            conn = RenderNodes._connection
-            fields = [RenderNodes.q.id,
-                      RenderNodes.q.name,
-                      RenderNodes.q.coresNumber,
-                      RenderNodes.q.speed,
-                      RenderNodes.q.ip,
-                      RenderNodes.q.port,
-                      RenderNodes.q.ramSize,
-                      RenderNodes.q.caracteristics,
-                      RenderNodes.q.performance]
-            renderNodes = conn.queryAll(conn.sqlrepr(Select(fields)))
-
-            LOGGER.warning("  - sql query executed in %.3f s " % ((time.time()-prevTimer)))
-            nbElems = len(renderNodes)
-            LOGGER.warning("  - creating %d elems" % nbElems)
-
-            for num, dbRenderNode in enumerate(renderNodes):
-                id, name, coresNumber, speed, ip, port, ramSize, caracteristics, performance = dbRenderNode
-                realRenderNode = RenderNode(id,
-                                            name,
-                                            coresNumber,
-                                            speed,
-                                            ip,
-                                            port,
-                                            ramSize,
-                                            json.loads(caracteristics),
-                                            performance)
-                # get the pools of the rendernode
-                prn = Table('pools_render_nodes')
-                join = INNERJOINOn(None, Pools, Pools.q.id == prn.pools_id)
-                dbPools = poolConn.queryAll(poolConn.sqlrepr(Select(poolFields, join=join, where=AND(prn.render_nodes_id == id, Pools.q.archived == False))))
-                for idx, dbPool in enumerate(dbPools):
+        tree.unregisterModelListeners()
+        try:
+            # reload the pools and rns from the database
+            LOGGER.warning("1/9 Reloading pools")
+            prevTimer = time.time()
+            tmpTimer = prevTimer
+
+            if not rnsAlreadyLoaded:
+                ### recreate the pools
+                for dbPool in sources[Pools.sqlmeta.table]:
                     id, name = dbPool
-                    poolsById[id].renderNodes.append(realRenderNode)
-                    realRenderNode.pools.append(poolsById[id])
-                tree.renderNodes[str(realRenderNode.name)] = realRenderNode
-                rnById[realRenderNode.id] = realRenderNode
+                    poolsById[id] = Pool(id=id,
+                                         name=name)
+
+                ### recreate the rendernodes
+                for num, dbRenderNode in enumerate(sources[RenderNodes.sqlmeta.table]):
+                    id, name, coresNumber, speed, ip, port, ramSize, caracteristics, performance = dbRenderNode
+                    realRenderNode = RenderNode(id,
+                                                str(name),
+                                                coresNumber,
+                                                speed,
+                                                ip,
+                                                port,
+                                                ramSize,
+                                                json.loads(caracteristics),
+                                                performance)
+                    rnById[realRenderNode.id] = realRenderNode
+
+                    if (time.time() - tmpTimer) > refreshDelay:
+                        tmpTimer = time.time()
+                        LOGGER.warning("    - progress: %d elems" % num)
+
+                ### join the pools and the rendernodes, the rows of archived pools are ignored
+                for dbPoolRenderNode in sources[POOLS_RENDER_NODES]:
+                    poolId, renderNodeId = dbPoolRenderNode
+                    if poolId in poolsById and renderNodeId in rnById:
+                        poolsById[poolId].renderNodes.append(rnById[renderNodeId])
+                        rnById[renderNodeId].pools.append(poolsById[poolId])
+                LOGGER.warning("  - created %d pools and %d rendernodes" % (len(poolsById), len(rnById)))
+            else:
+                # pools and rns have already been processed, either from a file or a webservice
+                for pool in tree.pools.values():
+                    poolsById[pool.id] = pool
+                for rn in tree.renderNodes.values():
+                    rnById[rn.id] = rn
+
+            timers.append(("pools", time.time() - prevTimer))
+            LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+
+            ####### recreate the folder nodes with the correct ids
+            LOGGER.warning("2/9 Reloading folder nodes")
+            prevTimer = time.time()
+            tmpTimer = prevTimer
+
+            folderParents = []
+            for num, dbFolderNode in enumerate(sources[FolderNodes.sqlmeta.table]):
+                id, name, parentId, user, priority, dispatchKey, maxRN, taskGroupId, strategy, creationTime, startTime, updateTime, endTime = dbFolderNode
+                realFolder = FolderNode(id,
+                                        name,
+                                        None,
+                                        user,
+                                        priority,
+                                        dispatchKey,
+                                        maxRN,
+                                        createStrategyInstance(strategy),
+                                        self.getTimeStampFromDate(creationTime),
+                                        self.getTimeStampFromDate(startTime),
+                                        self.getTimeStampFromDate(updateTime),
+                                        self.getTimeStampFromDate(endTime))
+                nodesById[realFolder.id] = realFolder
+                folderParents.append((realFolder, parentId))
+                if taskGroupId:
+                    folderNodeTaskGroupIds.append((realFolder, int(taskGroupId)))
 
                 if (time.time() - tmpTimer) > refreshDelay:
                     tmpTimer = time.time()
-                    LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-
-            # add the pools to the dispatch tree
-            for pool in poolsById.values():
-                tree.pools[pool.name] = pool
-        else:
-            # pools and rns have already been processed, either from a file or a webservice
-            poolsById = {}
-            rnById = {}
-            for pool in tree.pools.values():
-                poolsById[pool.id] = pool
-            for rn in tree.renderNodes.values():
-                rnById[rn.id] = rn
-
-        LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
-
-        # print "%s -- rendernodes complete --" % (time.strftime('[%H:%M:%S]', time.gmtime(time.time() - begintime)))
-
-        ####### recreate the folder nodes with the correct ids
-        LOGGER.warning("2/9 Reloading folder nodes")
-        prevTimer = time.time()
-        tmpTimer = prevTimer
+                    LOGGER.warning("    - progress: %d elems" % num)
+            LOGGER.warning("  - created %d elems" % len(folderParents))
+            timers.append(("folder nodes", time.time() - prevTimer))
+            LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+
+            ### recreate the task nodes with the correct ids
+            LOGGER.warning("3/9 Reloading task nodes")
+            prevTimer = time.time()
+            tmpTimer = prevTimer
+
+            taskNodeParents = []
+            for num, dbTaskNode in enumerate(sources[TaskNodes.sqlmeta.table]):
+                id, name, parentId, user, priority, dispatchKey, maxRN, taskId, creationTime, startTime, updateTime, endTime, maxAttempt = dbTaskNode
+                realTaskNode = TaskNode(id,
+                                        name,
+                                        None,
+                                        user,
+                                        priority,
+                                        dispatchKey,
+                                        maxRN,
+                                        None,
+                                        self.getTimeStampFromDate(creationTime),
+                                        self.getTimeStampFromDate(startTime),
+                                        self.getTimeStampFromDate(updateTime),
+                                        self.getTimeStampFromDate(endTime),
+                                        maxAttempt=maxAttempt)
+                nodesById[realTaskNode.id] = realTaskNode
+                taskNodeParents.append((realTaskNode, parentId))
+                taskNodeTaskIds.append((realTaskNode, int(taskId)))
 
-        nodesById = {}
-        conn = FolderNodes._connection
-        fields = [FolderNodes.q.id,
-                  FolderNodes.q.name,
-                  FolderNodes.q.parentId,
-                  FolderNodes.q.user,
-                  FolderNodes.q.priority,
-                  FolderNodes.q.dispatchKey,
-                  FolderNodes.q.maxRN,
-                  FolderNodes.q.taskGroupId,
-                  FolderNodes.q.strategy,
-                  FolderNodes.q.creationTime,
-                  FolderNodes.q.startTime,
-                  FolderNodes.q.updateTime,
-                  FolderNodes.q.endTime,
-                  FolderNodes.q.archived]
-        folderNodes = conn.queryAll(conn.sqlrepr(Select(fields, where=(FolderNodes.q.archived == False))))
-
-        LOGGER.warning("  - sql query executed in %.3f s " % ((time.time()-prevTimer)))
-        nbElems = len(folderNodes)
-        LOGGER.warning("  - creating %d elems" % nbElems)
-        for num, dbFolderNode in enumerate(folderNodes):
-            id, name, parentId, user, priority, dispatchKey, maxRN, taskGroupId, strategy, creationTime, startTime, updateTime, endTime, archived = dbFolderNode
-            realFolder = FolderNode(id,
-                                    name,
-                                    None,
-                                    user,
-                                    priority,
-                                    dispatchKey,
-                                    maxRN,
-                                    createStrategyInstance(strategy),
-                                    self.getTimeStampFromDate(creationTime),
-                                    self.getTimeStampFromDate(startTime),
-                                    self.getTimeStampFromDate(updateTime),
-                                    self.getTimeStampFromDate(endTime))
-            nodesById[realFolder.id] = realFolder
-
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-        LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
-
-        # print "%s -- foldernodes complete --" % (time.strftime('[%H:%M:%S]', time.gmtime(time.time() - begintime)))
-
-        ### recreate the task nodes with the correct ids
-        LOGGER.warning("3/9 Reloading task nodes")
-        prevTimer = time.time()
-        tmpTimer = prevTimer
-
-        conn = TaskNodes._connection
-        fields = [TaskNodes.q.id,
-                  TaskNodes.q.name,
-                  TaskNodes.q.parentId,
-                  TaskNodes.q.user,
-                  TaskNodes.q.priority,
-                  TaskNodes.q.dispatchKey,
-                  TaskNodes.q.maxRN,
-                  TaskNodes.q.taskId,
-                  TaskNodes.q.creationTime,
-                  TaskNodes.q.startTime,
-                  TaskNodes.q.updateTime,
-                  TaskNodes.q.endTime,
-                  TaskNodes.q.archived,
-                  TaskNodes.q.maxAttempt]
-        taskNodes = conn.queryAll(conn.sqlrepr(Select(fields, where=(TaskNodes.q.archived == False))))
-
-        LOGGER.warning("  - sql query executed in %.3f s " % ((time.time()-prevTimer)))
-        nbElems = len(taskNodes)
-        LOGGER.warning("  - creating %d elems" % nbElems)
-        for num, dbTaskNode in enumerate(taskNodes):
-            id, name, parentId, user, priority, dispatchKey, maxRN, taskId, creationTime, startTime, updateTime, endTime, archived, maxAttempt = dbTaskNode
-            realTaskNode = TaskNode(id,
-                                    name,
-                                    None,
-                                    user,
-                                    priority,
-                                    dispatchKey,
-                                    maxRN,
-                                    None,
-                                    self.getTimeStampFromDate(creationTime),
-                                    self.getTimeStampFromDate(startTime),
-                                    self.getTimeStampFromDate(updateTime),
-                                    self.getTimeStampFromDate(endTime),
-                                    maxAttempt=maxAttempt)
-            nodesById[realTaskNode.id] = realTaskNode
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-        LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
-
-        ###### additional loops for nodes
-        LOGGER.warning("4/9 Reparenting folder and task nodes")
-
-        nbElems = len(folderNodes)
-        prevTimer = time.time()
-        tmpTimer = prevTimer
-
-        LOGGER.warning("  - parsing %d folder nodes" % nbElems)
-        for num, dbFolderNode in enumerate(folderNodes):
-            id, name, parentId, user, priority, dispatchKey, maxRN, taskGroupId, strategy, creationTime, startTime, updateTime, endTime, archived = dbFolderNode
-            # recreate the parents of the folder nodes
-            if parentId == 0:
-                nodesById[id].setParentValue(tree.nodes[0])
-            elif parentId:
-                nodesById[id].setParentValue(nodesById[parentId])
-            ### add the dependencies between the nodes
-            # TODO to be tested
-            conn = Dependencies._connection
-            fields = [Dependencies.q.toNodeId,
-                      Dependencies.q.statusList]
-            dependencies = conn.queryAll(conn.sqlrepr(Select(fields, where=(Dependencies.q.folderNodes == id))))
-            for idx, dbDependency in enumerate(dependencies):
-                toNodeId, statusList = dbDependency
-                statusIntList = [int(i) for i in statusList.split(",")]
+                if (time.time() - tmpTimer) > refreshDelay:
+                    tmpTimer = time.time()
+                    LOGGER.warning("    - progress: %d elems" % num)
+            LOGGER.warning("  - created %d elems" % len(taskNodeParents))
+            timers.append(("task nodes", time.time() - prevTimer))
+            LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+
+            ###### additional loops for nodes
+            LOGGER.warning("4/9 Reparenting folder and task nodes")
+            prevTimer = time.time()
+
+            # nodes whose parent is unknown are left without parent, they are attached to the root on registration
+            for node, parentId in folderParents:
+                if parentId == 0:
+                    node.setParentValue(tree.nodes[0])
+                elif parentId:
+                    node.setParentValue(nodesById[parentId])
+            for node, parentId in taskNodeParents:
+                if parentId == 0:
+                    node.setParentValue(tree.nodes[0])
+                elif parentId in nodesById:
+                    node.setParentValue(nodesById[parentId])
+
+            ### add the dependencies between the nodes, dependencies on unknown nodes are ignored
+            nbDependencies = 0
+            for dbDependency in sources[Dependencies.sqlmeta.table]:
+                toNodeId, statusList, folderNodeId, taskNodeId = dbDependency
+                node = nodesById.get(folderNodeId or taskNodeId)
+                if node is None or toNodeId not in nodesById:
+                    continue
+                node.addDependency(nodesById[toNodeId], [int(i) for i in statusList.split(",")])
+                nbDependencies += 1
+            LOGGER.warning("  - added %d dependencies" % nbDependencies)
+            timers.append(("reparenting", time.time() - prevTimer))
+            LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+
+            ### recreate the poolShares
+            LOGGER.warning("5/9 Reloading pool shares")
+            prevTimer = time.time()
+
+            for dbPoolShare in sources[PoolShares.sqlmeta.table]:
+                id, poolId, nodeId, maxRN = dbPoolShare
                 #FIXME temp
-                # nodesById[id].addDependency(nodesById[toNodeId], statusIntList)
-                if toNodeId in nodesById.keys():
-                    nodesById[id].addDependency(nodesById[toNodeId], statusIntList)
-
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100 * num / float(nbElems - 1)))
-
-        nbElems = len(taskNodes)
-        LOGGER.warning("  - parsing %d task nodes" % nbElems)
-        for num, dbTaskNode in enumerate(taskNodes):
-            id, name, parentId, user, priority, dispatchKey, maxRN, taskId, creationTime, startTime, updateTime, endTime, archived, maxAttempt = dbTaskNode
-            # recreate the parents of the task nodes
-            if parentId == 0:
-                nodesById[id].setParentValue(tree.nodes[0])
-            elif parentId in nodesById:
-                nodesById[id].setParentValue(nodesById[parentId])
-                ### add the dependencies between the nodes
-                conn = Dependencies._connection
-                fields = [Dependencies.q.toNodeId,
-                          Dependencies.q.statusList]
-                dependencies = conn.queryAll(conn.sqlrepr(Select(fields, where=(Dependencies.q.taskNodes == id))))
-                for idx, dbDependency in enumerate(dependencies):
-                    toNodeId, statusList = dbDependency
-                    statusIntList = [int(i) for i in statusList.split(",")]
-                    #FIXME temp
-                    if toNodeId in nodesById.keys():
-                        nodesById[id].addDependency(nodesById[toNodeId], statusIntList)
-
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-        LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
-
-        # print "%s -- add loop complete --" % (time.strftime('[%H:%M:%S]', time.gmtime(time.time() - begintime)))
-
-        ### recreate the poolShares
-        LOGGER.warning("5/9 Reloading pool shares")
-        prevTimer = time.time()
-        tmpTimer = prevTimer
-
-        conn = PoolShares._connection
-        fields = [PoolShares.q.id,
-                  PoolShares.q.poolId,
-                  PoolShares.q.nodeId,
-                  PoolShares.q.maxRN,
-                  PoolShares.q.archived]
-        poolShares = conn.queryAll(conn.sqlrepr(Select(fields, where=(PoolShares.q.archived == False))))
-
-        LOGGER.warning("  - sql query executed in %.3f s " % ((time.time()-prevTimer)))
-        nbElems = len(poolShares)
-        LOGGER.warning("  - creating %d elems" % nbElems)
-
-        for num, dbPoolShare in enumerate(poolShares):
-            id, poolId, nodeId, maxRN, archived = dbPoolShare
-            #FIXME temp
-            if nodeId in nodesById.keys():
-                realPoolShare = PoolShare(id,
-                                          poolsById[poolId],
-                                          nodesById[nodeId],
-                                          maxRN)
-            tree.poolShares[realPoolShare.id] = realPoolShare
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-        LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
-
-        ### recreate the commands
-        LOGGER.warning("6/9 Reloading commands (use 'mysqladmin -u root processlist' to check mysql workload)")
-        prevTimer = time.time()
-        tmpTimer = prevTimer
-
-        cmdTaskIdList = defaultdict(list)
-        cmdDict = {}
-        conn = Commands._connection
-        fields = [Commands.q.id,
-                  Commands.q.description,
-                  Commands.q.taskId,
-                  Commands.q.status,
-                  Commands.q.completion,
-                  Commands.q.creationTime,
-                  Commands.q.startTime,
-                  Commands.q.updateTime,
-                  Commands.q.endTime,
-                  Commands.q.assignedRNId,
-                  Commands.q.message,
-                  Commands.q.stats,
-                  Commands.q.archived,
-                  Commands.q.args,
-                  Commands.q.attempt,
-                  Commands.q.runnerPackages,
-                  Commands.q.watcherPackages
-                  ]
-        commands = conn.queryAll(conn.sqlrepr(Select(fields, where=(Commands.q.archived == False))))
-
-        LOGGER.warning("  - sql query executed in %.3f s " % ((time.time()-prevTimer)))
-        nbElems = len(commands)
-        LOGGER.warning("  - creating %d elems" % nbElems)
-
-        for num, dbCmd in enumerate(commands):
-            id, description, taskId, status, completion, creationTime, startTime, updateTime, endTime, assignedRNId, message, stats, archived, args, attempt, runnerPackages, watcherPackages = dbCmd
-            if args is None:
-                args = "{}"
-            if stats is None:
-                stats = "{}"
-            if runnerPackages is None:
-                runnerPackages = ""
-            if watcherPackages is None:
-                watcherPackages = ""
-
-            realCmd = Command(id,
-                              description,
-                              None,
-                              eval(args),
-                              status,
-                              completion,
-                              rnById.get(assignedRNId, None),
-                              self.getTimeStampFromDate(creationTime),
-                              self.getTimeStampFromDate(startTime),
-                              self.getTimeStampFromDate(updateTime),
-                              self.getTimeStampFromDate(endTime),
-                              attempt=attempt,
-                              stats=eval(stats),
-                              message=message,
-                              runnerPackages=json.loads(runnerPackages),
-                              watcherPackages=json.loads(watcherPackages))
-            if status in [2, 3, 4] and realCmd.renderNode is None:
-                print "%s -- invalid status for command %d, setting to READY" % (time.strftime('[%H:%M:%S]', time.gmtime(time.time() - begintime)), realCmd.id)
-                realCmd.status = 1
-                status = 1
-
-            assert not(status in [2, 3, 4] and realCmd.renderNode is None)
-            cmdTaskIdList[taskId].append(realCmd)
-            cmdDict[realCmd.id] = realCmd
-
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-        LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
-
-        ### recreate the tasks
-        LOGGER.warning("7/9 Reloading tasks")
-        prevTimer = time.time()
-        tmpTimer = prevTimer
-
-        realTasksList = {}
-        conn = Tasks._connection
-        fields = [Tasks.q.id,
-                  Tasks.q.name,
-                  Tasks.q.parentId,
-                  Tasks.q.user,
-                  Tasks.q.priority,
-                  Tasks.q.dispatchKey,
-                  Tasks.q.maxRN,
-                  Tasks.q.runner,
-                  Tasks.q.environment,
-                  Tasks.q.requirements,
-                  Tasks.q.minNbCores,
-                  Tasks.q.maxNbCores,
-                  Tasks.q.ramUse,
-                  Tasks.q.licence,
-                  Tasks.q.tags,
-                  Tasks.q.validationExpression,
-                  Tasks.q.archived,
-                  Tasks.q.args,
-                  Tasks.q.maxAttempt,
-                  Tasks.q.runnerPackages,
-                  Tasks.q.watcherPackages
-                  ]
-
-        tasks = conn.queryAll(conn.sqlrepr(Select(
-                  fields, where=(
-                      IN(Tasks.q.id, Select( TaskNodes.q.taskId, where=(TaskNodes.q.archived == False)))
-                    )
-                )))
-
-        LOGGER.warning("  - sql query executed in %.3f s " % ((time.time()-prevTimer)))
-        nbElems = len(tasks)
-        LOGGER.warning("  - creating %d elems" % nbElems)
-
-        for num, dbTask in enumerate(tasks):
-            id, name, parentId, user, priority, dispatchKey, maxRN, runner, environment, requirements, minNbCores, maxNbCores, ramUse, licence, tags, validationExpression, archived, args, maxAttempt, runnerPackages, watcherPackages = dbTask
-            taskCmds = []
-            if args is None:
-                args = '{}'
-            if runnerPackages is None:
-                runnerPackages = ""
-            if watcherPackages is None:
-                watcherPackages = ""
-
-            # get the commands associated to this task
-            taskCmds = cmdTaskIdList[id]
-            realTask = Task(id,
-                            name,
-                            None,
-                            user,
-                            maxRN,
-                            priority,
-                            dispatchKey,
-                            runner,
-                            eval(args),
-                            validationExpression,
-                            taskCmds,
-                            json.loads(requirements),
-                            minNbCores,
-                            maxNbCores,
-                            ramUse,
-                            json.loads(environment),
-                            {},
-                            licence,
-                            json.loads(tags),
-                            maxAttempt=maxAttempt,
-                            runnerPackages=json.loads(runnerPackages),
-                            watcherPackages=json.loads(watcherPackages))
-            tree.tasks[realTask.id] = realTask
-            realTasksList[realTask.id] = realTask
-            # set the task on the appropriate commands
-            for cmd in taskCmds:
-                cmd.task = realTask
-                #cmd.computeAvgTimeByFrame()
-                # update the command in the dispatch tree
-                tree.commands[cmd.id] = cmd
-                # if the command was last reported as running, reassign the rendernode in the model
-                if cmd.status == 3:
-                    cmd.renderNode.commands[cmd.id] = cmd
-                    cmd.renderNode.reserveLicense(cmd, self.licenseManager)
-                    cmd.renderNode.reserveRessources(cmd)
-
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-        LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
-
-        # print "%s -- tasks complete --" % (time.strftime('[%H:%M:%S]', time.gmtime(time.time() - begintime)))
-
-        ### recreate the taskGroups
-        LOGGER.warning("8/9 Reloading task groups")
-        prevTimer = time.time()
-        tmpTimer = prevTimer
+                if nodeId in nodesById:
+                    poolShares.append(PoolShare(id,
+                                                poolsById[poolId],
+                                                nodesById[nodeId],
+                                                maxRN))
+            LOGGER.warning("  - created %d elems" % len(poolShares))
+            timers.append(("pool shares", time.time() - prevTimer))
+            LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+
+            ### recreate the commands
+            LOGGER.warning("6/9 Reloading commands (use 'mysqladmin -u root processlist' to check mysql workload)")
+            prevTimer = time.time()
+            tmpTimer = prevTimer
+
+            for num, dbCmd in enumerate(sources[Commands.sqlmeta.table]):
+                id, description, taskId, status, completion, creationTime, startTime, updateTime, endTime, assignedRNId, message, stats, args, attempt, runnerPackages, watcherPackages = dbCmd
+                if args is None:
+                    args = "{}"
+                if stats is None:
+                    stats = "{}"
+                if runnerPackages is None:
+                    runnerPackages = ""
+                if watcherPackages is None:
+                    watcherPackages = ""
+
+                realCmd = Command(id,
+                                  description,
+                                  None,
+                                  eval(args),
+                                  status,
+                                  completion,
+                                  rnById.get(assignedRNId, None),
+                                  self.getTimeStampFromDate(creationTime),
+                                  self.getTimeStampFromDate(startTime),
+                                  self.getTimeStampFromDate(updateTime),
+                                  self.getTimeStampFromDate(endTime),
+                                  attempt=attempt,
+                                  stats=eval(stats),
+                                  message=message,
+                                  runnerPackages=json.loads(runnerPackages),
+                                  watcherPackages=json.loads(watcherPackages))
+                if status in [2, 3, 4] and realCmd.renderNode is None:
+                    print "%s -- invalid status for command %d, setting to READY" % (time.strftime('[%H:%M:%S]', time.gmtime(time.time() - begintime)), realCmd.id)
+                    realCmd.status = 1
+                    status = 1
+
+                assert not(status in [2, 3, 4] and realCmd.renderNode is None)
+                cmdTaskIdList[taskId].append(realCmd)
+                commands.append(realCmd)
+
+                # Log progress info
+                if (time.time() - tmpTimer) > refreshDelay:
+                    tmpTimer = time.time()
+                    LOGGER.warning("    - progress: %d elems" % num)
+            LOGGER.warning("  - created %d elems" % len(commands))
+            timers.append(("commands", time.time() - prevTimer))
+            LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+
+            ### recreate the tasks
+            LOGGER.warning("7/9 Reloading tasks")
+            prevTimer = time.time()
+            tmpTimer = prevTimer
+
+            taskParents = []
+            for num, dbTask in enumerate(sources[Tasks.sqlmeta.table]):
+                id, name, parentId, user, priority, dispatchKey, maxRN, runner, environment, requirements, minNbCores, maxNbCores, ramUse, licence, tags, validationExpression, args, maxAttempt, runnerPackages, watcherPackages = dbTask
+                if args is None:
+                    args = '{}'
+                if runnerPackages is None:
+                    runnerPackages = ""
+                if watcherPackages is None:
+                    watcherPackages = ""
+
+                # get the commands associated to this task
+                taskCmds = cmdTaskIdList[id]
+                realTask = Task(id,
+                                name,
+                                None,
+                                user,
+                                maxRN,
+                                priority,
+                                dispatchKey,
+                                runner,
+                                eval(args),
+                                validationExpression,
+                                taskCmds,
+                                json.loads(requirements),
+                                minNbCores,
+                                maxNbCores,
+                                ramUse,
+                                json.loads(environment),
+                                {},
+                                licence,
+                                json.loads(tags),
+                                maxAttempt=maxAttempt,
+                                runnerPackages=json.loads(runnerPackages),
+                                watcherPackages=json.loads(watcherPackages))
+                realTasksList[realTask.id] = realTask
+                taskParents.append((realTask, parentId))
+                # set the task on the appropriate commands
+                for cmd in taskCmds:
+                    cmd.task = realTask
+                    # if the command was last reported as running, reassign the rendernode in the model
+                    if cmd.status == 3:
+                        cmd.renderNode.commands[cmd.id] = cmd
+                        cmd.renderNode.reserveLicense(cmd, self.licenseManager)
+                        cmd.renderNode.reserveRessources(cmd)
+
+                # Log progress info
+                if (time.time() - tmpTimer) > refreshDelay:
+                    tmpTimer = time.time()
+                    LOGGER.warning("    - progress: %d elems" % num)
+            LOGGER.warning("  - created %d elems" % len(realTasksList))
+            timers.append(("tasks", time.time() - prevTimer))
+            LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+
+            ### recreate the taskGroups
+            LOGGER.warning("8/9 Reloading task groups")
+            prevTimer = time.time()
+            tmpTimer = prevTimer
+
+            taskGroupParents = []
+            for num, dbTaskGroup in enumerate(sources[TaskGroups.sqlmeta.table]):
+                id, name, parentId, user, priority, dispatchKey, maxRN, environment, requirements, tags, strategy, args = dbTaskGroup
+                if args is None:
+                    args = '{}'
+                realTaskGroup = TaskGroup(id,
+                                          name,
+                                          None,
+                                          user,
+                                          eval(args),
+                                          json.loads(environment),
+                                          json.loads(requirements),
+                                          maxRN,
+                                          priority,
+                                          dispatchKey,
+                                          createStrategyInstance(str(strategy)),
+                                          {},
+                                          json.loads(tags))
+                realTaskGroupsList[realTaskGroup.id] = realTaskGroup
+                taskGroupParents.append((realTaskGroup, parentId))
+
+                # Log progress info
+                if (time.time() - tmpTimer) > refreshDelay:
+                    tmpTimer = time.time()
+                    LOGGER.warning("    - progress: %d elems" % num)
+            LOGGER.warning("  - created %d elems" % len(realTaskGroupsList))
 
-        realTaskGroupsList = {}
-        conn = TaskGroups._connection
-        fields = [TaskGroups.q.id,
-                  TaskGroups.q.name,
-                  TaskGroups.q.parentId,
-                  TaskGroups.q.user,
-                  TaskGroups.q.priority,
-                  TaskGroups.q.dispatchKey,
-                  TaskGroups.q.maxRN,
-                  TaskGroups.q.environment,
-                  TaskGroups.q.requirements,
-                  TaskGroups.q.tags,
-                  TaskGroups.q.strategy,
-                  TaskGroups.q.archived,
-                  TaskGroups.q.args]
-        taskGroups = conn.queryAll(conn.sqlrepr(Select(fields, where=(
-                      IN( TaskGroups.q.id, Select( FolderNodes.q.taskGroupId, where=(FolderNodes.q.archived == False) ) )
-                      ))))
-        LOGGER.warning("  - sql query executed in %.3f s " % ((time.time()-prevTimer)))
-        nbElems = len(taskGroups)
-        LOGGER.warning("  - creating %d elems" % nbElems)
-
-        for num, dbTaskGroup in enumerate(taskGroups):
-            id, name, parentId, user, priority, dispatcherKey, maxRN, environment, requirements, tags, strategy, archived, args = dbTaskGroup
-            if args is None:
-                args = '{}'
-            realTaskGroup = TaskGroup(id,
-                                      name,
-                                      None,
-                                      user,
-                                      eval(args),
-                                      json.loads(environment),
-                                      json.loads(requirements),
-                                      maxRN,
-                                      priority,
-                                      dispatchKey,
-                                      createStrategyInstance(str(strategy)),
-                                      {},
-                                      json.loads(tags))
-            realTaskGroupsList[realTaskGroup.id] = realTaskGroup
-
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-
-        # set the parents of the taskGroups
-        nbElems = len(taskGroups)
-        LOGGER.warning("  - parsing %d task groups" % nbElems)
-
-        for num, dbTaskGroup in enumerate(taskGroups):
-            id, name, parentId, user, priority, dispatcherKey, maxRN, environment, requirements, tags, strategy, archived, args = dbTaskGroup
-            if parentId:
+            # set the parents of the taskGroups and of the tasks
+            for taskGroup, parentId in taskGroupParents:
                 #FIXME: try to avoid pb when reloading DB with inconsistencies
-                if int(parentId) in realTaskGroupsList.keys():
-                    realTaskGroupsList[int(parentId)].addTask(realTaskGroupsList[int(id)])
-                    realTaskGroupsList[int(id)].parent = realTaskGroupsList[int(parentId)]
-
-            tree.tasks[int(id)] = realTaskGroupsList[int(id)]
-
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-
-        # set the parents of the tasks
-        nbElems = len(tasks)
-        LOGGER.warning("  - parsing %d tasks" % nbElems)
-        for num, dbTask in enumerate(tasks):
-            id, name, parentId, user, priority, dispatchKey, maxRN, runner, environment, requirements, minNbCores, maxNbCores, ramUse, licence, tags, validationExpression, archived, args, maxAttempt, runnerPackages, watcherPackages = dbTask
-            if parentId:
+                if parentId and int(parentId) in realTaskGroupsList:
+                    realTaskGroupsList[int(parentId)].addTask(taskGroup)
+                    taskGroup.parent = realTaskGroupsList[int(parentId)]
+            for task, parentId in taskParents:
                 #FIXME temp
-                if int(parentId) in realTaskGroupsList.keys():
-                    realTaskGroupsList[int(parentId)].addTask(realTasksList[int(id)])
-                    realTasksList[int(id)].parent = realTaskGroupsList[int(parentId)]
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-
-        # print "%s -- taskgroups complete --" % (time.strftime('[%H:%M:%S]', time.gmtime(time.time() - begintime)))
-
-        ### affect the task objects to the corresponding TaskNodes
-        nbElems = len(taskNodes)
-        LOGGER.warning("  - affecting task to %d task nodes" % nbElems)
-        for num, dbTaskNode in enumerate(taskNodes):
-            id, name, parentId, user, priority, dispatchKey, maxRN, taskId, creationTime, startTime, updateTime, endTime, archived, maxAttempt = dbTaskNode
-            # set the real task
-            dbTaskNodeId = int(id)
-            if dbTaskNodeId in nodesById.keys() and int(taskId) in realTasksList.keys():
-                nodesById[dbTaskNodeId].task = realTasksList[int(taskId)]
-                # get the correct task in the dispatchtree and append the node to the dict of nodes
-                tree.tasks[nodesById[dbTaskNodeId].task.id].nodes["graph_rule"] = nodesById[dbTaskNodeId]
-                tree.nodes[dbTaskNodeId] = nodesById[dbTaskNodeId]
-
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-
-        # print "%s -- affect task complete --" % (time.strftime('[%H:%M:%S]', time.gmtime(time.time() - begintime)))
-        ### affect the taskGroup objects to the corresponding FolderNodes
-        nbElems = len(folderNodes)
-        LOGGER.warning("  - affecting task groups to %d folder nodes" % nbElems)
-        for num, dbFolderNode in enumerate(folderNodes):
-            id, name, parentId, user, priority, dispatchKey, maxRN, taskGroupId, strategy, creationTime, startTime, updateTime, endTime, archived = dbFolderNode
-            if taskGroupId:
-                tgId = int(taskGroupId)
+                if parentId and int(parentId) in realTaskGroupsList:
+                    realTaskGroupsList[int(parentId)].addTask(task)
+                    task.parent = realTaskGroupsList[int(parentId)]
+
+            ### affect the task objects to the corresponding TaskNodes
+            for node, taskId in taskNodeTaskIds:
+                if taskId in realTasksList:
+                    node.task = realTasksList[taskId]
+                    node.task.nodes["graph_rule"] = node
+                    tree.nodes[node.id] = node
+
+            ### affect the taskGroup objects to the corresponding FolderNodes
+            for node, taskGroupId in folderNodeTaskGroupIds:
                 #FIXME temp
-                if tgId in tree.tasks.keys():
-                    nodesById[int(id)].taskGroup = tree.tasks[tgId]
-                    tree.tasks[tgId].nodes["graph_rule"] = nodesById[int(id)]
-            tree.nodes[int(id)] = nodesById[int(id)]
-            # Log progress info
-            if (time.time() - tmpTimer) > refreshDelay:
-                tmpTimer = time.time()
-                LOGGER.warning("    - progress: %d%%" % (100*num/float(nbElems-1)))
-        LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+                if taskGroupId in realTaskGroupsList:
+                    node.taskGroup = realTaskGroupsList[taskGroupId]
+                    node.taskGroup.nodes["graph_rule"] = node
+            for node, parentId in folderParents:
+                tree.nodes[node.id] = node
+            timers.append(("task groups", time.time() - prevTimer))
+            LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(prevTimer))
+        finally:
+            tree.registerModelListeners()
+
+        prevTimer = time.time()
+        if not rnsAlreadyLoaded:
+            tree.registerRestoredElements(pools=poolsById.values(), renderNodes=rnById.values())
+        tree.registerRestoredElements(nodes=nodesById.values(),
+                                      tasks=realTaskGroupsList.values() + realTasksList.values(),
+                                      commands=commands,
+                                      poolShares=poolShares)
+        timers.append(("registration", time.time() - prevTimer))
 
         # calculate the average time by frame
-        LOGGER.warning("9/9 Computing avg time and max ids")
+        LOGGER.warning("9/9 Computing avg time")
         startTimer = time.time()
         prevTimer = time.time()
 
@@ -1170,91 +1364,22 @@ class PuliDB(object):
             cmd.computeAvgTimeByFrame()
 
         LOGGER.warning("  - Average time by frame recomputed in %.3f s" % (time.time()-prevTimer))
+        timers.append(("avg time", time.time() - prevTimer))
 
-        ### calculate the correct max ids for all elements, get them from db in case of archived elements that would not appear in the dispatchtree
-        prevTimer = time.time()
-        statConn = StatDB.createConnection()
-        try:
-            folderConn = FolderNodes._connection
-            taskConn = TaskNodes._connection
-            FolderNodes._connection = statConn
-            TaskNodes._connection = statConn
-            #adding 0 to max([...]) to avoid TypeError if stat table is empty
-            statMaxId = int(max([FolderNodes.select().max(FolderNodes.q.id), TaskNodes.select().max(TaskNodes.q.id), 0]))
-            FolderNodes._connection = folderConn
-            TaskNodes._connection = taskConn
-            tree.nodeMaxId = int(max([FolderNodes.select().max(FolderNodes.q.id), TaskNodes.select().max(TaskNodes.q.id), statMaxId]))
-        except:
-            tree.nodeMaxId = 0
-        LOGGER.warning("  - Set max id for nodes in %.3f s" % (time.time()-prevTimer))
-
-        prevTimer = time.time()
-        try:
-            conn = Pools._connection
-            Pools._connection = statConn
-            #adding 0 to max([...]) to avoid TypeError if stat table is empty
-            statMaxId = int(max([Pools.select().max(Pools.q.id),0]))
-            Pools._connection = conn
-            tree.poolMaxId = int(max([Pools.select().max(Pools.q.id), statMaxId]))
-        except:
-            tree.poolMaxId = 0
-        LOGGER.warning("  - Set max id for pools in %.3f s" % (time.time()-prevTimer))
-
-        prevTimer = time.time()
-        try:
-            conn = RenderNodes._connection
-            RenderNodes._connection = statConn
-            #adding 0 to max([...]) to avoid TypeError if stat table is empty
-            statMaxId = int(max([RenderNodes.select().max(RenderNodes.q.id),0]))
-            RenderNodes._connection = conn
-            tree.renderNodeMaxId = int(max([RenderNodes.select().max(RenderNodes.q.id),statMaxId ]))
-        except:
-            tree.renderNodeMaxId = 0
-        LOGGER.warning("  - Set max id for render nodes in %.3f s" % (time.time()-prevTimer))
-
-        prevTimer = time.time()
-        try:
-            taskConn = Tasks._connection
-            taskGroupConn = TaskGroups._connection
-            Tasks._connection = statConn
-            TaskGroups._connection = statConn
-            #adding 0 to max([...]) to avoid TypeError if stat table is empty
-            statMaxId = int(max([Tasks.select().max(Tasks.q.id), TaskGroups.select().max(TaskGroups.q.id),0]))
-            Tasks._connection = taskConn
-            TaskGroups._connection = taskGroupConn
-            tree.taskMaxId = int(max([Tasks.select().max(Tasks.q.id), TaskGroups.select().max(TaskGroups.q.id), statMaxId ]))
-        except:
-            tree.taskMaxId = 0
-        LOGGER.warning("  - Set max id for tasks in %.3f s" % (time.time()-prevTimer))
-
-        prevTimer = time.time()
-        try:
-            conn = Commands._connection
-            Commands._connection = statConn
-            #adding 0 to max([...]) to avoid TypeError if stat table is empty
-            statMaxId = int(max([Commands.select().max(Commands.q.id),0]))
-            Commands._connection = conn
-            tree.commandMaxId = int(max([Commands.select().max(Commands.q.id),statMaxId ]))
-        except:
-            tree.commandMaxId = 0
-        LOGGER.warning("  - Set max id for commands in %.3f s" % (time.time()-prevTimer))
-
-        prevTimer = time.time()
-        try:
-            conn = PoolShares._connection
-            PoolShares._connection = statConn
-            #adding 0 to max([...]) to avoid TypeError if stat table is empty
-            statMaxId = int(max([PoolShares.select().max(PoolShares.q.id),0]))
-            PoolShares._connection = conn
-            tree.poolShareMaxId = int(max([PoolShares.select().max(PoolShares.q.id),statMaxId ]))
-        except:
-            tree.poolShareMaxId = 0
-        LOGGER.warning("  - Set max id for pool shares in %.3f s" % (time.time()-prevTimer))
+        # max ids are not queried anymore: the id allocators of the tree already know the ids of the archived
+        # elements (@see DispatchTree.initIdAllocators) and observed the ids of every reloaded element
+        LOGGER.warning("  - Max ids: nodes=%d tasks=%d commands=%d" % (tree.nodeIds.maxId, tree.taskIds.maxId, tree.commandIds.maxId))
         LOGGER.warning("  - elapsed time %s" % elapsedTimeToString(startTimer))
+        LOGGER.warning("  - restore timings: %s" % ", ".join("%s=%.3fs" % timer for timer in timers))
 
         tree.toCreateElements = []
 
 class StatDB():
+    # the connection to the stat DB is created once and shared, sqlobject keeps a pool of the underlying
+    # DB-API connections for the threads using it
+    connection = None
+    connectionLock = Lock()
+
     @staticmethod
     def createConnection():
         from octopus.dispatcher import settings
@@ -1262,205 +1387,19 @@ class StatDB():
         return connectionForURI(settings.STAT_DB_URL)
 
     @staticmethod
-    def archiveTaskNode(pulidb, element):
-        conn = StatDB.createConnection()
-        fields = {TaskNodes.q.id.fieldName: element.id,
-                  TaskNodes.q.name.fieldName: element.name,
-                  TaskNodes.q.parentId.fieldName: element.parent.id if element.parent else None,
-                  TaskNodes.q.user.fieldName: element.user,
-                  TaskNodes.q.priority.fieldName: element.priority,
-                  TaskNodes.q.dispatchKey.fieldName: element.dispatchKey,
-                  TaskNodes.q.maxRN.fieldName: element.maxRN,
-                  TaskNodes.q.taskId.fieldName: element.task.id,
-                  TaskNodes.q.creationTime.fieldName: pulidb.getDateFromTimeStamp(element.creationTime),
-                  TaskNodes.q.startTime.fieldName: pulidb.getDateFromTimeStamp(element.startTime),
-                  TaskNodes.q.updateTime.fieldName: pulidb.getDateFromTimeStamp(element.updateTime),
-                  TaskNodes.q.endTime.fieldName: pulidb.getDateFromTimeStamp(element.endTime),
-                  TaskNodes.q.maxAttempt.fieldName: element.maxAttempt,
-                  TaskNodes.q.archived.fieldName: True}
-        conn.query(conn.sqlrepr(Insert(TaskNodes.q, values=fields)))
-        conn.cache.clear()
-        if element.dependencies:
-            for (toNode, statusList) in element.dependencies:
-                statusStringList = [str(i) for i in statusList]
-                fields = {Dependencies.q.toNodeId.fieldName: toNode.id,
-                          Dependencies.q.statusList.fieldName: ','.join(statusStringList),
-                          Dependencies.q.taskNodes.fieldName: element.id,
-                          Dependencies.q.folderNodes.fieldName: None,
-                          Dependencies.q.archived.fieldName: False}
-                conn.query(conn.sqlrepr(Insert(Dependencies.q, values=fields)))
-                Dependencies._connection.query(conn.sqlrepr(Delete(Dependencies.q, where=AND(
-                    Dependencies.q.toNodeId==toNode.id,
-                    Dependencies.q.taskNodes==element.id,
-                    Dependencies.q.folderNodes==None))))
-                Dependencies._connection.cache.clear()
-
-    @staticmethod
-    def archiveFolderNode(pulidb, element):
-        conn = StatDB.createConnection()
-        fields = {FolderNodes.q.id.fieldName: element.id,
-                  FolderNodes.q.name.fieldName: element.name,
-                  FolderNodes.q.parentId.fieldName: element.parent.id if element.parent else None,
-                  FolderNodes.q.user.fieldName: element.user,
-                  FolderNodes.q.priority.fieldName: element.priority,
-                  FolderNodes.q.dispatchKey.fieldName: element.dispatchKey,
-                  FolderNodes.q.maxRN.fieldName: element.maxRN,
-                  FolderNodes.q.taskGroupId.fieldName: element.taskGroup.id if element.taskGroup else None,
-                  FolderNodes.q.strategy.fieldName: element.strategy.getClassName(),
-                  FolderNodes.q.creationTime.fieldName: pulidb.getDateFromTimeStamp(element.creationTime),
-                  FolderNodes.q.startTime.fieldName: pulidb.getDateFromTimeStamp(element.startTime),
-                  FolderNodes.q.updateTime.fieldName: pulidb.getDateFromTimeStamp(element.updateTime),
-                  FolderNodes.q.endTime.fieldName: pulidb.getDateFromTimeStamp(element.endTime),
-                  FolderNodes.q.archived.fieldName: True}
-        conn.query(conn.sqlrepr(Insert(FolderNodes.q, values=fields)))
-        conn.cache.clear()
-        if element.dependencies:
-            for (toNode, statusList) in element.dependencies:
-                statusStringList = [str(i) for i in statusList]
-                fields = {Dependencies.q.toNodeId.fieldName: toNode.id,
-                          Dependencies.q.statusList.fieldName: ','.join(statusStringList),
-                          Dependencies.q.taskNodes.fieldName: None,
-                          Dependencies.q.folderNodes.fieldName: element.id,
-                          Dependencies.q.archived.fieldName: False}
-                conn.query(conn.sqlrepr(Insert(Dependencies.q, values=fields)))
-                conn.cache.clear()
-                Dependencies._connection.query(conn.sqlrepr(Delete(Dependencies.q, where=AND(
-                    Dependencies.q.toNodeId==toNode.id,
-                    Dependencies.q.taskNodes==None,
-                    Dependencies.q.folderNodes==element.id))))
-                Dependencies._connection.cache.clear()
-
-    @staticmethod
-    def archiveTaskGroup(pulidb, element):
-        conn = StatDB.createConnection()
-        fields = {TaskGroups.q.id.fieldName: element.id,
-                  TaskGroups.q.name.fieldName: element.name,
-                  TaskGroups.q.parentId.fieldName: element.parent.id if element.parent else None,
-                  TaskGroups.q.user.fieldName: element.user,
-                  TaskGroups.q.priority.fieldName: element.priority,
-                  TaskGroups.q.dispatchKey.fieldName: element.dispatchKey,
-                  TaskGroups.q.maxRN.fieldName: element.maxRN,
-                  TaskGroups.q.environment.fieldName: json.dumps(element.environment),
-                  TaskGroups.q.requirements.fieldName: json.dumps(element.requirements),
-                  TaskGroups.q.tags.fieldName: json.dumps(element.tags),
-                  TaskGroups.q.strategy.fieldName: element.strategy.getClassName(),
-                  TaskGroups.q.archived.fieldName: True,
-                  TaskGroups.q.args.fieldName: str(element.arguments)}
-        conn.query(conn.sqlrepr(Insert(TaskGroups.q, values=fields)))
-        conn.cache.clear()
-        for (rule, node) in element.nodes.iteritems():
-            fields = {Rules.q.name.fieldName: rule,
-                      Rules.q.taskNodeId.fieldName: None,
-                      Rules.q.folderNodeId.fieldName: node.id}
-            conn.query(conn.sqlrepr(Insert(Rules.q, values=fields)))
-            conn.cache.clear()
-            Rules._connection.query(conn.sqlrepr(Delete(Rules.q, where=(Rules.q.folderNodeId==node.id))))
-            Rules._connection.cache.clear()
-
-    @staticmethod
-    def archiveTask(pulidb, element):
-        conn = StatDB.createConnection()
-        fields = {Tasks.q.id.fieldName: element.id,
-                  Tasks.q.name.fieldName: element.name,
-                  Tasks.q.parentId.fieldName: element.parent.id if element.parent else None,
-                  Tasks.q.user.fieldName: element.user,
-                  Tasks.q.priority.fieldName: element.priority,
-                  Tasks.q.dispatchKey.fieldName: element.dispatchKey,
-                  Tasks.q.maxRN.fieldName: element.maxRN,
-                  Tasks.q.runner.fieldName: element.runner,
-                  Tasks.q.environment.fieldName: json.dumps(element.environment),
-                  Tasks.q.requirements.fieldName: json.dumps(element.requirements),
-                  Tasks.q.minNbCores.fieldName: element.minNbCores,
-                  Tasks.q.maxNbCores.fieldName: element.maxNbCores,
-                  Tasks.q.ramUse.fieldName: element.ramUse,
-                  Tasks.q.licence.fieldName: element.lic,
-                  Tasks.q.tags.fieldName: json.dumps(element.tags),
-                  Tasks.q.validationExpression.fieldName: element.validationExpression,
-                  Tasks.q.archived.fieldName: True,
-                  Tasks.q.args.fieldName: str(element.arguments),
-                  Tasks.q.maxAttempt.fieldName: element.maxAttempt,
-                  Tasks.q.runnerPackages.fieldName: json.dumps(element.runnerPackages),
-                  Tasks.q.watcherPackages.fieldName: json.dumps(element.watcherPackages)
-                  }
-        conn.query(conn.sqlrepr(Insert(Tasks.q, values=fields)))
-        conn.cache.clear()
-        for (rule, node) in element.nodes.iteritems():
-            fields = {Rules.q.name.fieldName: rule,
-                      Rules.q.taskNodeId.fieldName: None,
-                      Rules.q.folderNodeId.fieldName: node.id}
-            conn.query(conn.sqlrepr(Insert(Rules.q, values=fields)))
-            conn.cache.clear()
-            Rules._connection.query(conn.sqlrepr(Delete(Rules.q, where=(Rules.q.folderNodeId == node.id))))
-            Rules._connection.cache.clear()
-
-    @staticmethod
-    def archiveCommand(pulidb, element):
-        conn = StatDB.createConnection()
-        fields = {Commands.q.id.fieldName: element.id,
-                  Commands.q.description.fieldName: element.description,
-                  Commands.q.taskId.fieldName: element.task.id,
-                  Commands.q.status.fieldName: element.status,
-                  Commands.q.completion.fieldName: element.completion,
-                  Commands.q.creationTime.fieldName: pulidb.getDateFromTimeStamp(element.creationTime),
-                  Commands.q.startTime.fieldName: pulidb.getDateFromTimeStamp(element.startTime),
-                  Commands.q.updateTime.fieldName: pulidb.getDateFromTimeStamp(element.updateTime),
-                  Commands.q.endTime.fieldName: pulidb.getDateFromTimeStamp(element.endTime),
-                  Commands.q.assignedRNId.fieldName: element.renderNode.id if element.renderNode else None,
-                  Commands.q.message.fieldName: element.message,
-                  Commands.q.stats.fieldName: str(element.stats),
-                  Commands.q.archived.fieldName: True,
-                  Commands.q.args.fieldName: str(element.arguments),
-                  Commands.q.attempt.fieldName: str(element.attempt),
-                  Commands.q.runnerPackages.fieldName: json.dumps(element.runnerPackages),
-                  Commands.q.watcherPackages.fieldName: json.dumps(element.watcherPackages)
-                  }
-        conn.query(conn.sqlrepr(Insert(Commands.q, values=fields)))
-
-
-
-    @staticmethod
-    def archiveRenderNode(pulidb, element):
-        conn = StatDB.createConnection()
-        fields = {RenderNodes.q.id.fieldName: element.id,
-                  RenderNodes.q.name.fieldName: element.name,
-                  RenderNodes.q.coresNumber.fieldName: element.coresNumber,
-                  RenderNodes.q.speed.fieldName: element.speed,
-                  RenderNodes.q.ip.fieldName: element.host,
-                  RenderNodes.q.port.fieldName: element.port,
-                  RenderNodes.q.ramSize.fieldName: element.ramSize,
-                  RenderNodes.q.caracteristics.fieldName: json.dumps(element.caracteristics),
-                  RenderNodes.q.performance.fieldName: element.performance}
-        conn.query(conn.sqlrepr(Insert(RenderNodes.q, values=fields)))
-        conn.cache.clear()
-
-
-    @staticmethod
-    def archivePool(pulidb, element):
-        conn = StatDB.createConnection()
-        fields = {Pools.q.id.fieldName: element.id,
-                  Pools.q.name.fieldName: element.name,
-                  Pools.q.archived.fieldName: True}
-        conn.query(conn.sqlrepr(Insert(Pools.q, values=fields)))
-        conn.cache.clear()
-
-    @staticmethod
-    def archivePoolShare(pulidb, element):
-        conn = StatDB.createConnection()
-        fields = {PoolShares.q.id.fieldName: element.id,
-                  PoolShares.q.poolId.fieldName: element.pool.id,
-                  PoolShares.q.nodeId.fieldName: element.node.id,
-                  PoolShares.q.maxRN.fieldName: element.maxRN,
-                  PoolShares.q.archived.fieldName: True}
-        conn.query(conn.sqlrepr(Insert(PoolShares.q, values=fields)))
+    def getConnection():
+        if StatDB.connection is None:
+            with StatDB.connectionLock:
+                if StatDB.connection is None:
+                    StatDB.connection = StatDB.createConnection()
+        return StatDB.connection
 
     @staticmethod
     def getMaxID(Table):
-        conn = Table._connection
-        Table._connection = StatDB.createConnection()
-        result = Table.select().max(Table.q.id)
-        Table._connection = conn
-        if result:
-            return int(result)
+        conn = StatDB.getConnection()
+        result = conn.queryOne(conn.sqlrepr(Select(func.MAX(Table.q.id))))
+        if result and result[0]:
+            return int(result[0])
         return 0
 
     @staticmethod
@@ -0,0 +1,151 @@
+"""
+Write-behind persistence of the dispatcher model.
+
+The rows returned by PuliDB.getRows for each iteration are appended to a local journal and queued to a
+PersistenceThread, which writes them to the database with its own connection. The main iteration only
+waits when the queue is full. A batch which cannot be written is retried until it succeeds before the next
+one is taken, so that the batches reach the database in order. Batches still in the journal when the dispatcher stops (i.e. not written
+yet) are written again at startup by PuliDB.restoreStateFromDb.
+"""
+
+from __future__ import with_statement
+
+import cPickle
+import logging
+import os
+from Queue import Queue, Full
+from threading import Thread, Lock, Event
+
+from sqlobject import connectionForURI, sqlhub
+
+
+LOGGER = logging.getLogger('main.dispatcher')
+
+# delays between two attempts to write a failed batch (in seconds)
+MIN_RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+
+class Journal(object):
+    '''
+    Append-only file holding the batches of rows not written to the database yet.
+    Batches are synced to disk unless sync is False.
+    '''
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(path, 'ab')
+
+    def append(self, rows):
+        cPickle.dump(rows, self.file, cPickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def truncate(self):
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.flush()
+
+    def read(self):
+        '''
+        Yields the batches of the journal, stops at the first incomplete batch (i.e. at a crash while appending).
+        '''
+        with open(self.path, 'rb') as journalFile:
+            while True:
+                try:
+                    yield cPickle.load(journalFile)
+                except EOFError:
+                    return
+                except Exception:
+                    LOGGER.warning("Ignoring incomplete batch at the end of journal %s" % self.path)
+                    return
+
+    def close(self):
+        self.file.close()
+
+
+class PersistenceThread(Thread):
+    '''
+    Writes the batches of rows pushed by the main iteration to the database.
+    The journal is truncated each time every journaled batch has been written. A failed batch is retried
+    with an increasing delay, the next batches wait in the queue (and the main iteration blocks once it is
+    full) until it is written.
+    '''
+
+    def __init__(self, pulidb, journal, dbUrl, queueSize):
+        Thread.__init__(self, name='PersistenceThread')
+        self.daemon = True
+        self.pulidb = pulidb
+        self.journal = journal
+        self.dbUrl = dbUrl
+        self.queue = Queue(queueSize)
+        self.lock = Lock()
+        self.lastJournaledBatch = 0
+        # True while a batch cannot be written to the database
+        self.failed = False
+        self.stopping = Event()
+
+    def push(self, rows):
+        '''
+        Journals and queues a batch of rows, blocks while the queue is full.
+        '''
+        with self.lock:
+            self.journal.append(rows)
+            self.lastJournaledBatch += 1
+            batch = self.lastJournaledBatch
+        self.queue.put((batch, rows))
+
+    def stop(self):
+        '''
+        Writes the pending batches and stops the thread. If a batch is failing, the thread stops without
+        writing it and the journal is replayed at the next startup.
+        '''
+        self.stopping.set()
+        while self.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                break
+            except Full:
+                pass
+        self.join()
+        self.journal.close()
+
+    def run(self):
+        # the thread owns its connection, the main thread keeps the process connection
+        sqlhub.threadConnection = connectionForURI(self.dbUrl)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch, rows = item
+            if not self.write(batch, rows):
+                # stopped while the batch was failing, it stays in the journal
+                break
+            with self.lock:
+                if batch == self.lastJournaledBatch:
+                    self.journal.truncate()
+
+    def write(self, batch, rows):
+        '''
+        Writes a batch of rows, retrying until it succeeds. Returns False if the thread has been stopped first.
+        '''
+        delay = MIN_RETRY_DELAY
+        while True:
+            try:
+                self.pulidb.writeRows(rows)
+            except Exception:
+                LOGGER.exception("Failed to write batch %d to the database, next attempt in %d s" % (batch, delay))
+                self.failed = True
+                if self.stopping.wait(delay):
+                    return False
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            if self.failed:
+                LOGGER.warning("Batch %d written to the database after a failure" % batch)
+                self.failed = False
+            return True
@@ -6,10 +6,11 @@
 
 from __future__ import with_statement
 
+import heapq
 import logging
 import socket
 import time
-from Queue import Queue
+from Queue import Queue, Empty
 from itertools import groupby, ifilter, chain
 import collections
 try:
@@ -20,16 +21,21 @@ except ImportError:
 # from octopus.core import tools
 from octopus.core import singletonconfig, singletonstats
 
-from octopus.core.threadpool import ThreadPool, makeRequests, NoResultsPending
 from octopus.core.framework import MainLoopApplication
-from octopus.core.tools import elapsedTimeToString
+from octopus.core.tools import elapsedTimeToString, Workload
 
 from octopus.dispatcher.model import (DispatchTree, FolderNode, RenderNode,
                                       Pool, PoolShare, enums)
 from octopus.dispatcher.strategies import FifoStrategy
 
-from octopus.dispatcher import settings
+from octopus.dispatcher import settings, workerclient
 from octopus.dispatcher.db.pulidb import PuliDB
+from octopus.dispatcher.db.writebehind import Journal, PersistenceThread
+from octopus.dispatcher.db.checkpoint import CheckpointManager
+from octopus.dispatcher.model.idallocator import IdReservations
+from octopus.dispatcher.model.fairshare import getJobPath
+from octopus.dispatcher.model.readytasks import getTaskNode, getEntryPoint
+from octopus.dispatcher.model.preemption import PreemptionPlanner
 from octopus.dispatcher.model.enums import *
 from octopus.dispatcher.poolman.filepoolman import FilePoolManager
 from octopus.dispatcher.poolman.wspoolman import WebServicePoolManager
@@ -63,7 +69,7 @@ class Dispatcher(MainLoopApplication):
 
         MainLoopApplication.__init__(self, framework)
 
-        self.threadPool = ThreadPool(16, 0, 0, None)
+        self.workerClient = workerclient.getClient()
 
         #
         # Class holding custom infos on the dispatcher.
@@ -71,17 +77,34 @@ class Dispatcher(MainLoopApplication):
         # later use
         #
         self.cycle = 1
+        # date of the next comparison of the farm counters with a full count of the tree
+        self.nextCountersCheck = 0
         self.dispatchTree = DispatchTree()
         self.licenseManager = LicenseManager()
+        self.preemptionPlanner = PreemptionPlanner()
         self.enablePuliDB = settings.DB_ENABLE
         self.cleanDB = settings.DB_CLEAN_DATA
         self.restartService = False
 
         self.pulidb = None
+        self.persistenceThread = None
         if self.enablePuliDB:
-            self.pulidb = PuliDB(self.cleanDB, self.licenseManager)
+            journal = None
+            if singletonconfig.get('DB', 'WRITE_BEHIND', False):
+                journal = Journal(singletonconfig.get('DB', 'JOURNAL_FILE', '/var/lib/puli/pulidb.journal'))
+            checkpoints = None
+            if singletonconfig.get('DB', 'CHECKPOINT', False):
+                checkpoints = CheckpointManager(singletonconfig.get('DB', 'CHECKPOINT_DIR', '/var/lib/puli/checkpoints'),
+                                                singletonconfig.get('DB', 'CHECKPOINT_INTERVAL', 600))
+            self.pulidb = PuliDB(self.cleanDB, self.licenseManager, journal, checkpoints)
 
         self.dispatchTree.registerModelListeners()
+        if self.enablePuliDB:
+            reservations = None
+            if singletonconfig.get('DB', 'ID_RESERVATION_FILE'):
+                reservations = IdReservations(singletonconfig.get('DB', 'ID_RESERVATION_FILE'),
+                                              singletonconfig.get('DB', 'ID_BLOCK_SIZE', 1000))
+            self.dispatchTree.initIdAllocators(reservations)
         rnsAlreadyInitialized = self.initPoolsDataFromBackend()
 
         if self.enablePuliDB and not self.cleanDB:
@@ -114,6 +137,11 @@ class Dispatcher(MainLoopApplication):
         if self.enablePuliDB and not self.cleanDB:
             self.dispatchTree.toModifyElements = []
 
+        if self.pulidb is not None and self.pulidb.journal is not None:
+            self.persistenceThread = PersistenceThread(self.pulidb, self.pulidb.journal, settings.DB_URL,
+                                                       singletonconfig.get('DB', 'WRITE_BEHIND_QUEUE_SIZE', 10))
+            self.persistenceThread.start()
+
         # If no 'default' pool exists, create default pool
         # When creating a pool with id=None, it is automatically appended in "toCreateElement" list in dispatcher and in the dispatcher's "pools" attribute
         if 'default' not in self.dispatchTree.pools:
@@ -127,7 +155,8 @@ class Dispatcher(MainLoopApplication):
         LOGGER.warning("Total time elapsed %s" % elapsedTimeToString(startTimer))
         LOGGER.warning("")
 
-        # it should be better to have a maxsize
+        # Workloads queued by the webservice when the main loop runs in the scheduler thread,
+        # they are applied by this thread between two cycles and at the safe points of a cycle (see idle() and safePoint())
         self.queue = Queue(maxsize=10000)
 
     def initPoolsDataFromBackend(self):
@@ -214,10 +243,21 @@ class Dispatcher(MainLoopApplication):
             logging.getLogger('main').warning("[HS] validate dependencies")
         try:
             self.updateDB()
+            if self.persistenceThread is not None:
+                self.persistenceThread.stop()
             logging.getLogger('main').warning("[OK] update DB")
         except Exception:
             logging.getLogger('main').warning("[HS] update DB")
 
+        if self.pulidb is not None and self.pulidb.checkpoints is not None:
+            try:
+                # the next startup only has to read this checkpoint
+                self.pulidb.checkpoints.write(self.pulidb.getTreeRows(self.dispatchTree))
+                self.pulidb.checkpoints.close()
+                logging.getLogger('main').warning("[OK] write checkpoint")
+            except Exception:
+                logging.getLogger('main').warning("[HS] write checkpoint")
+
     def loadRules(self):
         from .rules.graphview import GraphViewBuilder
         graphs = self.dispatchTree.findNodeByPath("/graphs", None)
@@ -234,6 +274,77 @@ class Dispatcher(MainLoopApplication):
         #self.httpRequester.stopAll()
         pass
 
+    def idle(self, timeout):
+        '''
+        | Called by the scheduler thread while waiting for the next cycle.
+        | Queued workloads are applied as soon as they arrive so that webservice requests are answered
+        | without waiting for the next cycle, the model is handed over to the IOLoop as soon as it asks
+        | for it (@see SchedulerThread.requestModel).
+        '''
+        deadline = time.time() + timeout
+        remaining = timeout
+        while remaining > 0:
+            try:
+                workload = self.queue.get(timeout=remaining)
+            except Empty:
+                return
+            workload()
+            self.commitWorkloads([workload])
+            workload.submit()
+            remaining = deadline - time.time()
+
+    def publish(self):
+        '''
+        Commits the changes of the model made since the previous commit, called by the scheduler thread before
+        handing the model over to the IOLoop: the webservice reads a committed version of the model.
+        '''
+        self.dispatchTree.changeLog.commit(self.dispatchTree)
+
+    def safePoint(self):
+        '''
+        Called by the scheduler thread between two steps of a cycle: applies the workloads queued since the
+        previous call and hands the model over to the IOLoop if it is waiting for it, so that the webservice
+        requests do not wait for the end of the cycle. Does nothing if the main loop is run by the IOLoop.
+
+        :returns: the number of applied workloads
+        '''
+        if self.framework.scheduler is None:
+            return 0
+        nbWorkloads = self.applyQueuedWorkloads()
+        self.yieldModel()
+        return nbWorkloads
+
+    def applyQueuedWorkloads(self):
+        '''
+        Applies every workload queued since the previous call. Only the workloads present when the call
+        starts are processed, requests arriving meanwhile will wait for the next call.
+        '''
+        workloads = []
+        for i in xrange(self.queue.qsize()):
+            try:
+                workload = self.queue.get_nowait()
+            except Empty:
+                break
+            workload()
+            workloads.append(workload)
+        self.commitWorkloads(workloads)
+        for workload in workloads:
+            workload.submit()
+        return len(workloads)
+
+    def commitWorkloads(self, workloads):
+        '''
+        Commits the changes of the applied workloads before their requests are answered, so that a client
+        reading the model right after modifying it does not get a cached response computed before the
+        modification.
+        '''
+        if not workloads:
+            return
+        if not all(workload.readOnly for workload in workloads):
+            # some workloads change more than the model (e.g. licenses)
+            self.dispatchTree.changeLog.touch()
+        self.dispatchTree.changeLog.commit(self.dispatchTree)
+
     @property
     def modified(self):
         return bool(self.dispatchTree.toArchiveElements or
@@ -244,7 +355,11 @@ class Dispatcher(MainLoopApplication):
         '''
         | Dispatcher main loop iteration.
         | Periodically called with tornado'sinternal callback mecanism, the frequency is defined by config: CORE.MASTER_UPDATE_INTERVAL
+        | If config CORE.SCHEDULER_THREAD is set, it is called by a dedicated scheduler thread instead: the
+        | changes queued by the webservice are applied first and at the safe points between the steps, where the
+        | model is also handed over to the IOLoop for the webservice reads (@see safePoint).
         | During this process, the dispatcher will:
+        |   - run the expired timers (e.g. auto retry of the failed commands)
         |   - update completion and status for all jobs in dispatchTree
         |   - update status of renderNodes
         |   - validate inter tasks dependencies
@@ -262,21 +377,30 @@ class Dispatcher(MainLoopApplication):
         log.info("-----------------------------------------------------")
         log.info(" Start dispatcher process cycle (old version).")
 
-        try:
-            self.threadPool.poll()
-        except NoResultsPending:
-            pass
-        else:
+        if self.workerClient.poll():
             log.info("finished some network requests")
-            pass
 
         self.cycle += 1
 
-        # Update of allocation is done when parsing the tree for completion and status update (done partially for invalidated node only i.e. when needed)
+        # Run the expired timers (e.g. auto retry of the failed commands)
+        prevTimer = time.time()
+        nbTimers = self.dispatchTree.timers.advance()
+        log.info("%8.2f ms --> ran %d timers" % ((time.time() - prevTimer) * 1000, nbTimers))
+
+        # Apply requests queued by the webservice during the previous cycle
+        prevTimer = time.time()
+        nbWorkloads = self.applyQueuedWorkloads()
+        if singletonconfig.get('CORE', 'GET_STATS'):
+            singletonstats.theStats.cycleTimers['apply_queue'] = time.time() - prevTimer
+        log.info("%8.2f ms --> applied %d queued requests" % ((time.time() - prevTimer) * 1000, nbWorkloads))
+        prevTimer = time.time()
+
+        # Refresh the nodes modified since the last cycle (dirty set of the dispatch tree), allocation included
         self.dispatchTree.updateCompletionAndStatus()
         if singletonconfig.get('CORE', 'GET_STATS'):
             singletonstats.theStats.cycleTimers['update_tree'] = time.time() - prevTimer
         log.info("%8.2f ms --> update completion status" % ((time.time() - prevTimer) * 1000))
+        nbWorkloads = self.safePoint()
         prevTimer = time.time()
 
         # Update render nodes
@@ -284,6 +408,7 @@ class Dispatcher(MainLoopApplication):
         if singletonconfig.get('CORE', 'GET_STATS'):
             singletonstats.theStats.cycleTimers['update_rn'] = time.time() - prevTimer
         log.info("%8.2f ms --> update render node" % ((time.time() - prevTimer) * 1000))
+        nbWorkloads += self.safePoint()
         prevTimer = time.time()
 
         # Validate dependencies
@@ -291,6 +416,7 @@ class Dispatcher(MainLoopApplication):
         if singletonconfig.get('CORE', 'GET_STATS'):
             singletonstats.theStats.cycleTimers['update_dependencies'] = time.time() - prevTimer
         log.info("%8.2f ms --> validate dependencies" % ((time.time() - prevTimer) * 1000))
+        nbWorkloads += self.safePoint()
         prevTimer = time.time()
 
         # update db
@@ -298,6 +424,12 @@ class Dispatcher(MainLoopApplication):
         if singletonconfig.get('CORE', 'GET_STATS'):
             singletonstats.theStats.cycleTimers['update_db'] = time.time() - prevTimer
         log.info("%8.2f ms --> update DB" % ((time.time() - prevTimer) * 1000))
+        nbWorkloads += self.safePoint()
+        if nbWorkloads:
+            # refresh the nodes modified by the workloads applied since the update of the tree
+            prevTimer = time.time()
+            self.dispatchTree.updateCompletionAndStatus()
+            log.info("%8.2f ms --> update completion status after %d queued requests" % ((time.time() - prevTimer) * 1000, nbWorkloads))
         prevTimer = time.time()
 
         # compute and send command assignments to rendernodes
@@ -312,6 +444,7 @@ class Dispatcher(MainLoopApplication):
             singletonstats.theStats.cycleTimers['send_assignment'] = time.time() - prevTimer
             singletonstats.theStats.cycleCounts['num_assignments'] = len(assignments)
         log.info("%8.2f ms --> send %r assignments." % ((time.time() - prevTimer) * 1000, len(assignments)))
+        self.safePoint()
         prevTimer = time.time()
 
         # call the release finishing status on all rendernodes
@@ -322,6 +455,18 @@ class Dispatcher(MainLoopApplication):
         log.info("%8.2f ms --> releaseFinishingStatus" % ((time.time() - prevTimer) * 1000))
         prevTimer = time.time()
 
+        # publish the changes of the iteration to the change feed (i.e. /changes)
+        version = self.dispatchTree.changeLog.commit(self.dispatchTree)
+        log.info("%8.2f ms --> commit changes (version %d)" % ((time.time() - prevTimer) * 1000, version))
+        prevTimer = time.time()
+
+        # self-check of the farm counters, any drift is logged and fixed
+        if loopStartTime >= self.nextCountersCheck:
+            self.nextCountersCheck = loopStartTime + singletonconfig.get('CORE', 'COUNTERS_CHECK_INTERVAL', 600)
+            self.dispatchTree.farmCounters.check(self.dispatchTree)
+            log.info("%8.2f ms --> check farm counters" % ((time.time() - prevTimer) * 1000))
+            prevTimer = time.time()
+
         loopDuration = (time.time() - loopStartTime)*1000
         log.info("%8.2f ms --> cycle ended. " % loopDuration)
 
@@ -334,9 +479,19 @@ class Dispatcher(MainLoopApplication):
 
     def updateDB(self):
         if settings.DB_ENABLE:
-            self.pulidb.createElements(self.dispatchTree.toCreateElements)
-            self.pulidb.updateElements(self.dispatchTree.toModifyElements)
-            self.pulidb.archiveElements(self.dispatchTree.toArchiveElements)
+            rows = self.pulidb.getRows(self.dispatchTree.toCreateElements,
+                                       self.dispatchTree.toModifyElements,
+                                       self.dispatchTree.toArchiveElements)
+            if self.pulidb.checkpoints is not None:
+                # recorded first, the delta journals must hold every change of the database
+                self.pulidb.checkpoints.record(rows)
+            if self.persistenceThread is not None:
+                # rows are taken now, the persistence thread writes them later
+                self.persistenceThread.push(rows)
+            else:
+                self.pulidb.writeRows(rows)
+            if self.pulidb.checkpoints is not None and self.pulidb.checkpoints.isDue():
+                self.pulidb.checkpoints.write(self.pulidb.getTreeRows(self.dispatchTree))
             # logging.getLogger('main.dispatcher').info("                UpdateDB: create=%d update=%d delete=%d" % (len(self.dispatchTree.toCreateElements), len(self.dispatchTree.toModifyElements), len(self.dispatchTree.toArchiveElements)) )
         self.dispatchTree.resetDbElements()
 
@@ -346,8 +501,10 @@ class Dispatcher(MainLoopApplication):
         LOGGER = logging.getLogger('main')
 
         from .model.node import NoRenderNodeAvailable, NoLicenseAvailableForTask
+        # the running commands may be preempted for the jobs which cannot get their maxRN, even on a full farm
+        preemption = singletonconfig.get('CORE', 'PREEMPTION', False)
         # if no rendernodes available, return
-        if not any(rn.isAvailable() for rn in self.dispatchTree.renderNodes.values()):
+        if not preemption and not any(rn.isAvailable() for rn in self.dispatchTree.renderNodes.values()):
             return []
 
         # first create a set of entrypoints that are not done nor cancelled nor blocked nor paused and that have at least one command ready
@@ -362,7 +519,7 @@ class Dispatcher(MainLoopApplication):
             if len(renderNodesAvailable):
                 isRenderNodesAvailable = True
                 break
-        if not isRenderNodesAvailable:
+        if not isRenderNodesAvailable and not preemption:
             return []
 
         # Log time updating max rn
@@ -371,6 +528,11 @@ class Dispatcher(MainLoopApplication):
         # sort by pool for the groupby
         entryPoints = sorted(entryPoints, key=lambda node: node.mainPoolShare().pool)
 
+        fairShare = singletonconfig.get('CORE', 'FAIRSHARE', False)
+        if fairShare:
+            self.dispatchTree.fairShare.configure()
+            self.dispatchTree.fairShare.purge()
+
         # update the value of the maxrn for the poolshares (parallel dispatching)
         for pool, jobsIterator in groupby(entryPoints, lambda x: x.mainPoolShare().pool):
 
@@ -395,6 +557,10 @@ class Dispatcher(MainLoopApplication):
             if len(jobsList) == 0:
                 continue
 
+            if fairShare:
+                self.updateFairShareMaxRN(jobsList, nbOnlineRenderNodes)
+                continue
+
             # Prepare updatedMaxRN with dispatch key proportions
             # list of dks (integer only)
             dkList = [job.dispatchKey for job in jobsList]
@@ -444,6 +610,9 @@ class Dispatcher(MainLoopApplication):
         entryPoints = sorted(entryPoints, key=lambda node: node.id)
         # then sort by dispatchKey (priority)
         entryPoints = sorted(entryPoints, key=lambda node: node.dispatchKey, reverse=True)
+        if fairShare:
+            # then the jobs the furthest below their fair share first
+            entryPoints = sorted(entryPoints, key=lambda node: node.mainPoolShare().allocatedRN - node.mainPoolShare().maxRN)
 
         # Put nodes with a userDefinedMaxRN first
         userDefEntryPoints = ifilter(lambda node: node.mainPoolShare().userDefinedMaxRN, entryPoints)
@@ -461,7 +630,8 @@ class Dispatcher(MainLoopApplication):
                 continue
 	    
 	    try:
-	        for (rn, com) in entryPoint.dispatchIterator(lambda: self.queue.qsize() > 0):
+	        # Queued workloads are applied between cycles, only interrupt dispatching if the queue is saturated
+	        for (rn, com) in entryPoint.dispatchIterator(lambda: self.queue.full()):
         	    assignments.append((rn, com))
         	    # increment the allocatedRN for the poolshare
         	    entryPoint.mainPoolShare().allocatedRN += 1
@@ -472,6 +642,17 @@ class Dispatcher(MainLoopApplication):
  	    except NoLicenseAvailableForTask:
                  LOGGER.info("Missing license for node \"%s\" (other commands can start anyway)." % entryPoint.name)
 		 pass
+            # the webservice may read the model between two entry points, the assignments are not sent yet
+            self.yieldModel()
+
+        # Backfill: give the render nodes left idle to the ready commands which fit on them
+        if singletonconfig.get('CORE', 'BACKFILL', True):
+            prevTimer = time.time()
+            backfillAssignments = self.backfill()
+            assignments.extend(backfillAssignments)
+            if singletonconfig.get('CORE','GET_STATS'):
+                singletonstats.theStats.assignmentTimers['backfill'] = time.time() - prevTimer
+            LOGGER.info("%8.2f ms --> .... backfilling %d commands", (time.time() - prevTimer) * 1000, len(backfillAssignments))
 
         assignmentDict = collections.defaultdict(list)
         for (rn, com) in assignments:
@@ -481,93 +662,264 @@ class Dispatcher(MainLoopApplication):
             singletonstats.theStats.assignmentTimers['dispatch_command'] = time.time() - prevTimer
         LOGGER.info( "%8.2f ms --> .... dispatching commands", (time.time() - prevTimer)*1000  )
 
-        #
-        # Check replacements
-        #
-        # - faire une passe pour les jobs n'ayant pas leur part de gateau
-        #     - identifier dans leur pool les jobs killable
-        #     - pour chaque ressource, si match : on jette le job en cours ET on desactive son attribut killable
+        # Preemption: evict the killable commands for the jobs which cannot get their maxRN
+        if preemption:
+            prevTimer = time.time()
+            nbEvicted = self.preempt()
+            if singletonconfig.get('CORE','GET_STATS'):
+                singletonstats.theStats.assignmentTimers['preemption'] = time.time() - prevTimer
+            LOGGER.info("%8.2f ms --> .... preempting %d render nodes", (time.time() - prevTimer) * 1000, nbEvicted)
 
+        return assignmentDict.items()
 
-        #
-        # Backfill
-        #
-        # TODO refaire une passe pour les jobs ayant un attribut "killable" et au moins une pool additionnelle
+    def preempt(self):
+        '''
+        Evicts the render nodes chosen by the preemption planner (@see PreemptionPlanner) for the jobs which still
+        have ready commands but cannot get their maxRN. The cancellations of the evicted commands are sent to the
+        workers in a batch of asynchronous requests. The evicted render nodes stay out of the dispatch until the
+        workers answer, the commands are then set back to ready without counting an attempt and the freed render
+        nodes are dispatched at the next cycle.
 
-        return assignmentDict.items()
+        :returns: the number of render nodes evicted
+        '''
+        evictions = self.preemptionPlanner.plan(self.dispatchTree,
+                                                singletonconfig.get('CORE', 'PREEMPTION_MAX_PER_CYCLE', 10),
+                                                singletonconfig.get('CORE', 'PREEMPTION_DELAY', 300))
+        log = logging.getLogger('main.dispatcher')
+        for (entryPoint, rendernode) in evictions:
+            self.preemptionPlanner.evict(rendernode, entryPoint)
+            for command in rendernode.commands.values():
+                log.warning("Preempting command %d on worker %s for job %d", command.id, rendernode.name, entryPoint.id)
+                self.workerClient.send(rendernode, "DELETE", "/commands/%d/" % command.id, None, {},
+                                       self._preemptionSent, self._preemptionFailed, context=command)
+        return len(evictions)
+
+    def _preemptionSent(self, request, response, data):
+        killed = response.status in (200, 202)
+        if not killed:
+            logging.getLogger('main.dispatcher').error("Preemption request failed: command %d on worker %s (status %d)", request.context.id, request.renderNode.name, response.status)
+        self.preemptionPlanner.release(request.renderNode, request.context, killed)
+
+    def _preemptionFailed(self, request, error):
+        logging.getLogger('main.dispatcher').error("Preemption of command %d on worker %s failed. Worker is likely dead (%r)", request.context.id, request.renderNode.name, error)
+        self.preemptionPlanner.release(request.renderNode, request.context, False)
+
+    def backfill(self):
+        '''
+        Gives the render nodes still idle after the dispatch of the entry points to the ready commands which fit on
+        them, e.g. the smaller nodes left idle because the first jobs require big nodes and the next ones have
+        reached the maxRN computed from their dispatch key. The maxRN set by the users are respected.
+        The candidate tasks of an idle render node are found through the requirement classes matching it (@see
+        ReadyTaskIndex) and are tried in the order of the dispatch: dispatch key, then id of their entry point.
 
+        :returns: a list of (rendernode, command) assignments
+        '''
+        idleRenderNodes = []
+        seen = set()
+        for pool in self.dispatchTree.pools.values():
+            for rendernode in pool.iterAvailableRenderNodes():
+                if rendernode not in seen:
+                    seen.add(rendernode)
+                    idleRenderNodes.append(rendernode)
+        if not idleRenderNodes:
+            return []
+
+        readyTasks = self.dispatchTree.readyTasks
+        # requirement class -> sorted list of the candidate (key, task, task node, entry point) of the class
+        candidates = {}
+        assignments = []
+        for rendernode in idleRenderNodes:
+            classCandidates = []
+            for (requirementClass, tasks) in readyTasks.iterMatchingClasses(rendernode):
+                if requirementClass not in candidates:
+                    candidates[requirementClass] = self.getBackfillCandidates(tasks)
+                classCandidates.append(candidates[requirementClass])
+            for (key, task, taskNode, entryPoint) in heapq.merge(*classCandidates):
+                # the index drops the command once assigned (i.e. not ready anymore)
+                command = readyTasks.firstReadyCommand(task)
+                if command is None:
+                    continue
+                poolShare = self.getBackfillPoolShare(entryPoint, rendernode)
+                if poolShare is None:
+                    continue
+                if not rendernode.canRun(command) or not rendernode.reserveLicense(command, self.licenseManager):
+                    continue
+                rendernode.addAssignment(command)
+                # same bookkeeping as the dispatch of the entry points (@see TaskNode.dispatchIterator)
+                taskNode.readyCommandCount -= 1
+                node = entryPoint
+                while node:
+                    node.readyCommandCount -= 1
+                    node = node.parent
+                poolShare.allocatedRN += 1
+                rendernode.currentpoolshare = poolShare
+                assignments.append((rendernode, command))
+                break
+        return assignments
+
+    def getBackfillCandidates(self, tasks):
+        candidates = []
+        for task in tasks:
+            taskNode = getTaskNode(task)
+            entryPoint = getEntryPoint(taskNode)
+            if entryPoint is None or entryPoint.name == 'graphs':
+                continue
+            if entryPoint.status in (NODE_BLOCKED, NODE_DONE, NODE_CANCELED, NODE_PAUSED) or taskNode.paused:
+                continue
+            if task.timer is not None and time.time() < task.timer:
+                continue
+            candidates.append(((-entryPoint.dispatchKey, entryPoint.id, task.id), task, taskNode, entryPoint))
+        candidates.sort()
+        return candidates
+
+    def getBackfillPoolShare(self, entryPoint, rendernode):
+        '''
+        Returns the poolshare of the entry point on a pool of the render node, None if it has none or if the maxRN
+        set by a user is reached.
+        '''
+        for pool in rendernode.pools:
+            poolShare = entryPoint.poolShares.get(pool)
+            if poolShare is None:
+                continue
+            if poolShare.userDefinedMaxRN and poolShare.maxRN > 0 and poolShare.allocatedRN >= poolShare.maxRN:
+                continue
+            return poolShare
+        return None
+
+
+    def updateFairShareMaxRN(self, jobsList, nbOnlineRenderNodes):
+        '''
+        Sets the maxRN of the poolshares of the active jobs of a pool from the targets of the hierarchical fair share
+        (@see FairShare) instead of the dispatch key proportions. The dispatch keys are the shares of the jobs of a
+        user and the demand of a job is the number of render nodes it uses plus its number of ready commands.
+        A job with a null target keeps an unbound maxRN, it is dispatched after the jobs below their target and only
+        gets the render nodes they cannot use.
+        '''
+        dkMin = min(job.dispatchKey for job in jobsList)
+        jobs = [(getJobPath(job), job.dispatchKey - dkMin + 1, job.mainPoolShare().allocatedRN + job.readyCommandCount)
+                for job in jobsList]
+        targets = self.dispatchTree.fairShare.computeTargets(jobs, max(nbOnlineRenderNodes, 0))
+        for (job, (path, weight, demand)) in zip(jobsList, jobs):
+            job.mainPoolShare().maxRN = targets.get(path, 0)
 
     def updateRenderNodes(self):
         for rendernode in self.dispatchTree.renderNodes.values():
             rendernode.updateStatus()
 
     def sendAssignments(self, assignmentList):
-        '''Processes a list of (rendernode, command) assignments.'''
+        '''
+        Processes a list of (rendernode, commands) assignments.
+        The commands assigned to a rendernode are sent in a single batch request when the worker supports it.
+        '''
 
-        def sendAssignment(args):
-            rendernode, commands = args
-            failures = []
+        log = logging.getLogger('assign')
+        # merged (arguments, environment) of the ancestors of each task, computed once per call
+        taskValues = {}
+        for (rendernode, commands) in assignmentList:
+            commandDicts = []
             for command in commands:
-                headers = {}
-                if not rendernode.idInformed:
-                    headers["rnId"] = rendernode.id
-                root = command.task
-                ancestors = [root]
-                while root.parent:
-                    root = root.parent
-                    ancestors.append(root)
-                arguments = {}
-                environment = {
-                    'PULI_USER': command.task.user,
-                    'PULI_ALLOCATED_MEMORY': unicode(rendernode.usedRam[command.id]),
-                    'PULI_ALLOCATED_CORES': unicode(rendernode.usedCoresNumber[command.id]),
-                }
-                for ancestor in ancestors:
-                    arguments.update(ancestor.arguments)
-                    environment.update(ancestor.environment)
-                arguments.update(command.arguments)
-
-                log = logging.getLogger('assign')
                 log.info("Sending command: %d from task %s to %s" % (command.id, command.task.name, rendernode))
+                commandDicts.append(self._getCommandDict(rendernode, command, taskValues))
+
+            if len(commands) > 1 and rendernode.batchAssignments:
+                self._sendAssignmentRequest(rendernode, "/commands/batch/", {"commands": commandDicts}, commands)
+            else:
+                for (command, commandDict) in zip(commands, commandDicts):
+                    self._sendAssignmentRequest(rendernode, "/commands/", commandDict, [command])
+
+    def _getCommandDict(self, rendernode, command, taskValues):
+        task = command.task
+        try:
+            taskArguments, taskEnvironment = taskValues[task.id]
+        except KeyError:
+            ancestors = [task]
+            while ancestors[-1].parent:
+                ancestors.append(ancestors[-1].parent)
+            taskArguments = {}
+            taskEnvironment = {}
+            for ancestor in ancestors:
+                taskArguments.update(ancestor.arguments)
+                taskEnvironment.update(ancestor.environment)
+            taskValues[task.id] = (taskArguments, taskEnvironment)
+
+        arguments = dict(taskArguments)
+        arguments.update(command.arguments)
+        environment = {
+            'PULI_USER': task.user,
+            'PULI_ALLOCATED_MEMORY': unicode(rendernode.usedRam[command.id]),
+            'PULI_ALLOCATED_CORES': unicode(rendernode.usedCoresNumber[command.id]),
+        }
+        environment.update(taskEnvironment)
+
+        return {
+            "id": command.id,
+            "runner": str(task.runner),
+            "arguments": arguments,
+            "validationExpression": task.validationExpression,
+            "taskName": task.name,
+            "relativePathToLogDir": "%d" % task.id,
+            "environment": environment,
+            "runnerPackages": command.runnerPackages,
+            "watcherPackages": command.watcherPackages
+        }
+
+    def _sendAssignmentRequest(self, rendernode, url, content, commands):
+        headers = {}
+        if not rendernode.idInformed:
+            headers["rnId"] = rendernode.id
+        body = json.dumps(content)
+        headers["Content-Length"] = len(body)
+        headers["Content-Type"] = "application/json"
+
+        # the requests are sent concurrently by the worker client, the callbacks are run by the next poll()
+        self.workerClient.send(rendernode, "POST", url, body, headers,
+                               self._assignmentSent, self._assignmentFailed, context=(commands, content))
+
+    def _assignmentSent(self, request, response, data):
+        rendernode = request.renderNode
+        commands, content = request.context
+        if "commands" not in content:
+            command = commands[0]
+            if not response.status == 202:
+                logging.getLogger('main.dispatcher').error("Assignment request failed: command %d on worker %s", command.id, rendernode.name)
+                self._clearAssignment(rendernode, command)
+            else:
+                logging.getLogger('main.dispatcher').info("Sent assignment of command %d to worker %s", command.id, rendernode.name)
+            return
 
-                commandDict = {
-                    "id": command.id,
-                    "runner": str(command.task.runner),
-                    "arguments": arguments,
-                    "validationExpression": command.task.validationExpression,
-                    "taskName": command.task.name,
-                    "relativePathToLogDir": "%d" % command.task.id,
-                    "environment": environment,
-                    "runnerPackages": command.runnerPackages,
-                    "watcherPackages": command.watcherPackages
-                }
-                body = json.dumps(commandDict)
-                headers["Content-Length"] = len(body)
-                headers["Content-Type"] = "application/json"
-
-                try:
-                    resp, data = rendernode.request("POST", "/commands/", body, headers)
-                    if not resp.status == 202:
-                        logging.getLogger('main.dispatcher').error("Assignment request failed: command %d on worker %s", command.id, rendernode.name)
-                        failures.append((rendernode, command))
-                    else:
-                        logging.getLogger('main.dispatcher').info("Sent assignment of command %d to worker %s", command.id, rendernode.name)
-                except rendernode.RequestFailed, e:
-                    logging.getLogger('main.dispatcher').error("Assignment of command %d to worker %s failed. Worker is likely dead (%r)", command.id, rendernode.name, e)
-                    failures.append((rendernode, command))
-            return failures
-
-        requests = makeRequests(sendAssignment, [[a, b] for (a, b) in assignmentList], self._assignmentFailed)
-        for request in requests:
-            self.threadPool.putRequest(request)
-
-    def _assignmentFailed(self, request, failures):
-        for assignment in failures:
-            rendernode, command = assignment
-            rendernode.clearAssignment(command)
-            command.clearAssignment()
-
-            logging.getLogger('main.dispatcher').info(" - assignment cleared: command[%r] on rn[%r]" % (command.id, rendernode.name))
+        if response.status == 404:
+            # the worker does not handle batches yet, send the commands one by one
+            logging.getLogger('main.dispatcher').warning("Worker %s does not accept batch assignments, sending commands separately", rendernode.name)
+            rendernode.batchAssignments = False
+            for (command, commandDict) in zip(commands, content["commands"]):
+                self._sendAssignmentRequest(rendernode, "/commands/", commandDict, [command])
+            return
+
+        statuses = {}
+        if response.status == 200:
+            try:
+                statuses = dict((result["id"], result["status"]) for result in json.loads(data)["results"])
+            except Exception:
+                logging.getLogger('main.dispatcher').exception("Invalid batch assignment answer from worker %s", rendernode.name)
+        for command in commands:
+            if not statuses.get(command.id) == 202:
+                logging.getLogger('main.dispatcher').error("Assignment request failed: command %d on worker %s", command.id, rendernode.name)
+                self._clearAssignment(rendernode, command)
+            else:
+                logging.getLogger('main.dispatcher').info("Sent assignment of command %d to worker %s", command.id, rendernode.name)
+
+    def _assignmentFailed(self, request, error):
+        rendernode = request.renderNode
+        commands, content = request.context
+        for command in commands:
+            logging.getLogger('main.dispatcher').error("Assignment of command %d to worker %s failed. Worker is likely dead (%r)", command.id, rendernode.name, error)
+            self._clearAssignment(rendernode, command)
+
+    def _clearAssignment(self, rendernode, command):
+        rendernode.clearAssignment(command)
+        command.clearAssignment()
+
+        logging.getLogger('main.dispatcher').info(" - assignment cleared: command[%r] on rn[%r]" % (command.id, rendernode.name))
 
     def handleNewGraphRequestApply(self, graph):
         '''Handles a graph submission request and closes the given ticket
@@ -593,12 +945,55 @@ class Dispatcher(MainLoopApplication):
         logging.getLogger('main.dispatcher').info('Added graph "%s" to the model.' % graph['name'])
         return nodes
 
-    def updateCommandApply(self, dct):
+    def updateCommands(self, updates):
         '''
-        Called from a RN with a json desc of a command (ie rendernode info, command info etc).
-        Raise an execption to tell caller to send a HTTP404 response to RN, if not error a HTTP200 will be send instead
+        Applies the command updates sent by a worker (@see updateCommandApply) and returns, for each update, the
+        exception raised or None. When the main loop runs in a scheduler thread, this is called by the IOLoop while
+        the model is handed over to it: the updates are only checked (@see checkCommandUpdate) so that the worker is
+        answered at once, and are applied afterwards by the scheduler thread, in order with the other queued requests.
         '''
         log = logging.getLogger('main.dispatcher')
+        apply = self.updateCommandApply if self.framework.scheduler is None else self.checkCommandUpdate
+        errors = []
+        for dct in updates:
+            try:
+                apply(dct)
+            except (KeyError, IndexError) as e:
+                errors.append(e)
+            except Exception as e:
+                log.exception("Exception during update of command %r from %s" % (dct.get('id'), dct.get('renderNodeName')))
+                errors.append(e)
+            else:
+                errors.append(None)
+        if self.framework.scheduler is not None:
+            checkedUpdates = [(dct, error is None) for (dct, error) in zip(updates, errors)]
+            self.queueWorkload(Workload(lambda: self.applyCommandUpdates(checkedUpdates)))
+        return errors
+
+    def applyCommandUpdates(self, checkedUpdates):
+        '''
+        Applies the command updates checked by updateCommands once their worker has been answered. The refused updates
+        are only used to record the kill of the preempted commands (@see PreemptionPlanner.isEvictionReport).
+        '''
+        log = logging.getLogger('main.dispatcher')
+        for (dct, accepted) in checkedUpdates:
+            if not accepted:
+                command = self.dispatchTree.commands.get(dct['id'])
+                if command is not None and "status" in dct:
+                    self.preemptionPlanner.isEvictionReport(command, dct['renderNodeName'], int(dct['status']))
+                continue
+            try:
+                self.updateCommandApply(dct)
+            except (KeyError, IndexError) as e:
+                log.warning("Update of command %d from %s refused after its check: %s" % (dct['id'], dct['renderNodeName'], e))
+            except Exception:
+                log.exception("Exception during update of command %r from %s" % (dct.get('id'), dct.get('renderNodeName')))
+
+    def checkCommandUpdate(self, dct):
+        '''
+        Checks a command update sent by a worker without modifying the model and returns the command.
+        Raises a KeyError if the update must be refused (@see updateCommandApply).
+        '''
         commandId = dct['id']
         renderNodeName = dct['renderNodeName']
 
@@ -607,6 +1002,9 @@ class Dispatcher(MainLoopApplication):
         except KeyError:
             raise KeyError("Command not found: %d" % commandId)
 
+        if "status" in dct and self.preemptionPlanner.isEviction(command, renderNodeName, int(dct['status'])):
+            raise KeyError("Command %d has been preempted on rendernode %s" % (commandId, renderNodeName))
+
         if not command.renderNode:
             # souldn't we reassign the command to the rn??
             raise KeyError("Command %d (%d) is no longer registered on rendernode %s" % (commandId, int(dct['status']), renderNodeName))
@@ -615,8 +1013,23 @@ class Dispatcher(MainLoopApplication):
             # rn = command.renderNode
             # rn.clearAssignment(command)
             # rn.request("DELETE", "/commands/" + str(commandId) + "/")
-            log.warning("The emitting RN %s is different from the RN assigned to the command in pulimodel: %s." % (renderNodeName, command.renderNode.name))
+            logging.getLogger('main.dispatcher').warning("The emitting RN %s is different from the RN assigned to the command in pulimodel: %s." % (renderNodeName, command.renderNode.name))
             raise KeyError("Command %d is running on a different rendernode (%s) than the one in puli's model (%s)." % (commandId, renderNodeName, command.renderNode.name))
+        return command
+
+    def updateCommandApply(self, dct):
+        '''
+        Called from a RN with a json desc of a command (ie rendernode info, command info etc).
+        Raise an execption to tell caller to send a HTTP404 response to RN, if not error a HTTP200 will be send instead
+        '''
+        log = logging.getLogger('main.dispatcher')
+        commandId = dct['id']
+        command = self.dispatchTree.commands.get(commandId)
+
+        # the kill of a preempted command is recorded before the update is refused
+        if command is not None and "status" in dct and self.preemptionPlanner.isEvictionReport(command, dct['renderNodeName'], int(dct['status'])):
+            raise KeyError("Command %d has been preempted on rendernode %s" % (commandId, dct['renderNodeName']))
+        command = self.checkCommandUpdate(dct)
 
         rn = command.renderNode
         rn.lastAliveTime = max(time.time(), rn.lastAliveTime)
@@ -0,0 +1,129 @@
+"""
+Versioned log of the changes of the dispatch tree, used by the /changes webservice.
+
+The listeners of the dispatch tree add each created, modified or destroyed node, command and render node to
+a pending set. At the end of each iteration the dispatcher commits the pending changes: the model version is
+incremented and every changed element is moved to the end of an ordered history with this version. The
+elements modified since a given version are then found by walking the history backwards. The history keeps
+one entry per element and at most historySize entries, a client asking for changes older than the oldest
+entry must reload the whole queue (resync). Other changes (pools, licenses...) are not in the history but
+increment the version too, the version is also used to invalidate the cached webservice responses.
+
+The version starts from the current time in milliseconds and is incremented by each commit (at the end of each
+iteration and once the requests modifying the model are applied), far less often than once per millisecond, so
+that it keeps increasing across restarts of the dispatcher.
+"""
+
+from __future__ import with_statement
+
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+
+LOGGER = logging.getLogger('main.dispatcher.dispatchtree')
+
+KINDS = ('nodes', 'commands', 'rendernodes')
+
+
+class ChangeLog(object):
+
+    def __init__(self, historySize=100000):
+        self.historySize = historySize
+        self.lock = Lock()
+        self.version = int(time.time() * 1000)
+        # clients asking for the changes since an older version must resync
+        self.minVersion = self.version
+        # elements changed since the last commit, filled by the listeners of the dispatch tree
+        self.nodes = set()
+        self.commands = set()
+        self.rendernodes = set()
+        # set when something else changed (e.g. pools or licenses), the version is incremented by the next commit
+        self.modified = False
+        # (kind, id) -> (version, element or None if it was removed), ordered by version
+        self.history = OrderedDict()
+        # callbacks of the clients waiting for the next version
+        self.waiters = []
+
+    def touch(self):
+        self.modified = True
+
+    def isRemoved(self, kind, element, tree):
+        if kind == 'nodes':
+            return tree.nodes.get(element.id) is not element
+        elif kind == 'commands':
+            return tree.commands.get(element.id) is not element
+        else:
+            return tree.renderNodes.get(element.name) is not element
+
+    ## Records the pending changes with a new version, called by the dispatcher at the end of each iteration.
+    # @return the current version
+    #
+    def commit(self, tree):
+        modified, self.modified = self.modified, False
+        changes = []
+        for kind in KINDS:
+            pending = getattr(self, kind)
+            if pending:
+                # not swapped with a new set: an element added meanwhile by another thread stays pending
+                elements = list(pending)
+                pending.difference_update(elements)
+                changes.append((kind, elements))
+        if not changes and not modified:
+            return self.version
+        with self.lock:
+            self.version += 1
+            history = self.history
+            for (kind, elements) in changes:
+                for element in elements:
+                    if element.id is None:
+                        continue
+                    key = (kind, element.id)
+                    history.pop(key, None)
+                    history[key] = (self.version, None if self.isRemoved(kind, element, tree) else element)
+            while len(history) > self.historySize:
+                (version, element) = history.popitem(last=False)[1]
+                self.minVersion = version
+            waiters, self.waiters = self.waiters, []
+        for callback in waiters:
+            try:
+                callback(self.version)
+            except Exception:
+                LOGGER.exception("error while notifying a client waiting for changes")
+        return self.version
+
+    ## Returns the changes committed after the given version.
+    # @return a (version, resync, changed, removed) tuple: changed maps each kind to the list of changed elements
+    #         and removed to the list of ids of the removed elements. If resync is set, the history does not go
+    #         back to the given version and changed/removed are empty.
+    #
+    def getChanges(self, since):
+        changed = dict((kind, []) for kind in KINDS)
+        removed = dict((kind, []) for kind in KINDS)
+        with self.lock:
+            if since < self.minVersion or since > self.version:
+                return self.version, True, changed, removed
+            for key in reversed(self.history):
+                (version, element) = self.history[key]
+                if version <= since:
+                    break
+                if element is None:
+                    removed[key[0]].append(key[1])
+                else:
+                    changed[key[0]].append(element)
+            return self.version, False, changed, removed
+
+    ## Calls callback(version) once a version newer than since is committed, at once if there is one already.
+    # The callback is called by the thread committing the changes.
+    #
+    def wait(self, since, callback):
+        with self.lock:
+            if since >= self.version:
+                self.waiters.append(callback)
+                return
+        callback(self.version)
+
+    def cancelWait(self, callback):
+        with self.lock:
+            if callback in self.waiters:
+                self.waiters.remove(callback)
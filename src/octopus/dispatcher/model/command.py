@@ -11,7 +11,6 @@
 
 import time
 import logging
-from threading import Timer
 
 from octopus.core.enums.command import *
 from octopus.core.enums.rendernode import RN_FINISHING
@@ -199,6 +198,22 @@ class Command(models.Model):
         self.retryCount = 0
         self.message = ""
 
+    def autoretry(self):
+        '''
+        Sets a failed command ready again and releases its render node, called DELAY_BEFORE_AUTORETRY seconds after
+        the failure while the command has attempts left.
+        '''
+        rn = self.renderNode
+        self.status = CMD_READY
+        self.clearAssignment()
+        self.completion = 0.0
+        self.message = ""
+        if rn is not None:
+            self.retryRnList.append(rn.name)
+            rn.clearAssignment(self)
+            rn.status = RN_FINISHING
+        self.retryCount += 1
+
     def computeAvgTimeByFrame(self):
         # compute the nbFrames
         self.nbFrames = 0
@@ -270,7 +285,7 @@ class CommandDatesUpdater(object):
             # only if we don't already have a command for this task
             if hasattr(cmd.renderNode, 'tasksHistory') and cmd.task.id not in cmd.renderNode.tasksHistory:
                 cmd.renderNode.tasksHistory.append(cmd.task.id)
-                cmd.renderNode.history.append(cmd.status)
+                cmd.renderNode.appendHistory(cmd.status)
         if cmd.status is CMD_DONE:
             # TOFIX: handle CANCEL status and update end time when cancelling a
             # job so that it can be properly cleaned
@@ -281,30 +296,11 @@ class CommandDatesUpdater(object):
         # autoretry
         elif cmd.status is CMD_ERROR:
             cmd.attempt += 1
-
-            if cmd.attempt < cmd.task.maxAttempt:
-                LOGGER.debug("Mark command %d for auto retry in %ds  (%d/%d)" % (cmd.id, singletonconfig.get('CORE', 'DELAY_BEFORE_AUTORETRY'), cmd.attempt, cmd.task.maxAttempt))
-                t = Timer(singletonconfig.get('CORE', 'DELAY_BEFORE_AUTORETRY'), self.autoretry, [cmd])
-                t.start()
-
+            # the auto retry is scheduled by the dispatch tree (@see DispatchTree.onCommandStatusChange)
         elif cmd.status is CMD_ASSIGNED:
             cmd.startTime = cmd.updateTime
         elif cmd.status < CMD_ASSIGNED:
             cmd.startTime = None
 
-    def autoretry(self, cmd):
-        rn = cmd.renderNode
-        cmd.retryRnList.append(rn.name)
-
-        # cmd.setReadyStatusAndClear()
-        cmd.status = CMD_READY
-        cmd.clearAssignment()
-        cmd.completion = 0.0
-        cmd.message = ""
-
-        rn.clearAssignment(cmd)
-        rn.status = RN_FINISHING
-        cmd.retryCount += 1
-
 
 Command.changeListeners.append(CommandDatesUpdater())
@@ -2,15 +2,24 @@
 
 import logging
 import time
+from collections import defaultdict
 from weakref import WeakValueDictionary
 
 
 from octopus.dispatcher.model import FolderNode, TaskNode, Pool, RenderNode, Task, TaskGroup, Command, PoolShare
 from octopus.dispatcher.model.node import BaseNode
+from octopus.dispatcher.model.idallocator import IdAllocator
+from octopus.dispatcher.model.jobindex import JobIndex, INDEXED_FIELDS
+from octopus.dispatcher.model.changelog import ChangeLog
+from octopus.dispatcher.model.farmcounters import FarmCounters
+from octopus.dispatcher.model.timers import TimerWheel
+from octopus.dispatcher.model.fairshare import FairShare
+from octopus.dispatcher.model.readytasks import ReadyTaskIndex
 from octopus.dispatcher.strategies import FifoStrategy, loadStrategyClass
 from octopus.core.enums.command import *
 from octopus.dispatcher.rules import RuleError
 from octopus.dispatcher.db.pulidb import StatDB
+from octopus.core import singletonconfig
 
 logger = logging.getLogger('main.dispatcher.dispatchtree')
 
@@ -57,12 +66,12 @@ class DispatchTree(object):
         self.poolShares = {}
         self.commands = {}
         # deduced properties
-        self.nodeMaxId = 0
-        self.poolMaxId = 0
-        self.renderNodeMaxId = 0
-        self.taskMaxId = 0
-        self.commandMaxId = 0
-        self.poolShareMaxId = 0
+        self.nodeIds = IdAllocator('nodes')
+        self.poolIds = IdAllocator('pools')
+        self.renderNodeIds = IdAllocator('renderNodes')
+        self.taskIds = IdAllocator('tasks')
+        self.commandIds = IdAllocator('commands')
+        self.poolShareIds = IdAllocator('poolShares')
         self.toCreateElements = []
         self.toModifyElements = []
         self.toArchiveElements = []
@@ -74,8 +83,26 @@ class DispatchTree(object):
         self.renderNodeListener = ObjectListener(self.onRenderNodeCreation, self.onRenderNodeDestruction, self.onRenderNodeChange)
         self.poolListener = ObjectListener(self.onPoolCreation, self.onPoolDestruction, self.onPoolChange)
         self.commandListener = ObjectListener(onCreationEvent=self.onCommandCreation, onChangeEvent=self.onCommandChange)
-        self.poolShareListener = ObjectListener(self.onPoolShareCreation)
+        self.poolShareListener = ObjectListener(self.onPoolShareCreation, onChangeEvent=self.onPoolShareChange)
         self.modifiedNodes = []
+        # nodes to refresh in the next call to updateCompletionAndStatus
+        self.dirtyNodes = set()
+        # nodes whose poolshares were modified and need to update their allocation
+        self.dirtyAllocations = set()
+        # indexes of the jobs used by the queries
+        self.jobIndex = JobIndex()
+        # versioned log of the changes of nodes, commands and render nodes used by the change feed
+        self.changeLog = ChangeLog(singletonconfig.get('CORE', 'CHANGES_HISTORY_SIZE', 100000))
+        # commands, render nodes and jobs by status, read by the stats webservices
+        self.farmCounters = FarmCounters()
+        # timers run by the main loop, e.g. the auto retry of the failed commands
+        self.timers = TimerWheel()
+        # command id -> handle of its pending auto retry
+        self.retryTimers = {}
+        # decayed usage of the pools, prods, users and jobs used by the fair share (i.e. CORE.FAIRSHARE)
+        self.fairShare = FairShare(singletonconfig.get('CORE', 'FAIRSHARE_HALF_LIFE', 14400.0))
+        # tasks having ready commands by requirements, used by the backfill
+        self.readyTasks = ReadyTaskIndex()
 
     def registerModelListeners(self):
         BaseNode.changeListeners.append(self.nodeListener)
@@ -86,13 +113,47 @@ class DispatchTree(object):
         Command.changeListeners.append(self.commandListener)
         PoolShare.changeListeners.append(self.poolShareListener)
 
-    def destroy(self):
+    def unregisterModelListeners(self):
         BaseNode.changeListeners.remove(self.nodeListener)
         Task.changeListeners.remove(self.taskListener)
+        TaskGroup.changeListeners.remove(self.taskListener)
         RenderNode.changeListeners.remove(self.renderNodeListener)
         Pool.changeListeners.remove(self.poolListener)
         Command.changeListeners.remove(self.commandListener)
         PoolShare.changeListeners.remove(self.poolShareListener)
+
+    def registerRestoredElements(self, pools=(), renderNodes=(), nodes=(), tasks=(), commands=(), poolShares=()):
+        '''
+        | Registers elements created while the model listeners were unregistered (i.e. reloaded from the database),
+        | as the creation listeners do for elements created with an id. The nodes are not added to the nodes dict,
+        | the caller only registers the nodes which are complete.
+        '''
+        for pool in pools:
+            self.poolIds.observe(pool.id)
+            self.pools[pool.name] = pool
+        for renderNode in renderNodes:
+            self.renderNodeIds.observe(renderNode.id)
+            self.renderNodes[renderNode.name] = renderNode
+        for node in nodes:
+            self.nodeIds.observe(node.id)
+            if node.parent is None:
+                node.parent = self.root
+        for task in tasks:
+            self.taskIds.observe(task.id)
+            self.tasks[task.id] = task
+        for poolShare in poolShares:
+            self.poolShareIds.observe(poolShare.id)
+            self.poolShares[poolShare.id] = poolShare
+            self.dirtyAllocations.add(poolShare.node)
+        for command in commands:
+            self.commandIds.observe(command.id)
+            self.commands[command.id] = command
+            if isRunningStatus(command.status):
+                self.fairShare.onCommandStatusChange(command, None, command.status)
+            self.readyTasks.onCommandCreation(command)
+
+    def destroy(self):
+        self.unregisterModelListeners()
         self.root = None
         self.nodes.clear()
         self.pools.clear()
@@ -100,8 +161,13 @@ class DispatchTree(object):
         self.tasks.clear()
         self.rules = None
         self.commands.clear()
+        for handle in self.retryTimers.values():
+            self.timers.cancel(handle)
+        self.retryTimers.clear()
         self.poolShares = None
         self.modifiedNodes = None
+        self.dirtyNodes = None
+        self.dirtyAllocations = None
         self.toCreateElements = None
         self.toModifyElements = None
         self.toArchiveElements = None
@@ -119,27 +185,56 @@ class DispatchTree(object):
         return node
 
     def updateCompletionAndStatus(self):
-        self.root.updateCompletionAndStatus()
+        '''
+        | Refreshes completion, status and command counts of the nodes registered in the dirty set.
+        | Nodes are processed from the deepest level up to the root. A node updates its values from its running
+        | counters and, when they have changed, reports the difference to its parent which is processed in turn.
+        | The cost of a call depends on the number of changes since the previous call, not on the size of the tree.
+        '''
+        for node in self.dirtyAllocations:
+            node.updateAllocation()
+        self.dirtyAllocations.clear()
+
+        if not self.dirtyNodes:
+            return
+
+        levels = defaultdict(set)
+        for node in self.dirtyNodes:
+            depth = 0
+            parent = node.parent
+            while parent is not None:
+                depth += 1
+                parent = parent.parent
+            levels[depth].add(node)
+        self.dirtyNodes = set()
+
+        depth = max(levels)
+        while depth >= 0:
+            for node in levels.pop(depth, ()):
+                node.updateCompletionAndStatus()
+                if node.updateContribution():
+                    levels[depth - 1].add(node.parent)
+            depth -= 1
 
     def validateDependencies(self):
-        nodes = set()
+        # dependency counters are maintained on status changes, we only have to update the commands
+        # of the tasks depending on the modified nodes, once per task
+        nodesByTask = {}
         for dependency in self.modifiedNodes:
             for node in dependency.reverseDependencies:
-                nodes.add(node)
+                if isinstance(node, TaskNode) and node.task is not None:
+                    nodesByTask[node.task.id] = node
         del self.modifiedNodes[:]
-        for node in nodes:
+        for node in nodesByTask.itervalues():
             # logger.debug("Dependencies on %r = %r"% (node.name, node.checkDependenciesSatisfaction() ) )
-            if not hasattr(node, "task") or node.task is None:
-                continue
-            if isinstance(node, TaskNode):
-                if node.checkDependenciesSatisfaction():
-                    for cmd in node.task.commands:
-                        if cmd.status == CMD_BLOCKED:
-                            cmd.status = CMD_READY
-                else:
-                    for cmd in node.task.commands:
-                        if cmd.status == CMD_READY:
-                            cmd.status = CMD_BLOCKED
+            if node.checkDependenciesSatisfaction():
+                for cmd in node.task.commands:
+                    if cmd.status == CMD_BLOCKED:
+                        cmd.status = CMD_READY
+            else:
+                for cmd in node.task.commands:
+                    if cmd.status == CMD_READY:
+                        cmd.status = CMD_BLOCKED
 
             # TODO: may be needed to check dependencies on task groups
             #       so far, a hack is done on the client side when submitting:
@@ -335,21 +430,20 @@ class DispatchTree(object):
         self.toModifyElements = []
         self.toArchiveElements = []
 
-    ## Recalculates the max ids of all elements. Generally called after a reload from db.
+    ## Initializes the id allocators with the max ids of the archived elements, read once from the stat DB.
+    # The allocators then only rely on the ids of the elements of the tree.
+    # @param reservations an IdReservations instance, or None to allocate ids without reserving them
     #
-    def recomputeMaxIds(self):
-        self.nodeMaxId = max([n.id for n in self.nodes.values()]) if self.nodes else 0
-        self.nodeMaxId = max(self.nodeMaxId, StatDB.getFolderNodesMaxId(), StatDB.getTaskNodesMaxId())
-        self.poolMaxId = max([p.id for p in self.pools.values()]) if self.pools else 0
-        self.poolMaxId = max(self.poolMaxId,  StatDB.getPoolsMaxId())
-        self.renderNodeMaxId = max([rn.id for rn in self.renderNodes.values()]) if self.renderNodes else 0
-        self.renderNodeMaxId = max(self.renderNodeMaxId, StatDB.getRenderNodesMaxId())
-        self.taskMaxId = max([t.id for t in self.tasks.values()]) if self.tasks else 0
-        self.taskMaxId = max(self.taskMaxId , StatDB.getTasksMaxId(), StatDB.getTaskGroupsMaxId())
-        self.commandMaxId = max([c.id for c in self.commands.values()]) if self.commands else 0
-        self.commandMaxId = max(self.commandMaxId, StatDB.getCommandsMaxId())
-        self.poolShareMaxId = max([ps.id for ps in self.poolShares.values()]) if self.poolShares else 0
-        self.poolShareMaxId = max(self.poolShareMaxId, StatDB.getPoolSharesMaxId())
+    def initIdAllocators(self, reservations=None):
+        self.nodeIds.observe(max(StatDB.getFolderNodesMaxId(), StatDB.getTaskNodesMaxId()))
+        self.poolIds.observe(StatDB.getPoolsMaxId())
+        self.renderNodeIds.observe(StatDB.getRenderNodesMaxId())
+        self.taskIds.observe(max(StatDB.getTasksMaxId(), StatDB.getTaskGroupsMaxId()))
+        self.commandIds.observe(StatDB.getCommandsMaxId())
+        self.poolShareIds.observe(StatDB.getPoolSharesMaxId())
+        if reservations is not None:
+            for allocator in (self.nodeIds, self.poolIds, self.renderNodeIds, self.taskIds, self.commandIds, self.poolShareIds):
+                allocator.setReservations(reservations)
 
     ## Removes from the dispatchtree the provided element and all its parents and children.
     #
@@ -415,6 +509,7 @@ class DispatchTree(object):
         elif isinstance(element, Command):
             del self.commands[element.id]
             self.toArchiveElements.append(element)
+            self.onCommandRemoval(element)
 
     ### methods called after interaction with a Task
 
@@ -422,11 +517,10 @@ class DispatchTree(object):
         # logger.info("  -- on task creation: %s" % task)
 
         if task.id is None:
-            self.taskMaxId += 1
-            task.id = self.taskMaxId
+            task.id = self.taskIds.allocate()
             self.toCreateElements.append(task)
         else:
-            self.taskMaxId = max(self.taskMaxId, task.id, StatDB.getTasksMaxId(), StatDB.getTaskGroupsMaxId())
+            self.taskIds.observe(task.id)
         self.tasks[task.id] = task
 
     def onTaskDestruction(self, task):
@@ -443,52 +537,68 @@ class DispatchTree(object):
         """
         if field == "tags":
             self.toModifyElements.append(task)
+            for node in task.nodes.values():
+                self.jobIndex.markDirty(node)
 
     ### methods called after interaction with a BaseNode
 
     def onNodeCreation(self, node):
         # logger.info("  -- on node creation: %s" % node)
         if node.id is None:
-            self.nodeMaxId += 1
-            node.id = self.nodeMaxId
+            node.id = self.nodeIds.allocate()
             self.toCreateElements.append(node)
         else:
-            self.nodeMaxId = max(self.nodeMaxId, node.id, StatDB.getFolderNodesMaxId(), StatDB.getTaskNodesMaxId())
+            self.nodeIds.observe(node.id)
         if node.parent is None:
             node.parent = self.root
+        self.changeLog.nodes.add(node)
+        self.farmCounters.onNodeCreation(node)
 
     def onNodeDestruction(self, node):
         # logger.info("  -- on node destruction: %s" % node)
         del self.nodes[node.id]
+        self.changeLog.nodes.add(node)
 
     def onNodeChange(self, node, field, oldvalue, newvalue):
         # logger.info("  -- on node change: %s [ %s = %s -> %s ]" % (node,field, oldvalue, newvalue) )
         # FIXME: do something when nodes are reparented from or to the root node
         if node.id is not None:
             self.toModifyElements.append(node)
+            self.changeLog.nodes.add(node)
             if field == "status" and node.reverseDependencies:
                 self.modifiedNodes.append(node)
+        if field == "status":
+            self.farmCounters.onNodeStatusChange(node, oldvalue, newvalue)
+        if field == "poolShares":
+            self.dirtyAllocations.add(node)
+        if field in INDEXED_FIELDS:
+            self.jobIndex.markDirty(node)
 
     ### methods called after interaction with a RenderNode
 
     def onRenderNodeCreation(self, renderNode):
         if renderNode.id is None:
-            self.renderNodeMaxId += 1
-            renderNode.id = self.renderNodeMaxId
+            renderNode.id = self.renderNodeIds.allocate()
             self.toCreateElements.append(renderNode)
         else:
-            self.renderNodeMaxId = max(self.renderNodeMaxId, renderNode.id, StatDB.getRenderNodesMaxId())
+            self.renderNodeIds.observe(renderNode.id)
         self.renderNodes[renderNode.name] = renderNode
+        self.changeLog.rendernodes.add(renderNode)
+        self.farmCounters.addRenderNode(renderNode)
 
     def onRenderNodeDestruction(self, rendernode):
         try:
             del self.renderNodes[rendernode.name]
             self.toArchiveElements.append(rendernode)
+            self.changeLog.rendernodes.add(rendernode)
+            self.farmCounters.removeRenderNode(rendernode)
         except KeyError:
             # TOFIX: use of class method vs obj method in changeListener might generate a duplicate call
             logger.warning("RN %s seems to have been deleted already." % rendernode.name)
 
     def onRenderNodeChange(self, rendernode, field, oldvalue, newvalue):
+        self.changeLog.rendernodes.add(rendernode)
+        self.farmCounters.onRenderNodeChange(rendernode, field, oldvalue, newvalue)
         if field == "performance":
             self.toModifyElements.append(rendernode)
 
@@ -496,45 +606,96 @@ class DispatchTree(object):
 
     def onPoolCreation(self, pool):
         if pool.id is None:
-            self.poolMaxId += 1
-            pool.id = self.poolMaxId
+            pool.id = self.poolIds.allocate()
             self.toCreateElements.append(pool)
         else:
-            self.poolMaxId = max(self.poolMaxId, pool.id, StatDB.getPoolsMaxId())
+            self.poolIds.observe(pool.id)
         self.pools[pool.name] = pool
+        self.changeLog.touch()
 
     def onPoolDestruction(self, pool):
         del self.pools[pool.name]
         self.toArchiveElements.append(pool)
+        self.changeLog.touch()
 
     def onPoolChange(self, pool, field, oldvalue, newvalue):
         if pool not in self.toModifyElements:
             self.toModifyElements.append(pool)
+        self.changeLog.touch()
 
     ### methods called after interaction with a Command
 
     def onCommandCreation(self, command):
         if command.id is None:
-            self.commandMaxId += 1
-            command.id = self.commandMaxId
+            command.id = self.commandIds.allocate()
             self.toCreateElements.append(command)
         else:
-            self.commandMaxId = max(self.commandMaxId, command.id, StatDB.getCommandsMaxId())
+            self.commandIds.observe(command.id)
         self.commands[command.id] = command
+        self.changeLog.commands.add(command)
+        self.farmCounters.onCommandCreation(command)
+        self.readyTasks.onCommandCreation(command)
 
     def onCommandChange(self, command, field, oldvalue, newvalue):
         self.toModifyElements.append(command)
+        self.changeLog.commands.add(command)
+        if field == "status":
+            self.farmCounters.onCommandStatusChange(oldvalue, newvalue)
+            self.onCommandStatusChange(command, oldvalue, newvalue)
         if command.task is not None:
             for node in command.task.nodes.values():
-                node.invalidate()
+                if node.onCommandChange(field, oldvalue, newvalue):
+                    self.dirtyNodes.add(node)
+
+    def onCommandStatusChange(self, command, oldvalue, newvalue):
+        '''
+        Counts the cores used by the running commands in the fair share and the ready commands of the tasks.
+        Schedules the auto retry of a failed command with attempts left, the attempt has already been counted by
+        the CommandDatesUpdater. A pending retry is cancelled when the status of the command changes meanwhile
+        (e.g. restarted or cancelled by a user).
+        '''
+        self.fairShare.onCommandStatusChange(command, oldvalue, newvalue)
+        self.readyTasks.onCommandStatusChange(command, oldvalue, newvalue)
+        handle = self.retryTimers.pop(command.id, None)
+        if handle is not None:
+            self.timers.cancel(handle)
+        if newvalue == CMD_ERROR and command.task is not None and command.attempt < command.task.maxAttempt:
+            delay = singletonconfig.get('CORE', 'DELAY_BEFORE_AUTORETRY')
+            logger.debug("Mark command %d for auto retry in %ds  (%d/%d)" % (command.id, delay, command.attempt, command.task.maxAttempt))
+            self.retryTimers[command.id] = self.timers.schedule(delay, self.autoretry, command)
+
+    def onCommandRemoval(self, command):
+        '''
+        Forgets a command removed from the tree (i.e. archived with its task) in the counters and indexes kept
+        by the listeners, and cancels its pending auto retry.
+        '''
+        self.changeLog.commands.add(command)
+        self.farmCounters.onCommandRemoval(command)
+        self.fairShare.onCommandRemoval(command)
+        self.readyTasks.onCommandRemoval(command)
+        handle = self.retryTimers.pop(command.id, None)
+        if handle is not None:
+            self.timers.cancel(handle)
+
+    def autoretry(self, command):
+        self.retryTimers.pop(command.id, None)
+        if self.commands.get(command.id) is command and command.status == CMD_ERROR:
+            command.autoretry()
 
     ### methods called after interaction with a Pool
 
     def onPoolShareCreation(self, poolShare):
         if poolShare.id is None:
-            self.poolShareMaxId += 1
-            poolShare.id = self.poolShareMaxId
+            poolShare.id = self.poolShareIds.allocate()
             self.toCreateElements.append(poolShare)
         else:
-            self.poolShareMaxId = max(self.poolShareMaxId, poolShare.id, StatDB.getPoolSharesMaxId())
+            self.poolShareIds.observe(poolShare.id)
         self.poolShares[poolShare.id] = poolShare
+        self.dirtyAllocations.add(poolShare.node)
+        self.jobIndex.markDirty(poolShare.node)
+        self.changeLog.touch()
+
+    def onPoolShareChange(self, poolShare, field, oldvalue, newvalue):
+        self.changeLog.touch()
+        if field in ("allocatedRN", "maxRN"):
+            self.dirtyAllocations.add(poolShare.node)
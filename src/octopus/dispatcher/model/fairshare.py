@@ -0,0 +1,239 @@
+"""
+Hierarchical fair share of the render nodes of the pools: pool -> prod -> user -> job.
+
+Each entity of the hierarchy is identified by its path, e.g. (pool, prod, user, job id) for a job, and has a
+configured share (the CORE.FAIRSHARE_PROD_SHARES and CORE.FAIRSHARE_USER_SHARES weights, 1 by default, and the
+dispatch key for the jobs). The engine keeps the usage of each entity in core-seconds, decayed exponentially with
+a half-life of CORE.FAIRSHARE_HALF_LIFE seconds: the usage is only updated when a command starts or ends on the
+entity (the number of running cores changes), its current value is computed from the last update.
+
+The render nodes of a pool are split top-down between the active entities of each level: an entity gets
+share * 2 ** (-usage / share) of its parent (share and usage normalized among its active siblings), so an
+entity which used more than its share during the last hours gets less than its share until the usages match the
+shares again. The targets of the jobs are then capped to their demand, the render nodes they cannot use being
+given to the other jobs. Computing the targets takes a time proportional to the number of active entities.
+"""
+
+import logging
+import time
+from math import exp, log
+
+from octopus.core import singletonconfig
+from octopus.core.enums.command import isRunningStatus
+from octopus.dispatcher.model.readytasks import getTaskNode, getEntryPoint
+
+LOGGER = logging.getLogger('main.dispatcher.fairshare')
+
+# levels of the hierarchy below the pool
+LEVELS = ('prod', 'user', 'job')
+
+# the usages decayed below this value (in core-seconds) are forgotten
+MIN_USAGE = 1.0
+
+
+class Usage(object):
+    '''
+    Decayed core-seconds of an entity at a given time, and number of cores it has been running since.
+    '''
+    __slots__ = ('value', 'rate', 'time')
+
+    def __init__(self, now):
+        self.value = 0.0
+        self.rate = 0
+        self.time = now
+
+    def at(self, now, decay):
+        elapsed = now - self.time
+        if elapsed <= 0:
+            return self.value
+        factor = exp(-decay * elapsed)
+        return self.value * factor + self.rate * (1.0 - factor) / decay
+
+    def advance(self, now, decay):
+        self.value = self.at(now, decay)
+        self.time = max(now, self.time)
+
+
+class FairShare(object):
+
+    def __init__(self, halfLife=14400.0, prodShares=None, userShares=None):
+        self.setHalfLife(halfLife)
+        # level -> name -> share
+        self.shares = {'prod': prodShares or {}, 'user': userShares or {}}
+        # path -> Usage, for the path of each running command and all its prefixes
+        self.usages = {}
+        # key (command id) -> (path, cores)
+        self.running = {}
+
+    def setHalfLife(self, halfLife):
+        self.halfLife = float(halfLife)
+        self.decay = log(2) / self.halfLife
+
+    ## Reads the half-life and the shares from the config (i.e. CORE.FAIRSHARE_*), they may be reloaded.
+    #
+    def configure(self):
+        halfLife = singletonconfig.get('CORE', 'FAIRSHARE_HALF_LIFE', 14400.0)
+        if halfLife != self.halfLife:
+            self.setHalfLife(halfLife)
+        self.shares = {'prod': singletonconfig.get('CORE', 'FAIRSHARE_PROD_SHARES', {}),
+                       'user': singletonconfig.get('CORE', 'FAIRSHARE_USER_SHARES', {})}
+
+    ## Counts the cores used by a command on the entities of the path from now on.
+    #
+    def start(self, key, path, cores, now=None):
+        if key in self.running:
+            self.stop(key, now)
+        self.running[key] = (path, cores)
+        self.addRate(path, cores, now)
+
+    def stop(self, key, now=None):
+        entry = self.running.pop(key, None)
+        if entry is not None:
+            self.addRate(entry[0], -entry[1], now)
+
+    def addRate(self, path, cores, now):
+        if now is None:
+            now = time.time()
+        for i in xrange(1, len(path) + 1):
+            usage = self.usages.get(path[:i])
+            if usage is None:
+                usage = self.usages[path[:i]] = Usage(now)
+            usage.advance(now, self.decay)
+            usage.rate += cores
+
+    def getUsage(self, path, now=None):
+        usage = self.usages.get(path)
+        if usage is None:
+            return 0.0
+        return usage.at(time.time() if now is None else now, self.decay)
+
+    ## Forgets the entities which are not running anything and whose usage has decayed.
+    #
+    def purge(self, now=None):
+        if now is None:
+            now = time.time()
+        for (path, usage) in self.usages.items():
+            if not usage.rate and usage.at(now, self.decay) < MIN_USAGE:
+                del self.usages[path]
+
+    ## Splits the capacity of a pool between its active jobs.
+    # @param jobs a list of (path, weight, demand) tuples, path being (pool, prod, user, job) and demand the max
+    #        number of render nodes the job can use
+    # @param capacity the number of render nodes to split
+    # @return a dict of the number of render nodes of each job path
+    #
+    def computeTargets(self, jobs, capacity, now=None):
+        if now is None:
+            now = time.time()
+        if not jobs:
+            return {}
+        # active children of each entity, and share of each entity
+        children = {}
+        weights = {}
+        for (path, weight, demand) in jobs:
+            for i in xrange(1, len(path)):
+                child = path[:i + 1]
+                if child in weights:
+                    continue
+                children.setdefault(path[:i], []).append(child)
+                if i == len(path) - 1:
+                    weights[child] = max(float(weight), 0.0)
+                else:
+                    weights[child] = float(self.shares[LEVELS[i - 1]].get(path[i], 1.0))
+        # fraction of the pool given to each entity, from the top of the hierarchy
+        fractions = {}
+        for pool in set(path[:1] for (path, weight, demand) in jobs):
+            fractions[pool] = 1.0
+            parents = [pool]
+            while parents:
+                parent = parents.pop()
+                siblings = children.get(parent)
+                if not siblings:
+                    continue
+                self.splitFraction(parent, siblings, weights, fractions, now)
+                parents.extend(siblings)
+        return self.fill(jobs, fractions, capacity)
+
+    def splitFraction(self, parent, siblings, weights, fractions, now):
+        totalWeight = sum(weights[path] for path in siblings) or 1.0
+        usages = dict((path, self.getUsage(path, now)) for path in siblings)
+        totalUsage = sum(usages.values())
+        factors = {}
+        for path in siblings:
+            share = weights[path] / totalWeight
+            if share <= 0:
+                factors[path] = 0.0
+            elif totalUsage > 0:
+                factors[path] = share * 2 ** (-usages[path] / totalUsage / share)
+            else:
+                factors[path] = share
+        totalFactor = sum(factors.values()) or 1.0
+        for path in siblings:
+            fractions[path] = fractions[parent] * factors[path] / totalFactor
+
+    def fill(self, jobs, fractions, capacity):
+        '''
+        Gives the capacity to the jobs according to their fraction, the jobs asking for less than their part get
+        their demand and the rest is split again between the other jobs.
+        '''
+        targets = {}
+        remaining = capacity
+        active = [(path, demand) for (path, weight, demand) in jobs]
+        while active:
+            total = sum(fractions[path] for (path, demand) in active)
+            if total <= 0:
+                break
+            saturated = [(path, demand) for (path, demand) in active if demand <= remaining * fractions[path] / total]
+            if not saturated:
+                break
+            for (path, demand) in saturated:
+                targets[path] = demand
+                remaining -= demand
+            active = [item for item in active if item[0] not in targets]
+        if not active:
+            return targets
+        # largest remainders
+        total = sum(fractions[path] for (path, demand) in active) or 1.0
+        parts = [(remaining * fractions[path] / total, path) for (path, demand) in active]
+        for (part, path) in parts:
+            targets[path] = int(part)
+        left = remaining - sum(int(part) for (part, path) in parts)
+        for (part, path) in sorted(parts, key=lambda item: item[0] - int(item[0]), reverse=True)[:max(left, 0)]:
+            targets[path] += 1
+        return targets
+
+    # usage of the commands, called by the listeners of the dispatch tree
+
+    def onCommandStatusChange(self, command, oldvalue, newvalue):
+        wasRunning = oldvalue is not None and isRunningStatus(oldvalue)
+        if isRunningStatus(newvalue):
+            if not wasRunning or command.id not in self.running:
+                path = getCommandPath(command)
+                if path is not None:
+                    self.start(command.id, path, getCommandCores(command))
+        elif wasRunning:
+            self.stop(command.id)
+
+    def onCommandRemoval(self, command):
+        self.stop(command.id)
+
+
+def getJobPath(job):
+    '''
+    Returns the (pool, prod, user, job id) path of a node holding a poolshare.
+    '''
+    tags = job.tags or {}
+    return (job.mainPoolShare().pool.name, tags.get('prod', ''), job.user, job.id)
+
+
+def getCommandPath(command):
+    job = getEntryPoint(getTaskNode(command.task))
+    if job is None:
+        return None
+    return getJobPath(job)
+
+
+def getCommandCores(command):
+    if command.renderNode is None:
+        return 1
+    return command.renderNode.usedCoresNumber.get(command.id) or 1
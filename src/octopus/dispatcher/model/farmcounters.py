@@ -0,0 +1,176 @@
+"""
+Counters of the farm kept up to date by the listeners of the dispatch tree, read by /stats and /mobile.
+
+Commands, render nodes and jobs (i.e. the children of the /graphs folder node) are counted by status, the
+cores of the known render nodes (i.e. not in the unknown status) are summed. Each creation, change of status or
+removal of a command from the tree updates the counters in constant time, so reading them does not walk the
+model. The elements restored from the database are not seen by the listeners, the counters are recounted from
+the whole tree when the jobs folder changes (i.e. on first use and after a reload) and by the periodic
+self-check of the dispatcher.
+"""
+
+import logging
+
+from octopus.core.enums.rendernode import RN_UNKNOWN
+from octopus.dispatcher.model.jobindex import JOBS_FOLDER_ID
+
+LOGGER = logging.getLogger('main.dispatcher.dispatchtree')
+
+
+class FarmCounters(object):
+
+    def __init__(self):
+        self.folder = None
+        # status -> count
+        self.commands = {}
+        self.renderNodes = {}
+        self.jobs = {}
+        # job node -> status counted for the job
+        self.jobStatus = {}
+        # render node -> (status, cores, free cores) counted for the render node
+        self.renderNodeState = {}
+        self.totalCores = 0
+        self.idleCores = 0
+
+    def count(self, counters, status, delta=1):
+        counters[status] = counters.get(status, 0) + delta
+
+    # commands
+
+    def onCommandCreation(self, command):
+        self.count(self.commands, command.status)
+
+    def onCommandStatusChange(self, oldvalue, newvalue):
+        self.count(self.commands, oldvalue, -1)
+        self.count(self.commands, newvalue)
+
+    def onCommandRemoval(self, command):
+        self.count(self.commands, command.status, -1)
+
+    # render nodes
+
+    def countRenderNode(self, state, sign):
+        (status, cores, freeCores) = state
+        self.count(self.renderNodes, status, sign)
+        if status != RN_UNKNOWN:
+            self.totalCores += sign * cores
+            self.idleCores += sign * freeCores
+
+    def addRenderNode(self, renderNode):
+        '''
+        Counts the render node with its current values, instead of the values counted before if any.
+        The change events of a render node may be received twice (its instance listeners are the listeners
+        of its class), so the counters are not updated from the old and new values of the events.
+        '''
+        self.removeRenderNode(renderNode)
+        state = self.renderNodeState[renderNode] = (renderNode.status, renderNode.coresNumber, renderNode.freeCoresNumber)
+        self.countRenderNode(state, 1)
+
+    def removeRenderNode(self, renderNode):
+        state = self.renderNodeState.pop(renderNode, None)
+        if state is not None:
+            self.countRenderNode(state, -1)
+
+    def onRenderNodeChange(self, renderNode, field, oldvalue, newvalue):
+        if field in ('status', 'coresNumber', 'freeCoresNumber') and renderNode in self.renderNodeState:
+            self.addRenderNode(renderNode)
+
+    # jobs
+
+    def addJob(self, node):
+        if node not in self.jobStatus:
+            self.jobStatus[node] = node.status
+            self.count(self.jobs, node.status)
+
+    def removeJob(self, node):
+        status = self.jobStatus.pop(node, None)
+        if status is not None:
+            self.count(self.jobs, status, -1)
+
+    def onNodeCreation(self, node):
+        if node.parent is self.folder and self.folder is not None:
+            self.addJob(node)
+
+    def onNodeStatusChange(self, node, oldvalue, newvalue):
+        if node in self.jobStatus:
+            self.count(self.jobs, self.jobStatus[node], -1)
+            self.jobStatus[node] = newvalue
+            self.count(self.jobs, newvalue)
+
+    # listener of the jobs folder (@see BaseNode.fireChildAddedEvent)
+
+    def onChildAddedEvent(self, folder, child):
+        # a job being created has no status yet, it is counted by onNodeCreation
+        if child.__dict__.get('_changeReady'):
+            self.addJob(child)
+
+    def onChildRemovedEvent(self, folder, child):
+        self.removeJob(child)
+
+    def onChangeEvent(self, obj, field, oldvalue, newvalue):
+        pass
+
+    def onDestructionEvent(self, obj):
+        pass
+
+    ## Counts the whole tree again.
+    #
+    def recount(self, tree):
+        if self.folder is not None and self in self.folder.changeListeners:
+            self.folder.changeListeners.remove(self)
+        self.__init__()
+        for command in tree.commands.values():
+            self.onCommandCreation(command)
+        for renderNode in tree.renderNodes.values():
+            self.addRenderNode(renderNode)
+        self.folder = tree.nodes.get(JOBS_FOLDER_ID)
+        if self.folder is not None:
+            self.folder.changeListeners.append(self)
+            for node in self.folder.children:
+                self.addJob(node)
+
+    def getCounters(self, tree):
+        '''
+        Returns a dict of the counters, the whole tree is counted first if its jobs folder changed.
+        '''
+        if self.folder is not tree.nodes.get(JOBS_FOLDER_ID):
+            self.recount(tree)
+        return {'commands': dict(self.commands),
+                'renderNodes': dict(self.renderNodes),
+                'jobs': dict(self.jobs),
+                'totalCores': self.totalCores,
+                'idleCores': self.idleCores}
+
+    ## Compares the counters with a full count of the tree, logs and fixes the drift if any.
+    # @return True if the counters were right
+    #
+    def check(self, tree):
+        counters = self.getCounters(tree)
+        expected = FarmCounters()
+        expected.folder = self.folder
+        for command in tree.commands.values():
+            expected.onCommandCreation(command)
+        for renderNode in tree.renderNodes.values():
+            expected.addRenderNode(renderNode)
+        if self.folder is not None:
+            for node in self.folder.children:
+                expected.addJob(node)
+        expectedCounters = {'commands': expected.commands,
+                            'renderNodes': expected.renderNodes,
+                            'jobs': expected.jobs,
+                            'totalCores': expected.totalCores,
+                            'idleCores': expected.idleCores}
+        drift = False
+        for (name, value) in counters.items():
+            if isinstance(value, dict):
+                # statuses with a null count are not always present
+                value = dict(item for item in value.items() if item[1])
+                expectedValue = dict(item for item in expectedCounters[name].items() if item[1])
+            else:
+                expectedValue = expectedCounters[name]
+            if value != expectedValue:
+                LOGGER.warning("Farm counters drift on %s: counted %r instead of %r" % (name, value, expectedValue))
+                drift = True
+        if drift:
+            self.recount(tree)
+        return not drift
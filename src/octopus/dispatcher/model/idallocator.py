@@ -0,0 +1,80 @@
+"""
+In-memory allocation of the ids of the model elements.
+
+The max ids of the archived elements are read once at startup, the ids are then allocated from memory.
+When a reservation file is given, ids are reserved by blocks and the end of the current block is saved
+before any id of the block is given, so that ids given before a restart (and maybe not written to the
+database yet) are never given again.
+"""
+
+from __future__ import with_statement
+
+import os
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+class IdReservations(object):
+    '''
+    Saves the last id reserved for each kind of element in a local file.
+    '''
+
+    def __init__(self, path, blockSize):
+        self.path = path
+        self.blockSize = blockSize
+        self.reserved = {}
+        if os.path.exists(path):
+            with open(path) as reservationFile:
+                self.reserved = json.load(reservationFile)
+        else:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    def get(self, name):
+        return self.reserved.get(name, 0)
+
+    def reserve(self, name, firstId):
+        '''
+        Reserves a block of ids starting at firstId and returns the last id of the block.
+        '''
+        self.reserved[name] = firstId + self.blockSize - 1
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as reservationFile:
+            json.dump(self.reserved, reservationFile)
+            reservationFile.flush()
+            os.fsync(reservationFile.fileno())
+        os.rename(tmpPath, self.path)
+        return self.reserved[name]
+
+
+class IdAllocator(object):
+    '''
+    Allocates the ids of one kind of element.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.maxId = 0
+        self.reservations = None
+        self.reservedId = 0
+
+    def setReservations(self, reservations):
+        self.reservations = reservations
+        self.observe(reservations.get(self.name))
+        self.reservedId = self.maxId
+
+    def allocate(self):
+        self.maxId += 1
+        if self.reservations is not None and self.maxId > self.reservedId:
+            self.reservedId = self.reservations.reserve(self.name, self.maxId)
+        return self.maxId
+
+    def observe(self, id):
+        '''
+        Records an id given outside of the allocator (i.e. an element reloaded from the database).
+        '''
+        if id > self.maxId:
+            self.maxId = id
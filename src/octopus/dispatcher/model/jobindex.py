@@ -0,0 +1,237 @@
+"""
+Secondary indexes over the jobs of the dispatch tree (i.e. the children of the /graphs folder node).
+
+The jobs are indexed by user, prod, shot, pool and status in hash indexes (value -> set of ids) and by
+creation, start and end time in sorted lists of (time, id). The dispatch tree marks a job dirty when one of
+its indexed values changes, the dirty jobs are indexed again by the next query. A query intersects the sets
+of ids given by the indexes of its constraints, the constraints without index (i.e. names) are then checked
+on the remaining jobs only.
+"""
+
+from __future__ import with_statement
+
+import re
+from bisect import bisect_left, insort
+from datetime import datetime
+from threading import Lock
+
+# id of the folder node holding the jobs
+JOBS_FOLDER_ID = 1
+
+# fields of the nodes changing the indexed values of a job
+INDEXED_FIELDS = frozenset(('status', 'user', 'creationTime', 'startTime', 'endTime', 'poolShares', 'taskGroup'))
+
+HASH_INDEXES = ('status', 'user', 'prod', 'shot', 'pool')
+TIME_INDEXES = ('creationTime', 'startTime', 'endTime')
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# max number of compiled regexes and parsed dates kept
+CACHE_SIZE = 256
+
+
+class JobIndex(object):
+
+    def __init__(self):
+        self.lock = Lock()
+        self.folder = None
+        self.jobs = {}
+        self.keys = {}
+        self.hashIndexes = dict((name, {}) for name in HASH_INDEXES)
+        self.timeIndexes = dict((name, []) for name in TIME_INDEXES)
+        self.dirty = set()
+        self.regexes = {}
+        self.timestamps = {}
+
+    ## Marks a node whose indexed values may have changed, ignored if it is not a job.
+    #
+    def markDirty(self, node):
+        if node.parent is self.folder and self.folder is not None:
+            with self.lock:
+                self.dirty.add(node)
+
+    # listener of the jobs folder (@see BaseNode.fireChildAddedEvent)
+
+    def onChildAddedEvent(self, folder, child):
+        with self.lock:
+            self.dirty.add(child)
+
+    def onChildRemovedEvent(self, folder, child):
+        with self.lock:
+            self.dirty.add(child)
+
+    def onChangeEvent(self, obj, field, oldvalue, newvalue):
+        pass
+
+    def onDestructionEvent(self, obj):
+        pass
+
+    def getJobKeys(self, job):
+        tags = job.tags
+        return {'status': (job.status,),
+                'user': (job.user,),
+                'prod': (tags.get('prod'),),
+                'shot': (tags.get('shot'),),
+                'pool': tuple(pool.name for pool in job.poolShares.keys()),
+                'creationTime': job.creationTime,
+                'startTime': job.startTime,
+                'endTime': job.endTime}
+
+    def addJob(self, job):
+        keys = self.keys[job.id] = self.getJobKeys(job)
+        self.jobs[job.id] = job
+        for name in HASH_INDEXES:
+            index = self.hashIndexes[name]
+            for value in keys[name]:
+                index.setdefault(value, set()).add(job.id)
+        for name in TIME_INDEXES:
+            if keys[name] is not None:
+                insort(self.timeIndexes[name], (keys[name], job.id))
+
+    def removeJob(self, id):
+        keys = self.keys.pop(id)
+        del self.jobs[id]
+        for name in HASH_INDEXES:
+            index = self.hashIndexes[name]
+            for value in keys[name]:
+                ids = index[value]
+                ids.discard(id)
+                if not ids:
+                    del index[value]
+        for name in TIME_INDEXES:
+            if keys[name] is not None:
+                index = self.timeIndexes[name]
+                del index[bisect_left(index, (keys[name], id))]
+
+    ## Brings the indexes up to date with the jobs folder of the given tree.
+    #
+    def refresh(self, tree):
+        folder = tree.nodes.get(JOBS_FOLDER_ID)
+        if folder is not self.folder:
+            # first query or new tree (i.e. reloaded from the database), index every job
+            if self.folder is not None:
+                self.folder.changeListeners.remove(self)
+            self.__init__()
+            self.folder = folder
+            if folder is None:
+                return
+            folder.changeListeners.append(self)
+            self.dirty.update(folder.children)
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        for job in dirty:
+            if job.id in self.keys:
+                self.removeJob(job.id)
+            if job.parent is folder:
+                self.addJob(job)
+
+    def getRegex(self, patterns):
+        key = tuple(patterns)
+        regex = self.regexes.get(key)
+        if regex is None:
+            if len(self.regexes) >= CACHE_SIZE:
+                self.regexes.clear()
+            regex = self.regexes[key] = re.compile('|'.join(patterns))
+        return regex
+
+    def getTimestamp(self, date):
+        '''
+        Returns the timestamp of a "YYYY-mm-dd HH:MM:SS" date, raises ValueError if the date is invalid.
+        '''
+        timestamp = self.timestamps.get(date)
+        if timestamp is None:
+            if len(self.timestamps) >= CACHE_SIZE:
+                self.timestamps.clear()
+            timestamp = self.timestamps[date] = int(datetime.strptime(date, DATE_FORMAT).strftime('%s'))
+        return timestamp
+
+    def getIds(self, name, values):
+        index = self.hashIndexes[name]
+        ids = set()
+        for value in values:
+            ids.update(index.get(value, ()))
+        return ids
+
+    def getIdsFrom(self, name, timestamp):
+        index = self.timeIndexes[name]
+        return set(id for (value, id) in index[bisect_left(index, (timestamp,)):])
+
+    def select(self, idSets, checks, used):
+        '''
+        Intersects the sets of ids (smallest first), then applies the checks to the remaining jobs.
+        Returns the matching jobs sorted by id (i.e. by creation).
+        '''
+        if idSets:
+            idSets.sort(key=len)
+            ids = idSets[0].intersection(*idSets[1:])
+        else:
+            ids = self.jobs
+            used.append('scan')
+        jobs = [self.jobs[id] for id in sorted(ids)]
+        for check in checks:
+            jobs = [job for job in jobs if check(job)]
+        return jobs
+
+    ## Returns the jobs matching the constraint_* arguments of a /query request and the names of the indexes used.
+    # @see IQueryNode.filterNodes for the semantics of the constraints
+    # @raise ValueError if a date constraint is invalid
+    #
+    def filterNodes(self, args, tree):
+        self.refresh(tree)
+        idSets = []
+        checks = []
+        used = []
+        if 'constraint_id' in args:
+            idSets.append(set(int(id) for id in args['constraint_id']) & set(self.jobs))
+            used.append('id')
+        if 'constraint_status' in args:
+            idSets.append(self.getIds('status', [int(status) for status in args['constraint_status']]))
+            used.append('status')
+        for name in ('user', 'prod', 'shot', 'pool'):
+            if 'constraint_' + name in args:
+                idSets.append(self.getIds(name, args['constraint_' + name]))
+                used.append(name)
+        for name in TIME_INDEXES:
+            if 'constraint_' + name.lower() in args:
+                idSets.append(self.getIdsFrom(name, self.getTimestamp(args['constraint_' + name.lower()][0])))
+                used.append(name)
+        if 'constraint_name' in args:
+            regex = self.getRegex(args['constraint_name'])
+            checks.append(lambda job: regex.match(job.name))
+        return self.select(idSets, checks, used), used
+
+    ## Returns the jobs matching the filters of a /query/job request and the names of the indexes used.
+    # @see IFilterNode.matchNodes for the semantics of the filters
+    #
+    def matchNodes(self, filters, tree):
+        self.refresh(tree)
+        idSets = []
+        checks = []
+        used = []
+        if 'id' in filters:
+            idSets.append(set(int(id) for id in filters['id']) & set(self.jobs))
+            used.append('id')
+        if 'name' in filters:
+            regex = self.getRegex(filters['name'])
+            checks.append(lambda job: regex.match(job.name))
+        if 'pool' in filters:
+            idSets.append(self.getIds('pool', filters['pool']))
+            used.append('pool')
+        if 'status' in filters:
+            idSets.append(self.getIds('status', filters['status']))
+            used.append('status')
+        if 'tags' in filters:
+            # a job matches if any of its tags matches (OR between tags)
+            tags = filters['tags']
+            if set(tags) <= set(('prod', 'shot')):
+                ids = set()
+                for (name, values) in tags.items():
+                    ids.update(self.getIds(name, values))
+                idSets.append(ids)
+                used.append('tags')
+            else:
+                checks.append(lambda job: any(job.tags.get(name) in values for (name, values) in tags.items() if name in job.tags))
+        if 'user' in filters:
+            idSets.append(self.getIds('user', filters['user']))
+            used.append('user')
+        return self.select(idSets, checks, used), used
@@ -41,7 +41,11 @@ class ModelType(type):
             del attributes[name]
         attributes['FIELDS'] = fields
         attributes['changeListeners'] = []
-        return super(ModelType, cls).__new__(cls, clsname, bases, attributes)
+        newcls = super(ModelType, cls).__new__(cls, clsname, bases, attributes)
+        # the listener lists of the class and of its bases, in mro order: the lists are shared with the classes
+        # so listeners appended or removed later are seen without walking the mro on each event
+        newcls.listenerTable = tuple(base.__dict__['changeListeners'] for base in newcls.__mro__ if 'changeListeners' in base.__dict__)
+        return newcls
 
     def __call__(self, *args, **kwargs):
         instance = super(ModelType, self).__call__(*args, **kwargs)
@@ -50,6 +54,10 @@ class ModelType(type):
         return instance
 
 
+# default value of getattr, distinguishes a missing attribute from an attribute set to None
+MISSING = object()
+
+
 class Model(object):
 
     __metaclass__ = ModelType
@@ -66,11 +74,26 @@ class Model(object):
         self.changeListeners = []
 
     def __setattr__(self, name, value):
-        if hasattr(self, name) and getattr(self, name) == value:
-            return
-        oldvalue = getattr(self, name, None)
-        super(Model, self).__setattr__(name, value)
-        if name in self.FIELDS:
+        instanceDict = self.__dict__
+        if name in instanceDict:
+            oldvalue = instanceDict[name]
+            # writing the current value is a no-op, checked before anything else as it is the most frequent case
+            if oldvalue is value or oldvalue == value:
+                return
+            if name not in self.FIELDS:
+                object.__setattr__(self, name, value)
+                return
+        else:
+            if name not in self.FIELDS:
+                object.__setattr__(self, name, value)
+                return
+            oldvalue = getattr(self, name, MISSING)
+            if oldvalue is MISSING:
+                oldvalue = None
+            elif oldvalue == value:
+                return
+        object.__setattr__(self, name, value)
+        if instanceDict.get('_changeReady'):
             try:
                 self.fireChangeEvent(self, name, oldvalue, value)
             except Exception:
@@ -87,10 +110,9 @@ class Model(object):
 
     @classmethod
     def fireCreationEvent(cls, obj):
-        for base in obj.__class__.__mro__:
-            if hasattr(base, 'changeListeners'):
-                for changeListener in base.changeListeners:
-                    changeListener.onCreationEvent(obj)
+        for changeListeners in obj.__class__.listenerTable:
+            for changeListener in changeListeners:
+                changeListener.onCreationEvent(obj)
 
     @classmethod
     def fireDestructionEvent(cls, obj):
@@ -104,12 +126,11 @@ class Model(object):
 
     @classmethod
     def fireChangeEvent(cls, obj, field, oldvalue, newvalue):
-        if not hasattr(obj, "_changeReady") or not obj._changeReady:
+        if not obj.__dict__.get('_changeReady'):
             return
-        for base in obj.__class__.__mro__:
-            if hasattr(base, 'changeListeners'):
-                for changeListener in base.changeListeners:
-                    changeListener.onChangeEvent(obj, field, oldvalue, newvalue)
+        for changeListeners in obj.__class__.listenerTable:
+            for changeListener in changeListeners:
+                changeListener.onChangeEvent(obj, field, oldvalue, newvalue)
         for changeListener in obj.changeListeners:
             changeListener.onChangeEvent(obj, field, oldvalue, newvalue)
 
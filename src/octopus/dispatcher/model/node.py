@@ -19,6 +19,17 @@ class NoLicenseAvailableForTask(BaseException):
     '''Raised to interrupt the dispatch iteration on an entry point node.'''
 
 
+# Time fields aggregated from the children of a node (or the commands of a task node)
+TIME_AGGREGATES = (('creationTime', min), ('startTime', min), ('updateTime', max), ('endTime', max))
+
+
+def decrementCount(counts, key):
+    '''Decrements a status histogram, removing the key when it reaches 0 so that "in" tests remain valid.'''
+    counts[key] -= 1
+    if counts[key] <= 0:
+        del counts[key]
+
+
 class DependencyListField(models.Field):
     def to_json(self, node):
         return [[dep.id, statusList] for (dep, statusList) in node.dependencies]
@@ -113,8 +124,7 @@ class BaseNode(models.Model):
 
         self.dependencies = []
         self.reverseDependencies = []
-        self.lastDependenciesSatisfaction = False
-        self.lastDependenciesSatisfactionDispatchCycle = -1
+        self.unsatisfiedDependencyCount = 0
         self.readyCommandCount = 0
         self.doneCommandCount = 0
         self.commandCount = 0
@@ -124,6 +134,14 @@ class BaseNode(models.Model):
         self.maxTimeByFrame = 0.0
         self.timer = None
 
+        # Running counters used to refresh the node without iterating over all its children,
+        # see updateCompletionAndStatus() and DispatchTree.updateCompletionAndStatus()
+        self._contribution = None
+        self._statusCounts = defaultdict(int)
+        self._completionSum = 0.0
+        self._times = dict.fromkeys([field for (field, func) in TIME_AGGREGATES])
+        self._timesStale = True
+
     def mainPoolShare(self):
         return self.poolShares.values()[0]
 
@@ -154,24 +172,31 @@ class BaseNode(models.Model):
             self.dependencies.append(val)
             if self not in node.reverseDependencies:
                 node.reverseDependencies.append(self)
+            if node.status not in acceptedStatus:
+                self.unsatisfiedDependencyCount += 1
 
     def checkDependenciesSatisfaction(self):
         # TODO dependencies should be set for restricted node statutes only: DONE, ERROR and CANCELED
+        node = self
+        while node is not None:
+            if node.unsatisfiedDependencyCount:
+                return False
+            node = node.parent
+        return True
 
-        if self.dispatcher.cycle == self.lastDependenciesSatisfactionDispatchCycle:
-            return self.lastDependenciesSatisfaction
-
-        self.lastDependenciesSatisfaction = True
-        self.lastDependenciesSatisfactionDispatchCycle = self.dispatcher.cycle
-        for node, acceptedStatus in self.dependencies:
-            if node.status not in acceptedStatus:
-                self.lastDependenciesSatisfaction = False
-                break
-        else:
-            if self.parent is not None:
-                self.lastDependenciesSatisfaction = self.parent.checkDependenciesSatisfaction()
-
-        return self.lastDependenciesSatisfaction
+    def updateDependentsSatisfaction(self, oldStatus, newStatus):
+        '''
+        Maintains the unsatisfied dependency count of the nodes depending on this node when its status changes.
+        '''
+        if oldStatus == newStatus:
+            return
+        for dependingNode in self.reverseDependencies:
+            for node, acceptedStatus in dependingNode.dependencies:
+                if node is not self:
+                    continue
+                wasSatisfied = oldStatus in acceptedStatus
+                if wasSatisfied != (newStatus in acceptedStatus):
+                    dependingNode.unsatisfiedDependencyCount += 1 if wasSatisfied else -1
 
     def __new__(cls, *args, **kwargs):
 
@@ -184,6 +209,8 @@ class BaseNode(models.Model):
     def __setattr__(self, name, value):
         if name == 'parent':
             self.setParentValue(value)
+        elif name == 'status' and self.__dict__.get('reverseDependencies'):
+            self.updateDependentsSatisfaction(self.__dict__.get('status'), value)
         super(BaseNode, self).__setattr__(name, value)
 
     def setParentValue(self, parent):
@@ -224,6 +251,51 @@ class BaseNode(models.Model):
     def updateCompletionAndStatus(self):
         raise NotImplementedError
 
+    def getContribution(self):
+        '''
+        Returns the values of this node which are aggregated by its parent, in the order:
+        status, readyCommandCount, doneCommandCount, commandCount, completion, creationTime, startTime, updateTime, endTime
+        '''
+        return (self.status, self.readyCommandCount, self.doneCommandCount, self.commandCount, self.completion,
+                self.creationTime, self.startTime, self.updateTime, self.endTime)
+
+    def updateContribution(self):
+        '''
+        Reports the changes of the aggregated values of this node to its parent.
+
+        :returns: True if the parent counters were modified and the parent needs to be refreshed
+        '''
+        contribution = self.getContribution()
+        previous = self._contribution
+        if contribution == previous:
+            return False
+        self._contribution = contribution
+        if self.parent is None:
+            return False
+        self.parent.onChildContributionChange(previous, contribution)
+        return True
+
+    def resetTimes(self, items):
+        '''
+        Recomputes the aggregated time values from the given items (children or commands).
+        '''
+        for field, func in TIME_AGGREGATES:
+            values = [getattr(item, field) for item in items if getattr(item, field) is not None]
+            self._times[field] = func(values) if values else None
+        self._timesStale = False
+
+    def onTimeChange(self, field, oldvalue, newvalue):
+        '''
+        Updates the aggregated time value when the time of a child (or command) has changed.
+        If the current extremum is lost, the values are flagged to be recomputed on next refresh.
+        '''
+        func = dict(TIME_AGGREGATES)[field]
+        current = self._times[field]
+        if newvalue is not None and (current is None or func(current, newvalue) == newvalue):
+            self._times[field] = newvalue
+        elif oldvalue is not None and oldvalue == current:
+            self._timesStale = True
+
     def __repr__(self):
         nodes = [self]
         parent = self.parent
@@ -239,10 +311,12 @@ class BaseNode(models.Model):
     parent_value = property(lambda self: self._parent_value, setParentValue)
 
     def invalidate(self):
+        '''
+        Flags the node for a complete recomputation of its running counters and registers it in the dispatch tree
+        dirty set. Its ancestors are then refreshed incrementally from the resulting changes.
+        '''
         self.invalidated = True
-        while self.parent and not self.parent.invalidated:
-            self.parent.invalidated = True
-            self = self.parent
+        self.dispatcher.dispatchTree.dirtyNodes.add(self)
 
 
 class FolderNode(BaseNode):
@@ -267,6 +341,9 @@ class FolderNode(BaseNode):
     #
     def __init__(self, id, name, parent, user, priority, dispatchKey, maxRN, strategy, creationTime=None, startTime=None, updateTime=None, endTime=None, status=NODE_DONE, taskGroup=None):
         BaseNode.__init__(self, id, name, parent, user, priority, dispatchKey, maxRN, creationTime, startTime, updateTime, endTime, status)
+        self._readyCount = 0
+        self._doneCount = 0
+        self._commandCount = 0
         self.children = []
         self.strategy = strategy
         self.taskGroup = taskGroup
@@ -328,7 +405,10 @@ class FolderNode(BaseNode):
             return
         self.strategy.update(self, ep)
 
-        for child in self.children:
+        for child in self.strategy.iterChildren(self):
+            # all the ready commands of the entry point have been assigned
+            if ep.readyCommandCount <= 0:
+                return
             try:
                 # PRA: only the TaskNode.dispatchIterator() may raise NoRenderNodeAvailable or NoLicenseAvailableForTask
                 for assignment in child.dispatchIterator(stopFunc, ep):
@@ -346,39 +426,78 @@ class FolderNode(BaseNode):
             if stopFunc():
                 return
 
+    def onChildContributionChange(self, previous, contribution):
+        '''
+        Applies to the running counters the difference between the previous and the new contribution of a child.
+        '''
+        if previous is None or self.invalidated:
+            # unknown previous values, counters will be rebuilt on next refresh
+            self.invalidated = True
+            return
+        decrementCount(self._statusCounts, previous[0])
+        self._statusCounts[contribution[0]] += 1
+        self._readyCount += contribution[1] - previous[1]
+        self._doneCount += contribution[2] - previous[2]
+        self._commandCount += contribution[3] - previous[3]
+        self._completionSum += contribution[4] - previous[4]
+        for index, (field, func) in enumerate(TIME_AGGREGATES, 5):
+            if previous[index] != contribution[index]:
+                self.onTimeChange(field, previous[index], contribution[index])
+
+    def rebuildCounters(self):
+        '''
+        Recomputes the running counters from the children, refreshing the invalidated ones first.
+        '''
+        self._statusCounts = defaultdict(int)
+        self._readyCount = 0
+        self._doneCount = 0
+        self._commandCount = 0
+        self._completionSum = 0.0
+        for child in self.children:
+            if child.invalidated:
+                child.updateCompletionAndStatus()
+            contribution = child.getContribution()
+            child._contribution = contribution
+            self._statusCounts[contribution[0]] += 1
+            self._readyCount += contribution[1]
+            self._doneCount += contribution[2]
+            self._commandCount += contribution[3]
+            self._completionSum += contribution[4]
+        self.resetTimes(self.children)
+
     def updateCompletionAndStatus(self):
         """
-        Evaluate new value for completion and status of a particular FolderNode
+        | Evaluate new value for completion and status of a particular FolderNode
+        | Values are computed from the running counters of the node, updated by its children when their own values
+        | change. The children are only iterated when the node has been invalidated.
         """
 
         self.updateAllocation()
 
-        if not self.invalidated:
-            return
-        if not self.children:
-            completion = 1.0
-            status = NODE_DONE
-        else:
+        if self.invalidated:
+            self.rebuildCounters()
+        elif self._timesStale:
+            self.resetTimes(self.children)
 
-            # Getting completion info
+        if not self.children:
             self.readyCommandCount = 0
             self.doneCommandCount = 0
             self.commandCount = 0
-            completion = 0.0
-            status = defaultdict(int)
-            for child in self.children:
-                child.updateCompletionAndStatus()
-                completion += child.completion
-                status[child.status] += 1
-                self.readyCommandCount += child.readyCommandCount
-                self.doneCommandCount += child.doneCommandCount
-                self.commandCount += child.commandCount
+            self.completion = 1.0
+            self.status = NODE_DONE
+        else:
+
+            # Getting completion info
+            self.readyCommandCount = self._readyCount
+            self.doneCommandCount = self._doneCount
+            self.commandCount = self._commandCount
+            status = self._statusCounts
 
-            if hasattr(self, "commandCount") and int(self.commandCount) != 0:
+            if int(self.commandCount) != 0:
                 self.completion = self.doneCommandCount / float(self.commandCount)
             else:
                 # LOGGER.warning("Warning: a folder node without \"commandCount\" value was found -> %s" % self.name  )
-                self.completion = completion / len(self.children)
+                self.completion = self._completionSum / len(self.children)
 
             # Updating node's overall status
             if NODE_PAUSED in status:
@@ -399,28 +518,24 @@ class FolderNode(BaseNode):
                 self.status = NODE_DONE
 
             # Updating timers
-            times = [childNode.creationTime for childNode in self.children if childNode.creationTime is not None]
-            if times:
-                self.creationTime = min(times)
+            if self._times['creationTime'] is not None:
+                self.creationTime = self._times['creationTime']
                 if self.taskGroup and (self.taskGroup.creationTime is None or self.taskGroup.creationTime > self.creationTime):
                     self.taskGroup.creationTime = self.creationTime
 
-            times = [childNode.startTime for childNode in self.children if childNode.startTime is not None]
-            if times:
-                self.startTime = min(times)
+            if self._times['startTime'] is not None:
+                self.startTime = self._times['startTime']
                 if self.taskGroup and (self.taskGroup.startTime is None or self.taskGroup.startTime > self.startTime):
                     self.taskGroup.startTime = self.startTime
 
-            times = [childNode.updateTime for childNode in self.children if childNode.updateTime is not None]
-            if times:
-                self.updateTime = max(times)
+            if self._times['updateTime'] is not None:
+                self.updateTime = self._times['updateTime']
                 if self.taskGroup and (self.taskGroup.updateTime is None or self.taskGroup.updateTime > self.updateTime):
                     self.taskGroup.updateTime = self.updateTime
 
             if isFinalNodeStatus(self.status):
-                times = [childNode.endTime for childNode in self.children if childNode.endTime is not None]
-                if times:
-                    self.endTime = max(times)
+                if self._times['endTime'] is not None:
+                    self.endTime = self._times['endTime']
                     if self.taskGroup and (self.taskGroup.endTime is None or
                                            self.taskGroup.endTime > self.taskGroup.endTime):
                         self.taskGroup.endTime = self.endTime
@@ -431,8 +546,8 @@ class FolderNode(BaseNode):
         self.invalidated = False
         if self.taskGroup:
             self.timer = self.taskGroup.timer
-            # FIXME: suboptimal... lazy update someday ?
-            self.taskGroup.updateStatusAndCompletion()
+            # child taskgroups have already been refreshed with their own folder node
+            self.taskGroup.updateStatusAndCompletion(recursive=False)
 
     def setPaused(self, paused):
         for child in self.children:
@@ -525,6 +640,9 @@ class TaskNode(BaseNode):
             return
         if self.paused:
             return
+        # the timer of the task is the same for all its commands, no render node can run them before it
+        if self.task.timer is not None and time() < self.task.timer:
+            return
 
         # ensure we are treating the commands in the order they arrived
         sorted(self.task.commands, key=lambda x: x.id)
@@ -558,10 +676,9 @@ class TaskNode(BaseNode):
             ep = self
 
         for poolshare in [poolShare for poolShare in ep.poolShares.values() if poolShare.hasRenderNodesAvailable()]:
-            # first, sort the rendernodes according their performance value
-            rnList = sorted(poolshare.pool.renderNodes, key=lambda rn: rn.performance, reverse=True)
-            for rendernode in rnList:
-                if rendernode.isAvailable() and rendernode.canRun(command):
+            # the pool index yields its available rendernodes according their performance value
+            for rendernode in poolshare.pool.iterAvailableRenderNodes(command.task.minNbCores):
+                if rendernode.canRun(command):
                     if rendernode.reserveLicense(command, self.dispatcher.licenseManager):
                         rendernode.addAssignment(command)
                         return rendernode
@@ -574,33 +691,61 @@ class TaskNode(BaseNode):
             raise NoRenderNodeAvailable
         return None
 
+    def onCommandChange(self, field, oldvalue, newvalue):
+        '''
+        Updates the running counters of the node when a field of one of its commands has changed.
+
+        :returns: True if the node needs to be refreshed
+        '''
+        if field == "status":
+            if not self.invalidated:
+                decrementCount(self._statusCounts, oldvalue)
+                self._statusCounts[newvalue] += 1
+        elif field == "completion":
+            if not self.invalidated:
+                self._completionSum += (newvalue or 0.0) - (oldvalue or 0.0)
+        elif field in ("creationTime", "startTime", "updateTime", "endTime"):
+            if not self.invalidated:
+                self.onTimeChange(field, oldvalue, newvalue)
+        else:
+            return False
+        return True
+
+    def rebuildCounters(self):
+        '''
+        Recomputes the running counters from the commands of the task.
+        '''
+        self._statusCounts = defaultdict(int)
+        self._completionSum = 0.0
+        for command in self.task.commands:
+            self._statusCounts[command.status] += 1
+            self._completionSum += command.completion
+        self.resetTimes(self.task.commands)
+
     def updateCompletionAndStatus(self):
         '''
-        Evaluate new value for completion and status of a particular TaskNode
+        | Evaluate new value for completion and status of a particular TaskNode
+        | Values are computed from the running counters of the node, updated on each command change.
+        | The commands are only iterated when the node has been invalidated.
         '''
         self.updateAllocation()
 
-        if not self.invalidated:
-            return
         if self.task is None:
             self.status = NODE_CANCELED
             return
-        completion = 0.0
-        status = defaultdict(int)
-        self.readyCommandCount = 0
-        self.doneCommandCount = 0
-        self.commandCount = len(self.task.commands)
 
-        for command in self.task.commands:
-            completion += command.completion
-            status[command.status] += 1
-            if command.status == CMD_READY:
-                self.readyCommandCount += 1
-            if command.status == CMD_DONE:
-                self.doneCommandCount += 1
+        if self.invalidated:
+            self.rebuildCounters()
+        elif self._timesStale:
+            self.resetTimes(self.task.commands)
+
+        status = self._statusCounts
+        self.readyCommandCount = status.get(CMD_READY, 0)
+        self.doneCommandCount = status.get(CMD_DONE, 0)
+        self.commandCount = len(self.task.commands)
 
         if self.task.commands:
-            self.completion = completion / len(self.task.commands)
+            self.completion = min(1.0, max(0.0, self._completionSum / len(self.task.commands)))
         else:
             self.completion = 1.0
 
@@ -627,23 +772,19 @@ class TaskNode(BaseNode):
             self.completion = 1.0
             self.status = NODE_DONE
 
-        times = [command.creationTime for command in self.task.commands if command.creationTime is not None]
-        if times:
-            self.creationTime = min(times)
+        if self._times['creationTime'] is not None:
+            self.creationTime = self._times['creationTime']
 
-        times = [command.startTime for command in self.task.commands if command.startTime is not None]
-        if times:
-            self.startTime = min(times)
+        if self._times['startTime'] is not None:
+            self.startTime = self._times['startTime']
 
-        times = [command.updateTime for command in self.task.commands if command.updateTime is not None]
-        if times:
-            self.updateTime = max(times)
+        if self._times['updateTime'] is not None:
+            self.updateTime = self._times['updateTime']
 
         # only set the endTime on the node if it's done
         if self.status == NODE_DONE:
-            times = [command.endTime for command in self.task.commands if command.endTime is not None]
-            if times:
-                self.endTime = max(times)
+            if self._times['endTime'] is not None:
+                self.endTime = self._times['endTime']
         else:
             self.endTime = None
 
@@ -660,10 +801,10 @@ class TaskNode(BaseNode):
 
     def checkDependenciesSatisfaction(self):
         # TODO dependencies should be set for restricted node statutes only: DONE, ERROR and CANCELED
-        taskNodes = [taskNode
-                     for taskNode in self.dispatcher.dispatchTree.nodes.values()
-                     if isinstance(taskNode, TaskNode) and taskNode.task == self.task]
-        return all(BaseNode.checkDependenciesSatisfaction(taskNode) for taskNode in taskNodes)
+        # the nodes of a task are indexed by rule on the task itself
+        return all(BaseNode.checkDependenciesSatisfaction(taskNode)
+                   for taskNode in self.task.nodes.values()
+                   if isinstance(taskNode, TaskNode))
 
     def setPaused(self, paused):
         # pause every job not done
@@ -9,6 +9,8 @@
 #
 ####################################################################################################
 
+import heapq
+from bisect import insort
 from weakref import WeakKeyDictionary
 
 from . import models
@@ -82,12 +84,71 @@ class PoolShare(models.Model):
         # As we have computed the authorized RN regarding the available nodes...
         #
         # Is there some render nodes available in the pool?
-        return any((rn.isAvailable() for rn in self.pool.renderNodes))
+        return self.pool.hasAvailableRenderNodes()
 
     def __repr__(self):
         return "PoolShare(id=%r, pool.name=%r, node=%r, maxRN=%r, allocatedRN=%r)" % (self.id, self.pool.name if self.pool else None, self.node.name, self.maxRN, self.allocatedRN)
 
 
+## Index of the available render nodes of a pool.
+#
+# Render nodes are bucketed by free cores and free RAM, each bucket being sorted by decreasing performance.
+# Removal is lazy: the entry is only forgotten and skipped when iterating, buckets are compacted when
+# too many dead entries have accumulated.
+#
+class RenderNodeAvailabilityIndex(object):
+
+    def __init__(self):
+        self.buckets = {}
+        self.entries = {}
+        self.deadEntries = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, rendernode):
+        return rendernode.name in self.entries
+
+    ## Adds a render node to the index or updates its position if its performance or resources changed.
+    #
+    def add(self, rendernode):
+        key = (rendernode.freeCoresNumber, rendernode.freeRam)
+        entry = self.entries.get(rendernode.name)
+        if entry is not None:
+            if entry[0] == -rendernode.performance and entry[3] == key and entry[2] is rendernode:
+                return
+            self.discard(rendernode)
+        entry = [-rendernode.performance, rendernode.name, rendernode, key]
+        self.entries[rendernode.name] = entry
+        insort(self.buckets.setdefault(key, []), entry)
+        if self.deadEntries > len(self.entries) + 64:
+            self.compact()
+
+    def discard(self, rendernode):
+        if self.entries.pop(rendernode.name, None) is not None:
+            self.deadEntries += 1
+
+    ## Rebuilds the buckets without the dead entries. New lists are created so that running iterations are not affected.
+    #
+    def compact(self):
+        buckets = {}
+        for key, bucket in self.buckets.iteritems():
+            alive = [entry for entry in bucket if self.entries.get(entry[1]) is entry]
+            if alive:
+                buckets[key] = alive
+        self.buckets = buckets
+        self.deadEntries = 0
+
+    ## Yields the indexed render nodes by decreasing performance.
+    # @param minCores only consider the render nodes with at least this number of free cores
+    #
+    def iterRenderNodes(self, minCores=0):
+        buckets = [bucket for (key, bucket) in self.buckets.iteritems() if key[0] >= minCores]
+        for entry in heapq.merge(*buckets):
+            if self.entries.get(entry[1]) is entry:
+                yield entry[2]
+
+
 ## This class represents a Pool.
 #
 class Pool(models.Model):
@@ -105,6 +166,7 @@ class Pool(models.Model):
         self.name = name if name else ""
         self.renderNodes = []
         self.poolShares = WeakKeyDictionary()
+        self.availableRenderNodes = RenderNodeAvailabilityIndex()
 
     def archive(self):
         self.fireDestructionEvent(self)
@@ -117,6 +179,8 @@ class Pool(models.Model):
             rendernode.pools.append(self)
         if rendernode not in self.renderNodes:
             self.renderNodes.append(rendernode)
+        if rendernode.isAvailable():
+            self.availableRenderNodes.add(rendernode)
         self.fireChangeEvent(self, "renderNodes", [], self.renderNodes)
 
     ## Removes a render node from the pool.
@@ -127,6 +191,7 @@ class Pool(models.Model):
             rendernode.pools.remove(self)
         if rendernode in self.renderNodes:
             self.renderNodes.remove(rendernode)
+        self.availableRenderNodes.discard(rendernode)
         self.fireChangeEvent(self, "renderNodes", [], self.renderNodes)
 
     ## Sets the rendernodes associated to this pool to the given list of rendernodes
@@ -137,6 +202,22 @@ class Pool(models.Model):
         for rendernode in renderNodes:
             self.addRenderNode(rendernode)
 
+    ## Yields the available render nodes of the pool, by decreasing performance.
+    # Render nodes found unavailable are removed from the index.
+    # @param minCores only consider the render nodes with at least this number of free cores
+    #
+    def iterAvailableRenderNodes(self, minCores=0):
+        for rendernode in self.availableRenderNodes.iterRenderNodes(minCores):
+            if rendernode.isAvailable():
+                yield rendernode
+            else:
+                self.availableRenderNodes.discard(rendernode)
+
+    def hasAvailableRenderNodes(self):
+        for rendernode in self.iterAvailableRenderNodes():
+            return True
+        return False
+
     ## Returns a human readable representation of the pool.
     #
     def __str__(self):
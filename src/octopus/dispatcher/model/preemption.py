@@ -0,0 +1,228 @@
+"""
+Preemption of the killable commands for the jobs which cannot get their part of the pools.
+
+After the dispatch and the backfill, a job (i.e. an entry point) is starved when it still has ready commands and
+uses fewer render nodes than its maxRN (its part of the pool computed from the dispatch keys or the fair share).
+The render nodes only running commands of tasks tagged killable, for a job of a lower dispatch key or above its
+maxRN, are the candidates to run the ready commands of the starved jobs. Evicting a render node costs the work
+lost: the core-seconds elapsed on its commands, weighted by their completion so that the commands about to end
+are kept. The starved jobs are served in the order of the dispatch, each one with the cheapest candidates able to
+run one of its ready commands, up to the number of render nodes it misses.
+
+The cancellation of the evicted commands is sent to the workers. An evicted render node keeps its commands, and
+stays out of the dispatch, until its worker answers: the commands whose kill is accepted (or reported by the worker
+first) are then set back to ready without changing their attempt and retry counters (an eviction is not a failure)
+and the render node is freed. The late report of the kill by the worker is not applied to the command, in case it
+runs again on the same render node meanwhile. To avoid thrashing, at most
+CORE.PREEMPTION_MAX_PER_CYCLE render nodes are evicted per cycle, and a job which has preempted or has been
+preempted neither preempts nor is preempted again during CORE.PREEMPTION_DELAY seconds.
+"""
+
+import logging
+import time
+
+from octopus.dispatcher.model.enums import *
+from octopus.dispatcher.model.readytasks import getTaskNode, getEntryPoint
+
+LOGGER = logging.getLogger('main.dispatcher.preemption')
+
+# values of the 'killable' tag of the tasks whose commands may be evicted
+KILLABLE_VALUES = ('1', 'true', 'yes')
+
+# the commands are never considered closer to their end than this (i.e. the cost of a command is at most
+# 1 / MIN_REMAINING times its elapsed core-seconds)
+MIN_REMAINING = 0.05
+
+
+def isKillable(task):
+    tags = task.tags or {}
+    return str(tags.get('killable', '')).lower() in KILLABLE_VALUES
+
+
+def getEvictionCost(rendernode, now):
+    '''
+    Returns the work lost by evicting the commands of a render node, None if one of them cannot be evicted.
+    '''
+    cost = 0.0
+    for command in rendernode.commands.values():
+        if command.status != CMD_RUNNING or command.task is None or not isKillable(command.task):
+            return None
+        elapsed = max(now - (command.startTime or now), 0.0)
+        cores = rendernode.usedCoresNumber.get(command.id) or 1
+        cost += elapsed * cores / max(1.0 - (command.completion or 0.0), MIN_REMAINING)
+    return cost
+
+
+class PreemptionPlanner(object):
+
+    def __init__(self):
+        # entry point id -> time of its last preemption, as the starved job or as the victim
+        self.lastPreemptions = {}
+        # evicted render node -> {command id: starved entry point} of its commands whose kill is not answered yet
+        self.pending = {}
+        # command id -> (render node name, time) of the commands set back to ready before the worker reported their kill
+        self.killed = {}
+
+    ## Chooses the render nodes to evict for the starved jobs.
+    # @param maxEvictions the max number of render nodes to evict
+    # @param delay the number of seconds during which the jobs of a preemption are left alone
+    # @return a list of (starved entry point, rendernode) tuples
+    #
+    def plan(self, dispatchTree, maxEvictions, delay, now=None):
+        if now is None:
+            now = time.time()
+        for (entryPointId, lastTime) in self.lastPreemptions.items():
+            if now - lastTime >= delay:
+                del self.lastPreemptions[entryPointId]
+        for (commandId, (renderNodeName, killTime)) in self.killed.items():
+            if now - killTime >= delay:
+                del self.killed[commandId]
+        if maxEvictions <= 0:
+            return []
+
+        # starved entry point -> number of render nodes it misses
+        starved = {}
+        for poolShare in dispatchTree.poolShares.values():
+            entryPoint = poolShare.node
+            if entryPoint.name == 'graphs' or entryPoint.id in self.lastPreemptions or entryPoint in starved:
+                continue
+            if entryPoint.status in (NODE_BLOCKED, NODE_DONE, NODE_CANCELED, NODE_PAUSED) or entryPoint.readyCommandCount <= 0:
+                continue
+            mainPoolShare = entryPoint.mainPoolShare()
+            if mainPoolShare.maxRN > 0 and mainPoolShare.allocatedRN < mainPoolShare.maxRN:
+                starved[entryPoint] = min(mainPoolShare.maxRN - mainPoolShare.allocatedRN, entryPoint.readyCommandCount)
+        if not starved:
+            return []
+
+        # ready tasks of each starved entry point
+        readyTasks = dict((entryPoint, []) for entryPoint in starved)
+        for task in dispatchTree.readyTasks.readyCommands:
+            taskNode = getTaskNode(task)
+            entryPoint = getEntryPoint(taskNode)
+            if entryPoint in readyTasks and not taskNode.paused and (task.timer is None or task.timer <= now):
+                readyTasks[entryPoint].append(task)
+
+        # (cost, rendernode id, rendernode, poolshare) of the render nodes which may be evicted, cheapest first
+        candidates = []
+        for rendernode in dispatchTree.renderNodes.values():
+            poolShare = rendernode.currentpoolshare
+            if rendernode.status != RN_WORKING or not rendernode.commands or poolShare is None or rendernode in self.pending:
+                continue
+            if poolShare.node.id in self.lastPreemptions:
+                continue
+            cost = getEvictionCost(rendernode, now)
+            if cost is not None:
+                candidates.append((cost, rendernode.id, rendernode, poolShare))
+        if not candidates:
+            return []
+        candidates.sort()
+
+        evictions = []
+        evicted = set()
+        # poolshare -> number of its render nodes evicted
+        evictedCounts = {}
+        for entryPoint in sorted(starved, key=lambda node: (-node.dispatchKey, node.id)):
+            missing = starved[entryPoint]
+            for (cost, rendernodeId, rendernode, poolShare) in candidates:
+                if len(evictions) >= maxEvictions or missing <= 0:
+                    break
+                if rendernode in evicted or not self.isVictim(entryPoint, poolShare, evictedCounts.get(poolShare, 0)):
+                    continue
+                if not self.canServe(entryPoint, rendernode, poolShare.pool, readyTasks[entryPoint]):
+                    continue
+                evicted.add(rendernode)
+                evictedCounts[poolShare] = evictedCounts.get(poolShare, 0) + 1
+                evictions.append((entryPoint, rendernode))
+                missing -= 1
+                self.lastPreemptions[entryPoint.id] = now
+                self.lastPreemptions[poolShare.node.id] = now
+                LOGGER.info("planning the eviction of %s (cost %.0f) for job %d", rendernode.name, cost, entryPoint.id)
+        return evictions
+
+    ## Returns True if the job of a poolshare may give a render node to the starved entry point: it has a lower
+    # dispatch key or it uses more render nodes than its maxRN (the maxRN set by the users are never exceeded).
+    #
+    def isVictim(self, entryPoint, poolShare, evictedCount):
+        victim = poolShare.node
+        if victim is entryPoint or poolShare.pool not in entryPoint.poolShares:
+            return False
+        if victim.dispatchKey < entryPoint.dispatchKey:
+            return True
+        return not poolShare.userDefinedMaxRN and poolShare.allocatedRN - evictedCount > max(poolShare.maxRN, 0)
+
+    ## Returns True if one of the ready tasks of the entry point can run on the render node once evicted.
+    #
+    def canServe(self, entryPoint, rendernode, pool, tasks):
+        poolShare = entryPoint.poolShares[pool]
+        if poolShare.userDefinedMaxRN and poolShare.maxRN > 0 and poolShare.allocatedRN >= poolShare.maxRN:
+            return False
+        if rendernode.excluded:
+            return False
+        for task in tasks:
+            if task.minNbCores and task.minNbCores > rendernode.coresNumber:
+                continue
+            if task.ramUse and task.ramUse > rendernode.ramSize:
+                continue
+            if task.requirementMatcher.matches(rendernode):
+                return True
+        return False
+
+    ## Records the eviction of a render node for a starved entry point, the cancellation of its commands is being
+    # sent to the worker. The render node keeps its commands until the worker answers (@see release).
+    #
+    def evict(self, rendernode, entryPoint):
+        self.pending[rendernode] = dict((commandId, entryPoint) for commandId in rendernode.commands)
+
+    ## Called when the worker answers the cancellation of an evicted command. If the command has been killed, it is
+    # set back to ready, keeping its attempt and retry counters. The render node is freed once every cancellation
+    # is answered.
+    # @param killed False if the worker refused the cancellation or could not be reached: the command is left to
+    #               the usual updates of the worker (or to the timeout of the render node)
+    # @param reported True if the worker has already reported the kill of the command
+    #
+    def release(self, rendernode, command, killed, reported=False, now=None):
+        entryPoints = self.pending.get(rendernode)
+        if entryPoints is None or command.id not in entryPoints:
+            return
+        entryPoint = entryPoints.pop(command.id)
+        if killed and rendernode.commands.get(command.id) is command:
+            rendernode.clearAssignment(command)
+            command.clearAssignment()
+            command.completion = 0.
+            command.message = "preempted by job %d" % entryPoint.id
+            if not reported:
+                self.killed[command.id] = (rendernode.name, now if now is not None else time.time())
+        if not entryPoints:
+            del self.pending[rendernode]
+            if not rendernode.commands:
+                rendernode.reset()
+
+    ## Returns True if a status update sent by a worker reports the kill of an evicted command, without recording
+    # the kill (@see isEvictionReport).
+    #
+    def isEviction(self, command, renderNodeName, status):
+        if status != CMD_CANCELED:
+            return False
+        if self.isPendingOn(command, renderNodeName):
+            return True
+        killed = self.killed.get(command.id)
+        return killed is not None and killed[0] == renderNodeName
+
+    ## Returns True if a status update sent by a worker reports the kill of an evicted command, the update must not
+    # be applied. The kill reported before the worker answered the cancellation releases the command at once.
+    #
+    def isEvictionReport(self, command, renderNodeName, status):
+        if not self.isEviction(command, renderNodeName, status):
+            return False
+        if self.isPendingOn(command, renderNodeName):
+            self.release(command.renderNode, command, True, reported=True)
+        else:
+            del self.killed[command.id]
+        return True
+
+    ## Returns True if the command is being evicted from the render node of the given name, i.e. the worker has not
+    # answered its cancellation yet.
+    #
+    def isPendingOn(self, command, renderNodeName):
+        rendernode = command.renderNode
+        return rendernode is not None and rendernode.name == renderNodeName and command.id in self.pending.get(rendernode, ())
@@ -0,0 +1,128 @@
+"""
+Index of the tasks having ready commands by requirement class, used by the backfill pass of the dispatcher.
+
+The tasks having the same requirements belong to the same requirement class. Each requirement class is matched
+once against each capability class of render nodes (i.e. render nodes with the same caracteristics, @see
+capabilityClass), so the tasks which may run on an idle render node are found with a lookup per requirement class
+instead of a walk of the queue. The ready commands of each task are kept by the listeners of the dispatch tree when
+a command is created, changes its status or is removed, so a ready command of a task is found without walking the
+commands of the task.
+"""
+
+from collections import OrderedDict
+
+from octopus.core.enums.command import CMD_READY
+from octopus.dispatcher.model.jobindex import JOBS_FOLDER_ID
+from octopus.dispatcher.model.requirement import capabilityClass
+
+
+class ReadyTaskIndex(object):
+
+    def __init__(self):
+        # task -> ready commands of the task (keys of an OrderedDict), in the order they became ready
+        self.readyCommands = {}
+        # requirement class -> set of the tasks having ready commands
+        self.classes = {}
+        # task -> requirement class
+        self.taskClasses = {}
+        # (requirement class, capability class) -> True if the render nodes of the capability class match
+        self.matches = {}
+
+    def __len__(self):
+        return len(self.readyCommands)
+
+    def add(self, command):
+        task = command.task
+        commands = self.readyCommands.get(task)
+        if commands is None:
+            commands = self.readyCommands[task] = OrderedDict()
+            requirementClass = self.taskClasses[task] = capabilityClass(task.requirements)
+            self.classes.setdefault(requirementClass, set()).add(task)
+        commands[command] = None
+
+    def remove(self, command):
+        commands = self.readyCommands.get(command.task)
+        if commands is None:
+            return
+        commands.pop(command, None)
+        if not commands:
+            self.discard(command.task)
+
+    ## Returns the number of ready commands of the task.
+    #
+    def readyCount(self, task):
+        commands = self.readyCommands.get(task)
+        return len(commands) if commands is not None else 0
+
+    ## Returns the ready command of the task which has been ready for the longest time, None if there is none.
+    #
+    def firstReadyCommand(self, task):
+        commands = self.readyCommands.get(task)
+        if not commands:
+            return None
+        return next(iter(commands))
+
+    ## Forgets a task and its ready commands.
+    #
+    def discard(self, task):
+        self.readyCommands.pop(task, None)
+        requirementClass = self.taskClasses.pop(task, None)
+        tasks = self.classes.get(requirementClass)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self.classes[requirementClass]
+
+    ## Yields the (requirement class, tasks) tuples of the requirement classes matching the render node.
+    #
+    def iterMatchingClasses(self, rendernode):
+        capability = rendernode.getCapabilityClass()
+        for (requirementClass, tasks) in self.classes.items():
+            key = (requirementClass, capability)
+            match = self.matches.get(key)
+            if match is None:
+                # the requirements are the same for all the tasks of the class
+                for task in tasks:
+                    match = self.matches[key] = task.requirementMatcher.evaluate(rendernode.caracteristics)
+                    break
+            if match:
+                yield (requirementClass, tasks)
+
+    # listener of the commands (@see DispatchTree.onCommandCreation, DispatchTree.onCommandStatusChange and
+    # DispatchTree.onCommandRemoval)
+
+    def onCommandCreation(self, command):
+        if command.status == CMD_READY and command.task is not None:
+            self.add(command)
+
+    def onCommandStatusChange(self, command, oldvalue, newvalue):
+        if command.task is None or oldvalue == newvalue:
+            return
+        if newvalue == CMD_READY:
+            self.add(command)
+        elif oldvalue == CMD_READY:
+            self.remove(command)
+
+    def onCommandRemoval(self, command):
+        if command.status == CMD_READY and command.task is not None:
+            self.remove(command)
+
+
+def getTaskNode(task):
+    '''
+    Returns the node of the task in the graph view, the first node of the task if there is none.
+    '''
+    if task is None or not task.nodes:
+        return None
+    return task.nodes.get('graph_rule') or task.nodes.values()[0]
+
+
+def getEntryPoint(node):
+    '''
+    Returns the first node holding a poolshare among the node and its ancestors (i.e. the job), None if there is none.
+    '''
+    while node is not None and node.id != JOBS_FOLDER_ID:
+        if node.poolShares:
+            return node
+        node = node.parent
+    return None
@@ -9,19 +9,18 @@
 #
 ####################################################################################################
 
-import httplib as http
 import time
 import datetime
 import logging
-import errno
 import requests
 from collections import deque
 
 from octopus.dispatcher.model.enums import *
-from octopus.dispatcher import settings
+from octopus.dispatcher import settings, workerclient
 from octopus.core import singletonconfig
 
 from . import models
+from .requirement import capabilityClass
 
 LOGGER = logging.getLogger('main.dispatcher.webservice')
 logging.getLogger('requests.packages.urllib3.connectionpool').setLevel(logging.WARNING)
@@ -90,6 +89,8 @@ class RenderNode(models.Model):
         self.port = int(port)
         self.pools = []
         self.idInformed = False
+        # cleared when the worker answers that it does not handle batch assignments (/commands/batch/)
+        self.batchAssignments = True
         self.isRegistered = False
         self.lastAliveTime = 0
         self.httpConnection = None
@@ -97,6 +98,7 @@ class RenderNode(models.Model):
         self.currentpoolshare = None
         self.performance = float(performance)
         self.history = deque(maxlen=singletonconfig.get('CORE', 'RN_NB_ERRORS_TOLERANCE'))
+        self.historyErrorCount = 0
         self.tasksHistory = deque(maxlen=15)
         self.excluded = False
 
@@ -122,6 +124,45 @@ class RenderNode(models.Model):
         # Need to avoid nodes that have flag isPaused set (i.e. nodes paused by user but still running a command)
         return (self.isRegistered and self.status == RN_IDLE and not self.commands and not self.excluded)
 
+    # Fields affecting the availability of the rendernode or its position in the pools availability index
+    AVAILABILITY_FIELDS = frozenset(['status', 'isRegistered', 'excluded', 'commands', 'performance', 'freeCoresNumber', 'freeRam'])
+
+    def __setattr__(self, name, value):
+        super(RenderNode, self).__setattr__(name, value)
+        if name == 'caracteristics':
+            self.__dict__['_capabilityClass'] = None
+        elif name in self.AVAILABILITY_FIELDS and self.__dict__.get('_changeReady'):
+            self.updateAvailability()
+
+    ## Returns the key of the capability class of this rendernode, computed from its caracteristics.
+    # The key is reset each time the caracteristics are replaced (i.e. on sysinfos update).
+    #
+    def getCapabilityClass(self):
+        key = self.__dict__.get('_capabilityClass')
+        if key is None:
+            key = self.__dict__['_capabilityClass'] = capabilityClass(self.caracteristics)
+        return key
+
+    ## Records the final status of a command in the history of this rendernode.
+    #
+    def appendHistory(self, status):
+        self.history.append(status)
+        self.historyErrorCount = self.history.count(CMD_ERROR)
+
+    def clearHistory(self):
+        self.history.clear()
+        self.historyErrorCount = 0
+
+    ## Registers or unregisters this rendernode in the availability index of its pools.
+    #
+    def updateAvailability(self):
+        if self.isAvailable():
+            for pool in self.pools:
+                pool.availableRenderNodes.add(self)
+        else:
+            for pool in self.pools:
+                pool.availableRenderNodes.discard(self)
+
     def reset(self, paused=False):
         # if paused, set the status to RN_PAUSED, else set it to Finishing, it will be set to IDLE in the next iteration of the dispatcher main loop
         if paused:
@@ -166,6 +207,7 @@ class RenderNode(models.Model):
         else:
             self.releaseRessources(command)
             self.releaseLicense(command)
+            self.updateAvailability()
 
     ## Add a command assignment
     #
@@ -176,6 +218,7 @@ class RenderNode(models.Model):
             # FIXME the assignment of the cmd should be done here and not in the dispatchIterator func
             command.assign(self)
             self.updateStatus()
+            self.updateAvailability()
 
     ## Reserve license
     #
@@ -295,24 +338,16 @@ class RenderNode(models.Model):
                     cmd.finish()
             self.status = RN_IDLE
 
-    ##
-    #
-    # @warning The returned HTTPConnection is not safe to use from multiple threads
-    #
-    def getHTTPConnection(self):
-        timeout = singletonconfig.get('COMMUNICATION', 'RENDERNODE_REQUEST_TIMEOUT', 5)
-        return http.HTTPConnection(self.host, self.port, timeout=timeout)
-
     ## An exception class to report a render node http request failure.
     #
-    class RequestFailed(Exception):
-        pass
+    RequestFailed = workerclient.RequestFailed
 
     ## Sends a HTTP request to the render node and returns a (HTTPResponse, data) tuple on success.
     #
-    # This method tries to send the request at most RENDERNODE_REQUEST_MAX_RETRY_COUNT times,
-    # waiting RENDERNODE_REQUEST_DELAY_AFTER_REQUEST_FAILURE seconds between each try. It
-    # then raises a RenderNode.RequestFailed exception.
+    # The request is sent by the shared worker client (@see octopus.dispatcher.workerclient) over a
+    # keep-alive connection. It is tried at most RENDERNODE_REQUEST_MAX_RETRY_COUNT times, waiting
+    # RENDERNODE_REQUEST_DELAY_AFTER_REQUEST_FAILURE seconds (doubled at each try) between each try.
+    # It then raises a RenderNode.RequestFailed exception and the render node is put in quarantine.
     #
     # @param method the HTTP method for this request
     # @param url the requested URL
@@ -324,95 +359,32 @@ class RenderNode(models.Model):
     #       RENDERNODE_REQUEST_DELAY_AFTER_REQUEST_FAILURE params affect the execution of this method.
     #
     def request(self, method, url, body=None, headers={}):
-        """
-        """
-
-        # from octopus.dispatcher import settings
-        # LOGGER.debug("Send request to RN: http://%s:%s%s %s (%s)" % (self.host, self.port, url, method, headers))
-
-        err = None
-        conn = self.getHTTPConnection()
-
-        # try to process the request at most RENDERNODE_REQUEST_MAX_RETRY_COUNT times.
-        for i in xrange(singletonconfig.get('COMMUNICATION', 'RENDERNODE_REQUEST_MAX_RETRY_COUNT')):
-            try:
-                conn.request(method, url, body, headers)
-                response = conn.getresponse()
-                if response.length:
-                    data = response.read(response.length)
-                else:
-                    data = None
-                # request succeeded
-                conn.close()
-                return (response, data)
-            except http.socket.error, e:
-                err = e
-                # LOGGER.debug("socket error %r" % e)
-                try:
-                    conn.close()
-                except:
-                    pass
-                if e in (errno.ECONNREFUSED, errno.ENETUNREACH):
-                    raise self.RequestFailed(cause=e)
-            except http.HTTPException, e:
-                err = e
-                # LOGGER.debug("HTTPException %r" % e)
-                try:
-                    conn.close()
-                except:
-                    pass
-                LOGGER.exception("rendernode.request failed")
-
-            LOGGER.warning("request failed (%d/%d), reason: %s" % (i + 1, singletonconfig.get('COMMUNICATION', 'RENDERNODE_REQUEST_MAX_RETRY_COUNT'), err))
-            # request failed so let's sleep for a while
-            time.sleep(singletonconfig.get('COMMUNICATION', 'RENDERNODE_REQUEST_DELAY_AFTER_REQUEST_FAILURE'))
-
-        # request failed too many times so reset the RN (without pausing) and set quarantine
+        try:
+            return workerclient.getClient().call(self, method, url, body, headers)
+        except self.RequestFailed, e:
+            if e.quarantine:
+                self.quarantine()
+            raise
+
+    ## Resets the render node (without pausing it) and excludes it from the dispatch, used when it cannot
+    # be reached anymore.
+    #
+    def quarantine(self):
         self.reset(paused=False)
         self.excluded = True
         LOGGER.warning("A network call to the node %s can not be completed --> put in quarantine" % (self.name))
-        raise self.RequestFailed()
 
     def canRun(self, command):
         # check if this rendernode has made too much errors in its last commands
-        cpt = 0
-        for i in self.history:
-            if i == CMD_ERROR:
-                cpt += 1
-        if cpt == singletonconfig.get('CORE', 'RN_NB_ERRORS_TOLERANCE'):
+        if self.historyErrorCount == singletonconfig.get('CORE', 'RN_NB_ERRORS_TOLERANCE'):
             LOGGER.warning("RenderNode %s had only errors in its commands history, excluding..." % self.name)
             self.excluded = True
             return False
         if self.excluded:
             return False
-        for (requirement, value) in command.task.requirements.items():
-            if requirement.lower() == "softs":  # todo
-                for soft in value:
-                    if not soft in self.caracteristics['softs']:
-                        return False
-            else:
-                if not requirement in self.caracteristics:
-                    return False
-                else:
-                    caracteristic = self.caracteristics[requirement]
-                    if type(caracteristic) != type(value) and not isinstance(value, list):
-                        return False
-                    if isinstance(value, list) and len(value) == 2:
-                        a, b = value
-                        if type(a) != type(b) or type(a) != type(caracteristic):
-                            return False
-                        try:
-                            if not (a < caracteristic < b):
-                                return False
-                        except ValueError:
-                            return False
-                    else:
-                        if isinstance(caracteristic, bool) and caracteristic != value:
-                            return False
-                        if isinstance(caracteristic, basestring) and caracteristic != value:
-                            return False
-                        if isinstance(caracteristic, int) and caracteristic < value:
-                            return False
+        # requirements are compiled once per task and matched once per capability class
+        if not command.task.requirementMatcher.matches(self):
+            return False
 
         if command.task.minNbCores:
             if self.freeCoresNumber < command.task.minNbCores:
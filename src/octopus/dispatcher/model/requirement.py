@@ -0,0 +1,98 @@
+"""
+Compiled matching of task requirements against rendernode caracteristics.
+"""
+
+import copy
+
+
+def capabilityClass(caracteristics):
+    '''
+    Returns a hashable key identifying a set of rendernode caracteristics. Rendernodes sharing the same
+    caracteristics belong to the same capability class and are matched once for all by a RequirementMatcher.
+    Types are part of the key since requirements are type sensitive (i.e. 1, 1.0 and True are different classes).
+    '''
+    if isinstance(caracteristics, dict):
+        return ('dict', tuple(sorted((key, capabilityClass(value)) for (key, value) in caracteristics.iteritems())))
+    if isinstance(caracteristics, (list, tuple)):
+        return (type(caracteristics).__name__, tuple(capabilityClass(value) for value in caracteristics))
+    return (type(caracteristics).__name__, caracteristics)
+
+
+def compileRequirement(value):
+    '''
+    Returns a predicate on a caracteristic value for the given requirement value:
+    - a list of 2 values of the same type [a, b] requires a caracteristic of this type in the range ]a, b[
+    - a boolean or a string requires an equal caracteristic
+    - a number requires a caracteristic greater or equal
+    '''
+    if isinstance(value, list) and len(value) == 2:
+        a, b = value
+        if type(a) != type(b):
+            return lambda caracteristic: False
+
+        def checkRange(caracteristic):
+            if type(a) != type(caracteristic):
+                return False
+            try:
+                return a < caracteristic < b
+            except ValueError:
+                return False
+        return checkRange
+
+    def checkValue(caracteristic):
+        if type(caracteristic) != type(value) and not isinstance(value, list):
+            return False
+        if isinstance(caracteristic, bool) and caracteristic != value:
+            return False
+        if isinstance(caracteristic, basestring) and caracteristic != value:
+            return False
+        if isinstance(caracteristic, int) and caracteristic < value:
+            return False
+        return True
+    return checkValue
+
+
+class RequirementMatcher(object):
+    '''
+    Requirements of a task compiled into a predicate on rendernode caracteristics.
+    The result is cached for each capability class so that matching a rendernode is usually a dict lookup.
+    The matcher keeps its own copy of the requirements, compared with the requirements of the task to know if
+    they have been edited since (@see isCompiledFrom).
+    '''
+
+    def __init__(self, requirements):
+        requirements = self.requirements = copy.deepcopy(requirements)
+        self.softs = ()
+        self.checks = []
+        self.matchingClasses = {}
+        for (requirement, value) in requirements.items():
+            if requirement.lower() == "softs":  # todo
+                self.softs = tuple(value)
+            else:
+                self.checks.append((requirement, compileRequirement(value)))
+
+    ## Returns True if the matcher has been compiled from requirements equal to the given ones.
+    #
+    def isCompiledFrom(self, requirements):
+        return self.requirements == requirements
+
+    def matches(self, rendernode):
+        key = rendernode.getCapabilityClass()
+        try:
+            return self.matchingClasses[key]
+        except KeyError:
+            result = self.matchingClasses[key] = self.evaluate(rendernode.caracteristics)
+            return result
+
+    def evaluate(self, caracteristics):
+        if self.softs:
+            softs = caracteristics.get('softs', ())
+            for soft in self.softs:
+                if soft not in softs:
+                    return False
+        for (requirement, check) in self.checks:
+            if requirement not in caracteristics:
+                return False
+            if not check(caracteristics[requirement]):
+                return False
+        return True
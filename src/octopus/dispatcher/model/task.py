@@ -1,6 +1,7 @@
 from .models import (Model, StringField, ModelField, DictField, IntegerField, FloatField,
                      ModelListField, ModelDictField, ListField)
 from .enums import NODE_BLOCKED, NODE_CANCELED, NODE_DONE, NODE_ERROR, NODE_PAUSED, NODE_READY, NODE_RUNNING
+from .requirement import RequirementMatcher
 from collections import defaultdict
 import logging
 import datetime
@@ -74,7 +75,7 @@ class TaskGroup(Model):
     def archive(self):
         self.fireDestructionEvent(self)
 
-    def updateStatusAndCompletion(self):
+    def updateStatusAndCompletion(self, recursive=True):
         if not self.tasks:
             self.completion = 1.0
             self.status = NODE_DONE
@@ -82,7 +83,7 @@ class TaskGroup(Model):
             completion = 0.0
             status = defaultdict(int)
             for child in self.tasks:
-                if isinstance(child, TaskGroup):
+                if recursive and isinstance(child, TaskGroup):
                     child.updateStatusAndCompletion()
                 completion += child.completion
                 status[child.status] += 1
@@ -202,6 +203,16 @@ class Task(Model):
         self.runnerPackages = runnerPackages
         self.watcherPackages = watcherPackages
 
+    @property
+    def requirementMatcher(self):
+        '''
+        The requirements of the task compiled into a RequirementMatcher, rebuilt if the requirements are replaced
+        or edited in place.
+        '''
+        matcher = self.__dict__.get('_requirementMatcher')
+        if matcher is None or not matcher.isCompiledFrom(self.requirements):
+            matcher = self._requirementMatcher = RequirementMatcher(self.requirements)
+        return matcher
 
     def addValidationExpression(self, validationExpression):
         self.validationExpression = "&".join(self.validationExpression,
@@ -0,0 +1,115 @@
+"""
+Timers of the dispatcher (e.g. the auto retry of the failed commands), run by the main loop.
+
+The timers are kept in a hashed timer wheel: a circular array of slots of resolution seconds, a timer is put in
+the slot of its deadline, so scheduling and cancelling a timer take a constant time. At the start of each
+iteration the dispatcher advances the wheel to the current time and runs the expired timers in a single batch,
+from the thread of the main loop, so the callbacks can change the model without any lock. A timer never runs
+before its deadline and at most resolution seconds (plus the duration of an iteration) after it. Timers further
+than a turn of the wheel stay in their slot until the turn of their deadline.
+"""
+
+from __future__ import with_statement
+
+import logging
+import time
+from threading import Lock
+
+LOGGER = logging.getLogger('main.dispatcher.dispatchtree')
+
+
+class TimerHandle(object):
+    '''
+    A scheduled timer, given to TimerWheel.cancel to cancel it.
+    '''
+    __slots__ = ('deadline', 'tick', 'callback', 'args', 'slot')
+
+    def __init__(self, deadline, tick, callback, args):
+        self.deadline = deadline
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        # set of the wheel holding the timer, None once the timer has run or has been cancelled
+        self.slot = None
+
+    def isPending(self):
+        return self.slot is not None
+
+
+class TimerWheel(object):
+
+    def __init__(self, resolution=1.0, size=1024):
+        self.resolution = float(resolution)
+        self.size = size
+        self.slots = [set() for i in xrange(size)]
+        self.lock = Lock()
+        # the ticks up to this one have been run
+        self.tick = self.getTick(time.time()) - 1
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def getTick(self, t):
+        return int(t // self.resolution)
+
+    ## Calls callback(*args) from the main loop in delay seconds.
+    # @return the handle of the timer
+    #
+    def schedule(self, delay, callback, *args):
+        return self.scheduleAt(time.time() + delay, callback, *args)
+
+    ## Calls callback(*args) from the main loop once the given time has passed.
+    # @return the handle of the timer
+    #
+    def scheduleAt(self, deadline, callback, *args):
+        with self.lock:
+            # the timers already expired run at the next advance
+            tick = max(self.getTick(deadline), self.tick + 1)
+            handle = TimerHandle(deadline, tick, callback, args)
+            handle.slot = self.slots[tick % self.size]
+            handle.slot.add(handle)
+            self.count += 1
+        return handle
+
+    ## Cancels a timer if it has not run yet.
+    # @return True if the timer was pending
+    #
+    def cancel(self, handle):
+        with self.lock:
+            if handle.slot is None:
+                return False
+            handle.slot.discard(handle)
+            handle.slot = None
+            self.count -= 1
+            return True
+
+    ## Runs the timers expired at the given time (the current time by default), in the order of their deadline.
+    # @return the number of timers run
+    #
+    def advance(self, now=None):
+        if now is None:
+            now = time.time()
+        # only the elapsed ticks are run, so that no timer runs before its deadline
+        target = self.getTick(now) - 1
+        expired = []
+        with self.lock:
+            if target <= self.tick or not self.count:
+                self.tick = max(target, self.tick)
+                return 0
+            # after a full turn every slot has been visited
+            for tick in xrange(max(self.tick + 1, target - self.size + 1), target + 1):
+                slot = self.slots[tick % self.size]
+                for handle in [handle for handle in slot if handle.tick <= target]:
+                    slot.discard(handle)
+                    handle.slot = None
+                    expired.append(handle)
+            self.tick = target
+            self.count -= len(expired)
+        expired.sort(key=lambda handle: handle.deadline)
+        for handle in expired:
+            try:
+                handle.callback(*handle.args)
+            except Exception:
+                LOGGER.exception("error in timer %r" % handle.callback)
+        return len(expired)
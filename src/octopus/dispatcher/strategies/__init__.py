@@ -17,12 +17,17 @@
 # - update(self, folder, entrypoint) -> sorts the folder's children according to the strategy
 # - on_assignment(self, folder, task, rendernode) -> called after a rendernode has been assigned
 #                                                    to a child or descendant of the folder.
+# The children are then dispatched in the order returned by iterChildren(self, folder), i.e. the order of
+# folder.children by default. The strategies deriving from IncrementalStrategy only implement key(self, child):
+# they keep the children sorted by key between the cycles instead of sorting folder.children at each update.
 #
 ####################################################################################################
 
 __all__ = ['loadStrategyClass', 'createStrategyInstance']
 
+from bisect import bisect_left, insort
 from collections import defaultdict
+from weakref import WeakKeyDictionary
 
 
 class BaseStrategy(object):
@@ -36,18 +41,151 @@ class BaseStrategy(object):
     def on_assignment(self, folder, task, node):
         raise NotImplementedError
 
+    def iterChildren(self, folder):
+        '''
+        Returns the children of the folder in the order of the dispatch, called after update.
+        '''
+        return folder.children
+
     def getClassName(self):
         return self.__module__ + "." + self.__class__.__name__
 
 
-class FifoStrategy(BaseStrategy):
+class ChildOrder(object):
+    '''
+    Children of a folder sorted by the key of an incremental strategy, kept between the cycles.
+
+    The order listens to the folder and to its children. The children added to or removed from the folder, the
+    children whose fields listed in the KEY_FIELDS of the strategy have changed and the children marked by the
+    strategy (@see IncrementalStrategy.reposition) are pending, they are repositioned by the next refresh.
+    '''
+
+    # above this ratio of pending children, the order is sorted again instead of repositioning each child
+    RESORT_RATIO = 0.25
+
+    def __init__(self, strategy, folder):
+        self.strategy = strategy
+        self.watchChildren = bool(strategy.KEY_FIELDS)
+        # child -> key of the child in entries
+        self.keys = {}
+        # sorted list of (key, child) tuples
+        self.entries = []
+        self.pending = set(folder.children)
+        folder.changeListeners.append(self)
+        if self.watchChildren:
+            for child in folder.children:
+                child.changeListeners.append(self)
+
+    def detach(self, folder):
+        if self in folder.changeListeners:
+            folder.changeListeners.remove(self)
+        if self.watchChildren:
+            for child in self.keys.keys() + list(self.pending):
+                if self in child.changeListeners:
+                    child.changeListeners.remove(self)
+        self.keys.clear()
+        self.entries = []
+        self.pending = set()
+
+    ## Repositions the pending children.
+    #
+    def refresh(self, folder):
+        if not self.pending:
+            return
+        # swapped so that a child marked meanwhile stays pending
+        pending, self.pending = self.pending, set()
+        key = self.strategy.key
+        if len(pending) > self.RESORT_RATIO * len(self.entries):
+            self.keys = dict((child, key(child)) for child in folder.children)
+            self.entries = sorted((childKey, child) for (child, childKey) in self.keys.iteritems())
+            return
+        for child in pending:
+            childKey = self.keys.pop(child, None)
+            if childKey is not None:
+                # (key,) is lower than (key, child), the keys are unique as they end with the id of the child
+                del self.entries[bisect_left(self.entries, (childKey,))]
+            if child.parent is folder:
+                childKey = self.keys[child] = key(child)
+                insort(self.entries, (childKey, child))
+
+    def __iter__(self):
+        for (childKey, child) in self.entries:
+            yield child
+
+    # listener of the folder and of its children
+
+    def onChildAddedEvent(self, folder, child):
+        self.pending.add(child)
+        if self.watchChildren:
+            child.changeListeners.append(self)
+
+    def onChildRemovedEvent(self, folder, child):
+        self.pending.add(child)
+        if self.watchChildren and self in child.changeListeners:
+            child.changeListeners.remove(self)
+
+    def onChangeEvent(self, obj, field, oldvalue, newvalue):
+        if field == 'strategy' and self.strategy.orders.get(obj) is self and newvalue is not self.strategy:
+            # the strategy of the folder has been replaced
+            self.strategy.orders.pop(obj, None)
+            self.detach(obj)
+        elif field in self.strategy.KEY_FIELDS:
+            self.pending.add(obj)
+
+    def onCreationEvent(self, obj):
+        pass
+
+    def onDestructionEvent(self, obj):
+        pass
+
+
+class IncrementalStrategy(BaseStrategy):
+    '''
+    Base class of the strategies dispatching the children by increasing key(child).
+
+    The children of each folder using the strategy are kept sorted in a ChildOrder, a child is only repositioned
+    when its key may have changed: when the value of one of the KEY_FIELDS of the child changes, or when the
+    strategy calls reposition (e.g. from on_assignment). The key must end with the id of the child.
+    '''
+
+    # fields of the children the key depends on
+    KEY_FIELDS = ()
+
+    def key(self, child):
+        raise NotImplementedError
+
+    def getOrder(self, folder):
+        # a strategy may be shared by several folders (e.g. the nodes of a task group)
+        orders = self.__dict__.get('orders')
+        if orders is None:
+            orders = self.orders = WeakKeyDictionary()
+        order = orders.get(folder)
+        if order is None:
+            order = orders[folder] = ChildOrder(self, folder)
+        return order
 
     def update(self, folder, ep):
-        folder.children.sort(key=lambda child: child.id)
+        self.getOrder(folder).refresh(folder)
+
+    def iterChildren(self, folder):
+        return iter(self.getOrder(folder))
+
+    ## Repositions the child in the order of the folder at the next update.
+    #
+    def reposition(self, folder, child):
+        order = self.__dict__.get('orders', {}).get(folder)
+        if order is not None:
+            order.pending.add(child)
 
     def on_assignment(self, folder, task, node):
         pass
 
+
+class FifoStrategy(IncrementalStrategy):
+
+    def key(self, child):
+        return (child.id,)
+
     def __str__(self):
         return "FifoStrategy"
 
@@ -64,68 +202,45 @@ class AsIsStrategy(BaseStrategy):
         return "AsIsStrategy"
 
 
-class FairStrategy(BaseStrategy):
+class FairStrategy(IncrementalStrategy):
 
     def __init__(self):
         self.assignment_counts = defaultdict(int)
 
-    def update(self, folder, ep):
-        folder.children.sort(self.cmp)
-
-    def cmp(self, x, y):
-        countx = self.assignment_counts[x]
-        county = self.assignment_counts[y]
-        val = cmp(countx, county)
-        if val == 0:
-            return cmp(x.id, y.id)
-        else:
-            return val
+    def key(self, child):
+        return (self.assignment_counts[child], child.id)
 
     def on_assignment(self, folder, task, node):
         self.assignment_counts[task] += 1
+        self.reposition(folder, task)
 
     def __str__(self):
         return "FairStrategy"
 
 
-class WeighedFairStrategy(BaseStrategy):
+class WeighedFairStrategy(IncrementalStrategy):
 
     def __init__(self):
         self.assignment_counts = defaultdict(int)
 
-    def update(self, folder, ep):
-        folder.children.sort(self.cmp)
-
-    def cmp(self, x, y):
-        countx = self.assignment_counts[x]
-        county = self.assignment_counts[y]
-        val = cmp(countx, county)
-        if val == 0:
-            return cmp(x.id, y.id)
-        else:
-            return val
+    def key(self, child):
+        return (self.assignment_counts[child], child.id)
 
     def on_assignment(self, folder, task, node):
         self.assignment_counts[task] += task.dispatchKey
+        self.reposition(folder, task)
 
     def __str__(self):
         return "WeighedFairStrategy"
 
 
-class PriorityStrategy(BaseStrategy):
+class PriorityStrategy(IncrementalStrategy):
 
-    def update(self, folder, ep):
-        folder.children.sort(self.cmp)
+    KEY_FIELDS = ('priority',)
 
-    def cmp(self, x, y):
-        priocmp = cmp(y.priority, x.priority)
-        if priocmp:
-            return priocmp
-        else:
-            return cmp(x.id, y.id)
-
-    def on_assignment(self, folder, task, node):
-        pass
+    def key(self, child):
+        # highest priority first
+        return (-child.priority, child.id)
 
     def __str__(self):
         return "PriorityStrategy"
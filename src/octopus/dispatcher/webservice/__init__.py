@@ -1,5 +1,10 @@
 
+import heapq
 import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
 from octopus.core import framework
 from octopus.core.tools import Workload
 
@@ -24,6 +29,8 @@ class Controller(framework.Controller):
 
 from octopus.core import singletonconfig, singletonstats
 from octopus.core.framework import BaseResource
+from octopus.core.communication.http import Http400
+from octopus.dispatcher.webservice.responsecache import ResponseCache
 
 
 class DispatcherBaseResource(BaseResource):
@@ -31,6 +38,10 @@ class DispatcherBaseResource(BaseResource):
     Simply override prepare to have a specific handler for the dispatcher (stats are not allowed for the worker)
     """
 
+    # responses of the read-only resources, shared by all the requests (@see answerFromCache)
+    responseCache = ResponseCache()
+    cacheKey = None
+
     def prepare(self):
         """
         For each request, update stats if needed
@@ -48,4 +59,134 @@ class DispatcherBaseResource(BaseResource):
             elif self.request.method == 'DELETE':
                     singletonstats.theStats.cycleCounts['incoming_delete'] += 1
 
+    def getPageArguments(self, args):
+        '''
+        Returns the (limit, cursor) pagination arguments of a request, limit is None if the whole
+        collection is requested and cursor is None for the first page.
+        '''
+        try:
+            limit = int(args['limit'][0]) if 'limit' in args else None
+            cursor = int(args['cursor'][0]) if 'cursor' in args else None
+        except (ValueError, TypeError):
+            raise Http400("Invalid pagination arguments, limit and cursor must be integers")
+        if limit is not None and limit < 1:
+            raise Http400("Invalid pagination arguments, limit must be positive")
+        return limit, cursor
+
+    def getFieldsArgument(self, args):
+        '''
+        Returns the fields requested for each item (i.e. "fields=id,status" or "fields=id&fields=status"),
+        None if every field is requested.
+        '''
+        if 'fields' not in args:
+            return None
+        return frozenset(field for value in args['fields'] for field in value.split(',') if field)
+
+    def getPage(self, ids, limit=None, cursor=None):
+        '''
+        Returns the ids following the cursor (i.e. greater than the cursor id) in increasing order, at most
+        limit of them, and the cursor of the next page (None if there is no next page).
+        '''
+        if cursor is not None:
+            ids = [id for id in ids if id > cursor]
+        if limit is None:
+            return sorted(ids), None
+        page = heapq.nsmallest(limit + 1, ids)
+        if len(page) > limit:
+            del page[limit:]
+            return page, page[-1]
+        return page, None
+
+    def projectFields(self, rep, fields):
+        if fields is None:
+            return rep
+        return dict((name, value) for (name, value) in rep.iteritems() if name in fields)
+
+    def finish(self, chunk=None):
+        if self.request.method != 'GET' and not self.readOnly:
+            changeLog = self.getDispatchTree().changeLog
+            # the request may have changed something the change listeners do not see (e.g. licenses)
+            changeLog.touch()
+            if self.framework.scheduler is None:
+                # the main loop runs in the IOLoop: the changes are committed before the response is sent, so
+                # that the next request does not get a response cached before them (the scheduler thread
+                # commits the queued handlers itself, @see Dispatcher.commitWorkloads)
+                changeLog.commit(self.getDispatchTree())
+        BaseResource.finish(self, chunk)
+
+    def answerFromCache(self):
+        '''
+        | Called by the read-only resources before computing their response. The version of the model is sent
+        | as ETag: a request with a matching If-None-Match header is answered with a 304, else the response
+        | cached for this version of the model and these arguments is sent if any. The headers set with
+        | setCachedHeader are sent again in both cases.
+        | Returns True if the request has been answered, else the response must be written with writeCached
+        | or writeStream to be cached.
+        '''
+        self.cacheVersion = self.getDispatchTree().changeLog.version
+        self.cacheKey = (self.request.path, tuple(sorted((name, tuple(values)) for (name, values) in self.request.arguments.iteritems())))
+        self.cachedHeaders = {}
+        etag = '"%d"' % self.cacheVersion
+        self.set_header('Etag', etag)
+        cached = self.responseCache.get(self.cacheKey, self.cacheVersion)
+        if cached is None:
+            # the headers of the response are unknown, it is computed again
+            return False
+        body, contentType, headers = cached
+        for (name, value) in headers.iteritems():
+            self.set_header(name, value)
+        noneMatch = self.request.headers.get('If-None-Match')
+        if noneMatch is not None and (etag in noneMatch or noneMatch.strip() == '*'):
+            self.set_status(304)
+            self.finish()
+            return True
+        if body is None:
+            return False
+        if contentType is not None:
+            self.set_header('Content-Type', contentType)
+        self.writeCallback(body)
+        self.finish()
+        return True
+
+    def setCachedHeader(self, name, value):
+        '''
+        Sets a header of the response that is cached with it (e.g. the cursor of the next page).
+        '''
+        self.set_header(name, value)
+        if self.cacheKey is not None:
+            self.cachedHeaders[name] = value
+
+    def writeCached(self, chunk):
+        '''
+        Writes the response and caches it, a dict is sent as JSON.
+        '''
+        contentType = None
+        if isinstance(chunk, dict):
+            chunk = json.dumps(chunk)
+            contentType = 'application/json; charset=UTF-8'
+            self.set_header('Content-Type', contentType)
+        if self.cacheKey is not None:
+            self.responseCache.put(self.cacheKey, self.cacheVersion, chunk, contentType, self.cachedHeaders)
+        self.writeCallback(chunk)
+
+    def writeStream(self, chunks):
+        if self.cacheKey is not None:
+            chunks = self.iterCachedChunks(chunks)
+        BaseResource.writeStream(self, chunks)
+
+    def iterCachedChunks(self, chunks):
+        # keeps the streamed chunks to cache the response, only its headers if it is too big
+        pieces = []
+        size = 0
+        for chunk in chunks:
+            if pieces is not None:
+                size += len(chunk)
+                if size > self.responseCache.maxResponseSize:
+                    pieces = None
+                else:
+                    pieces.append(chunk)
+            yield chunk
+        self.responseCache.put(self.cacheKey, self.cacheVersion, ''.join(pieces) if pieces is not None else None,
+                               headers=self.cachedHeaders)
+
 from .webservicedispatcher import WebServiceDispatcher as WebService
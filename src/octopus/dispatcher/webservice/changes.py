@@ -0,0 +1,91 @@
+"""
+Change feed of the dispatcher: sends the nodes, commands and render nodes modified since a given version of the
+model, so that the clients polling the queue fetch deltas instead of the whole queue.
+
+GET /changes?since=<version>[&wait=<seconds>]
+
+{
+    "version": int,        # version to give as "since" in the next request
+    "resync": bool,        # the changes since the given version are not known anymore, reload the whole queue
+    "removed": {"nodes": [ids], "commands": [ids], "rendernodes": [ids]},
+    "nodes": [...],
+    "commands": [...],
+    "rendernodes": [...]
+}
+
+If wait is given and nothing changed since the given version, the request is answered when the next version is
+committed, or after wait seconds (at most CORE.CHANGES_MAX_WAIT) with no changes.
+"""
+
+import itertools
+import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import tornado
+import tornado.ioloop
+
+from octopus.core import singletonconfig
+from octopus.core.communication.http import Http400
+from octopus.core.framework import iterJSONList
+from octopus.dispatcher.webservice import DispatcherBaseResource
+
+__all__ = ['ChangesResource']
+
+
+class ChangesResource(DispatcherBaseResource):
+
+    @tornado.web.asynchronous
+    def get(self):
+        args = self.request.arguments
+        try:
+            self.since = int(args['since'][0]) if 'since' in args else 0
+            wait = float(args['wait'][0]) if 'wait' in args else 0
+        except ValueError:
+            raise Http400("Invalid arguments, since must be an integer and wait a number of seconds")
+        wait = min(wait, singletonconfig.get('CORE', 'CHANGES_MAX_WAIT', 60))
+        self.changeLog = self.getDispatchTree().changeLog
+        self.timeout = None
+        self.sending = False
+        if wait > 0:
+            self.timeout = tornado.ioloop.IOLoop.instance().add_timeout(time.time() + wait, self.sendChanges)
+            self.changeLog.wait(self.since, self.onNewVersion)
+        else:
+            self.sendChanges()
+
+    def onNewVersion(self, version):
+        # called by the thread committing the changes, the response is sent from the IOLoop
+        tornado.ioloop.IOLoop.instance().add_callback(self.sendChanges)
+
+    def stopWaiting(self):
+        if self.timeout is not None:
+            tornado.ioloop.IOLoop.instance().remove_timeout(self.timeout)
+            self.timeout = None
+        self.changeLog.cancelWait(self.onNewVersion)
+
+    def on_connection_close(self):
+        self.stopWaiting()
+
+    def sendChanges(self):
+        if self._finished or self.sending:
+            return
+        self.sending = True
+        self.stopWaiting()
+        if self.framework.scheduler is not None:
+            # the changes are read when the scheduler thread hands the model over
+            self.runWithModel(self.writeChanges)
+        else:
+            self.writeChanges()
+
+    def writeChanges(self):
+        version, resync, changed, removed = self.changeLog.getChanges(self.since)
+        head = '{"version": %d, "resync": %s, "removed": %s' % (version, json.dumps(resync), json.dumps(removed))
+        chunks = [[head]]
+        for kind in ('nodes', 'commands', 'rendernodes'):
+            # the representations are built while streaming
+            chunks.append([', "%s": ' % kind])
+            chunks.append(iterJSONList(changed[kind], lambda element: element.to_json()))
+        chunks.append(['}'])
+        self.writeStream(itertools.chain(*chunks))
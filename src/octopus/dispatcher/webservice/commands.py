@@ -9,7 +9,7 @@ from tornado.web import HTTPError
 import tornado
 
 from octopus.core.enums.command import *
-from octopus.core.framework import queue
+from octopus.core.framework import queue, snapshot, iterJSONList
 from octopus.core.communication.http import Http404, Http400, Http500, HttpConflict
 
 from octopus.dispatcher.model.nodequery import IQueryNode
@@ -27,15 +27,31 @@ from octopus.dispatcher.webservice import DispatcherBaseResource
 
 
 class CommandsResource(DispatcherBaseResource):
+    @tornado.web.asynchronous
+    @snapshot
     def get(self):
-        commands = self.framework.application.dispatchTree.commands.values()
-        commandRepresentations = [command.to_json() for command in commands]
-        commandRepresentations = json.dumps(commandRepresentations)
-        self.writeCallback(commandRepresentations)
+        """
+        Sends the list of the commands sorted by id, streamed in small pieces.
+        Optional arguments:
+          - limit: max number of commands sent, the id to give as cursor for the next page is sent in the
+            X-Next-Cursor header (no header for the last page)
+          - cursor: only the commands with a greater id are sent
+          - fields: names of the fields sent for each command (e.g. "fields=id,status")
+        """
+        args = self.request.arguments
+        limit, cursor = self.getPageArguments(args)
+        fields = self.getFieldsArgument(args)
+        commands = self.getDispatchTree().commands
+        ids, nextCursor = self.getPage(commands.keys(), limit, cursor)
+        if nextCursor is not None:
+            self.set_header('X-Next-Cursor', str(nextCursor))
+        # the commands are taken at once, the representations are built while streaming
+        page = filter(None, (commands.get(id) for id in ids))
+        self.writeStream(iterJSONList(page, lambda command: self.projectFields(command.to_json(), fields)))
 
 
 class CommandResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self, commandId):
         try:
             id = int(commandId)
@@ -46,7 +62,7 @@ class CommandResource(DispatcherBaseResource):
         body = json.dumps(rep)
         self.writeCallback(body)
 
-    #@queue
+    @queue
     def put(self, commandId):
         def work(self, commandId, toUpdate):
             commands = self.getDispatchTree().commands
@@ -176,6 +192,7 @@ class CommandQueryResource(DispatcherBaseResource, IQueryNode):
 
 
     @tornado.web.asynchronous
+    @snapshot
     def get(self):
         """
         Handle user query request.
@@ -187,6 +204,12 @@ class CommandQueryResource(DispatcherBaseResource, IQueryNode):
         args = self.request.arguments
 
         self.command = self.commandGenerator( args )
+        if self.framework.scheduler is not None:
+            # the model is only handed over to the IOLoop while the handler runs, the result is computed at once
+            for i in self.command:
+                pass
+            self.finish()
+            return
         tornado.ioloop.IOLoop.instance().add_callback(self.loop)
 
 
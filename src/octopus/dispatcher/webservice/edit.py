@@ -40,7 +40,7 @@ from octopus.dispatcher.model.nodequery import IQueryNode
 from octopus.core.enums.node import NODE_ERROR, NODE_CANCELED, NODE_DONE, NODE_READY
 from octopus.core.communication.http import Http404, Http400, Http500, HttpConflict
 
-from octopus.core.framework import BaseResource, queue
+from octopus.core.framework import BaseResource, queue, snapshot
 from octopus.dispatcher.webservice import DispatcherBaseResource
 
 __all__ = []
@@ -79,6 +79,7 @@ class EditStatusResource(DispatcherBaseResource, IQueryNode):
 
         return pNode.id
 
+    @queue
     def put(self):
         """
 
@@ -140,6 +141,7 @@ class PauseResource(DispatcherBaseResource, IQueryNode):
         except KeyError:
             raise KeyError
 
+    @queue
     def put(self):
         """
 
@@ -187,6 +189,7 @@ class ResumeResource(DispatcherBaseResource, IQueryNode):
         except KeyError:
             raise KeyError
 
+    @queue
     def put(self):
         """
 
@@ -233,6 +236,7 @@ class EditMaxRnResource(DispatcherBaseResource, IQueryNode):
     test: curl -X PUT  http://pulitest:8004/edit/maxrn?value=2&constraint_id=5028
     """
 
+    @queue
     def put(self):
         """
         """
@@ -294,6 +298,7 @@ class EditPrioResource(DispatcherBaseResource, IQueryNode):
     test: curl -X PUT  http://pulitest:8004/edit/prio?value=20&contraint_status=1
     """
 
+    @queue
     def put(self):
         """
         """
@@ -342,6 +347,7 @@ class EditPrioResource(DispatcherBaseResource, IQueryNode):
 
 
 class RenderNodeEditResource(DispatcherBaseResource, IQueryNode):
+    @snapshot
     def get(self):
         """
         """
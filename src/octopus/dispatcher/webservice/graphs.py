@@ -3,12 +3,14 @@ import logging
 
 from octopus.core.communication import *
 from octopus.core import singletonconfig, singletonstats
+from octopus.core.framework import queue
 from octopus.dispatcher.webservice import DispatcherBaseResource
 
 logger = logging.getLogger("main.dispatcher.webservice")
 
 
 class GraphesResource(DispatcherBaseResource):
+    @queue
     def post(self):
 
         if singletonconfig.get('CORE', 'GET_STATS'):
@@ -25,4 +27,3 @@ class GraphesResource(DispatcherBaseResource):
         self.set_header('Location', 'http://%s:%s/nodes/%d' % (host, port, nodes[0].id))
         self.set_status(201)
         self.writeCallback("Graph created.\nCreated nodes: %s" % (",".join([str(node.id) for node in nodes])))
-        self.finish()
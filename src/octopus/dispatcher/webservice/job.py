@@ -6,6 +6,7 @@ from __future__ import absolute_import
 __author__ = "Jerome Samson"
 __copyright__ = "Copyright 2014, Mikros Image"
 
+import itertools
 import logging
 import time
 try:
@@ -13,10 +14,11 @@ try:
 except ImportError:
     import json
 
+import tornado
 from tornado.web import HTTPError
 
 from octopus.core.communication.http import Http404
-from octopus.core.framework import ResourceNotFoundError
+from octopus.core.framework import ResourceNotFoundError, snapshot, iterJSONList
 from octopus.dispatcher.webservice import DispatcherBaseResource
 from octopus.dispatcher.model.filter.node import IFilterNode
 from octopus.dispatcher.model import Task as DispatcherTask
@@ -55,48 +57,51 @@ class JobQueryResource(DispatcherBaseResource, IFilterNode):
 
         return newJob
 
+    @tornado.web.asynchronous
+    @snapshot
     def post(self):
         """
+        Sends the jobs matching the filters of the request body, sorted by id and streamed in small pieces.
+        Optional body keys:
+          - limit/cursor: pagination (@see CommandsResource.get), the cursor of the next page is given by summary.nextCursor
+          - fields: names of the fields sent for each job
         """
         self.logger = logging.getLogger('main.query')
 
         filters = self.getBodyAsJSON()
         self.logger.debug('filters: %s' % filters)
+        limit, cursor = self.getPageArguments(dict((name, [filters[name]]) for name in ('limit', 'cursor') if name in filters))
+        fields = frozenset(filters['fields']) if 'fields' in filters else None
+        recursive = filters.get('recursive', True)
 
         try:
             start_time = time.time()
-            resultData = []
 
             # Root node is node 1.
             nodes = self.getDispatchTree().nodes[1].children
             totalNodes = len(nodes)
 
             #
-            # --- filtering
+            # --- filtering, using the indexes of the jobs maintained by the dispatch tree
             #
-            filteredNodes = self.matchNodes(filters, nodes)
+            filteredNodes, usedIndexes = self.getDispatchTree().jobIndex.matchNodes(filters, self.getDispatchTree())
             # self.logger.debug("Nodes have been filtered")
 
             #
-            # --- Prepare the result json object
+            # --- Select the requested page
             #
-            for currNode in filteredNodes:
-                tmp = self.createJobRepr(currNode, filters.get('recursive', True))
-                resultData.append(tmp.encode())
-
-            content = {
-                'summary': {
-                    'count': len(filteredNodes),
-                    'totalInDispatcher': totalNodes,
-                    'requestTime': time.time() - start_time,
-                    'requestDate': time.ctime()
-                },
-                'items': resultData
+            nodesById = dict((node.id, node) for node in filteredNodes)
+            ids, nextCursor = self.getPage(nodesById.keys(), limit, cursor)
+
+            summary = {
+                'count': len(filteredNodes),
+                'totalInDispatcher': totalNodes,
+                'requestTime': time.time() - start_time,
+                'requestDate': time.ctime(),
+                'indexes': usedIndexes,
+                'nextCursor': nextCursor
             }
 
-            # Create response and callback
-            self.writeCallback(json.dumps(content))
-
         except KeyError:
             raise Http404('Error unknown key')
 
@@ -105,3 +110,9 @@ class JobQueryResource(DispatcherBaseResource, IFilterNode):
 
         except Exception, e:
             raise HTTPError(500, "Impossible to retrieve jobs (%s)" % e)
+
+        #
+        # --- Stream the result json object, the representation of each job (and its subtree) is created when it is sent
+        #
+        items = iterJSONList([nodesById[id] for id in ids], lambda node: self.projectFields(self.createJobRepr(node, recursive).encode(), fields))
+        self.writeStream(itertools.chain(['{"summary": %s, "items": ' % json.dumps(summary)], items, ['}']))
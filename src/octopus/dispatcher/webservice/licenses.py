@@ -4,19 +4,21 @@ Created on Apr 27, 2012
 @author: Arnaud Chassagne
 '''
 
-from octopus.core.framework import ResourceNotFoundError
+from octopus.core.framework import ResourceNotFoundError, queue, snapshot
 from octopus.dispatcher.webservice import DispatcherBaseResource
 from octopus.core.communication.http import Http404, Http500
 
 
 class LicensesResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self):
-        self.writeCallback(repr(self.dispatcher.licenseManager))
+        if self.answerFromCache():
+            return
+        self.writeCached(repr(self.dispatcher.licenseManager))
 
 
 class LicenseResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self, licenseName):
         try:
             lic = self.dispatcher.licenseManager.licenses[licenseName]
@@ -28,7 +30,7 @@ class LicenseResource(DispatcherBaseResource):
         except KeyError:
             raise ResourceNotFoundError
 
-    #@queue
+    @queue
     def put(self, licenseName):
         data = self.getBodyAsJSON()
         try:
@@ -39,7 +41,7 @@ class LicenseResource(DispatcherBaseResource):
             self.dispatcher.licenseManager.setMaxLicensesNumber(licenseName, maxLic)
             self.writeCallback("OK")
 
-    #@queue
+    @queue
     def delete(self, licenseName):
         data = self.getBodyAsJSON()
         try:
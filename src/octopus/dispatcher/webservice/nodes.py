@@ -5,6 +5,7 @@ from octopus.core.enums.node import NODE_ERROR, NODE_CANCELED, NODE_DONE, NODE_R
 from octopus.dispatcher.model.task import TaskGroup
 from octopus.core.enums.command import CMD_READY, CMD_RUNNING, CMD_CANCELED
 from octopus.dispatcher.webservice import DispatcherBaseResource
+from octopus.dispatcher import workerclient
 
 import logging
 import time
@@ -20,7 +21,7 @@ from tornado.web import HTTPError
 logger = logging.getLogger("main.dispatcher.webservice.NodeController")
 
 from octopus.core.communication import *
-from octopus.core.framework import ResourceNotFoundError, ControllerError, queue
+from octopus.core.framework import ResourceNotFoundError, ControllerError, queue, snapshot
 from octopus.dispatcher.model import FolderNode, TaskNode, Task
 from octopus.dispatcher.webservice.tasks import TaskNotFoundError
 
@@ -53,7 +54,7 @@ if __name__ == '__main__':
 
 
 class NodesResource(DispatcherBaseResource):
-    ##@queue
+    @snapshot
     def get(self):
         self.writeCallback(self.getNode(0))
 
@@ -76,13 +77,13 @@ class NodesResource(DispatcherBaseResource):
 
 
 class NodeResource(NodesResource):
-    ##@queue
+    @snapshot
     def get(self, nodeId):
         self.writeCallback(self.getNode(nodeId))
 
 
 class NodeNameResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         '''
         Pushes an order to change the name of the given node.
@@ -102,53 +103,39 @@ class NodeCancelResource(NodesResource):
     It handles the process in 2 steps:
     - reset node and commands on the dispatch tree (server side)
     - send "DELETE" request to the rendernode on which a command was assigned
-    The 2nd step is executed in a dedicated thread to avoir blocking tornado
+    The requests of the 2nd step are sent concurrently by the worker client to avoid blocking tornado,
+    the assignments are cleared when they complete (in the dispatcher main loop)
     '''
 
+    @queue
     def put(self, nodeId):
-        # If user action is CANCEL, we use asynchronous webservice to avoid the timeout that
-        # might occur when sending requests to each render node.
-
         node = self._findNode(int(nodeId))
-        self.interruptedRnList = []
 
+        client = workerclient.getClient()
         for cmd in node.cmdIterator():
             if cmd.status == CMD_RUNNING:
-                self.interruptedRnList.append((cmd.renderNode, cmd.id))
+                rn = cmd.renderNode
                 cmd.status = CMD_CANCELED
-
-        if len(self.interruptedRnList) > 0:
-            from threading import Thread
-            t = Thread(target=self.sendCancelRequests)
-            t.start()
+                client.send(rn, "DELETE", "/commands/" + str(cmd.id) + "/",
+                            onResponse=self.cancelRequestSent, onError=self.cancelRequestFailed, context=cmd)
 
         # logger.debug("Done updating server")
         self.writeCallback("New status has been taken into account. Change will be effective soon")
-        self.finish()
-
-    def sendCancelRequests(self):
-        '''
-        Send a specific request to each rendernodes.
-        '''
-        for rn, cmdId in self.interruptedRnList:
-            # For each RN marked as having a running command
-            try:
-                rn.request("DELETE", "/commands/" + str(cmdId) + "/")
-            except:
-                logger.warning("Problem occured interruption of %s for command %s (however command has already been reseted on the server)" % (cmdId, rn))
 
-            # Reset RN assignment to make it available for a future assignment
-            rn.clearAssignment(self)
+    def cancelRequestSent(self, request, response, data):
+        # Reset RN assignment to make it available for a future assignment
+        request.renderNode.clearAssignment(request.context)
 
-        # Clean rn list after process
-        self.interruptedRnList = []
+    def cancelRequestFailed(self, request, error):
+        logger.warning("Problem occured interruption of %s for command %s (however command has already been reseted on the server)" % (request.context.id, request.renderNode))
+        request.renderNode.clearAssignment(request.context)
 
 
 class NodeStatusResource(NodesResource):
     '''
     TOFIX: specific case for a retry all command on errors should be handled in another WS for better understanding
     '''
-    @tornado.web.asynchronous
+    @queue
     def put(self, nodeId):
         '''
         | Pushes an order to change the status of the given node.
@@ -201,7 +188,6 @@ class NodeStatusResource(NodesResource):
                 else:
                     msg = "No commands were restarted."
                 self.writeCallback("Done. %s" % msg)
-                self.finish()
             #
             # handles the 'general' setStatus
             #
@@ -215,37 +201,37 @@ class NodeStatusResource(NodesResource):
                 if nodeStatus not in NODE_STATUS:
                     raise Http400("Invalid status value %r" % nodeStatus)
                 elif nodeStatus == NODE_CANCELED:
-                    # If user action is CANCEL, we use asynchronous webservice to avoid the timeout that
-                    # might occur when sending requests to each render node.
-                    self.gen = node.cmdIterator()
-                    tornado.ioloop.IOLoop.instance().add_callback(self.iterOnCommands)
-
+                    # If user action is CANCEL, the requests to the render nodes are sent concurrently by the worker
+                    # client to avoid the timeout that might occur when sending requests to each render node.
+                    self.cancelCommands(node)
                     self.writeCallback("New status (CANCEL) has been taken into account. Change will be effective soon")
                 else:
                     if node.setStatus(nodeStatus, cascadeUpdate):
                         self.writeCallback("Status set to %r" % nodeStatus)
-                        self.finish()
                     else:
                         self.writeCallback("Status was not changed.")
-                        self.finish()
 
-    def iterOnCommands(self):
+    def cancelCommands(self, node):
         """
-        Cancel each command in a node hierarchy (command is given by a generator on the node)
-        Each command might be blocked by network pb (or machine swapping) but asynchronous mecanism will
-        allow other request to be treated between each command cancelation.
+        Cancel each command in a node hierarchy. The running commands are cleared from their render node and
+        canceled at once, the DELETE requests are sent by the worker client and only their failures are reported.
         """
-        try:
-            # Get next command in generator
-            cmd = self.gen.next()
-            cmd.cancel()
-            tornado.ioloop.IOLoop.instance().add_callback(self.iterOnCommands)
-        except StopIteration:
-            self.finish()
+        client = workerclient.getClient()
+        for cmd in node.cmdIterator():
+            if cmd.status == CMD_RUNNING and cmd.renderNode is not None:
+                rn = cmd.renderNode
+                rn.clearAssignment(cmd)
+                cmd.status = CMD_CANCELED
+                client.send(rn, "DELETE", "/commands/" + str(cmd.id) + "/", onError=self.cancelRequestFailed, context=cmd)
+            else:
+                cmd.cancel()
+
+    def cancelRequestFailed(self, request, error):
+        logger.error("Impossible to reach RN %s to cancel command %d." % (request.renderNode, request.context.id))
 
 
 class NodePausedResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         data = self.getBodyAsJSON()
         try:
@@ -262,7 +248,7 @@ class NodePausedResource(NodesResource):
 
 
 class NodePauseKillResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         nodeId = int(nodeId)
         node = self._findNode(nodeId)
@@ -285,7 +271,7 @@ class NodePauseKillResource(NodesResource):
 
 
 class NodePriorityResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         '''
         Pushes an order to change the priority of the given node.
@@ -303,7 +289,7 @@ class NodePriorityResource(NodesResource):
 
 
 class NodeDispatchKeyResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         '''
         Pushes an order to change the dispatch key of the given node.
@@ -320,7 +306,7 @@ class NodeDispatchKeyResource(NodesResource):
 
 
 class NodeMaxRNResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         '''
         Pushes an order to change the maxRN of the given node.
@@ -337,7 +323,7 @@ class NodeMaxRNResource(NodesResource):
 
 
 class NodeStrategyResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         '''
         Pushes an order to change the strategy of the given node.
@@ -360,7 +346,7 @@ class NodeStrategyResource(NodesResource):
 
 
 class NodeUserResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         '''
         Sets the user of a node.
@@ -382,7 +368,7 @@ class NodeUserResource(NodesResource):
 
 
 class NodeProdResource(NodesResource):
-    ##@queue
+    @queue
     def put(self, nodeId):
         data = self.getBodyAsJSON()
         try:
@@ -394,10 +380,11 @@ class NodeProdResource(NodesResource):
             node = self._findNode(nodeId)
             node.tags["prod"] = str(prod)
             self.dispatcher.dispatchTree.toModifyElements.append(node)
+            self.dispatcher.dispatchTree.jobIndex.markDirty(node)
 
 
 class NodeChildrenResource(NodesResource):
-    #@queue
+    @snapshot
     def get(self, nodeId):
         '''
         Returns a HTTP response containing the list of the children of node `nodeId`.
@@ -486,6 +473,7 @@ class NodeChildrenResource(NodesResource):
 
 class NodeMaxAttemptResource(NodesResource):
 
+    @queue
     def put(self, nodeId):
         '''
         | Put a new value for the maxAttempt attribute of a task node
@@ -8,7 +8,7 @@ import logging
 from octopus.dispatcher.model.pool import Pool
 from octopus.core.communication.http import Http404, Http400, HttpConflict
 
-from octopus.core.framework import queue
+from octopus.core.framework import queue, snapshot
 from octopus.dispatcher.webservice import DispatcherBaseResource
 
 __all__ = []
@@ -17,16 +17,18 @@ logger = logging.getLogger('main.dispatcher.webservice.PoolController')
 
 
 class PoolsResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self):
+        if self.answerFromCache():
+            return
         pools = self.getDispatchTree().pools.values()
-        self.writeCallback({
+        self.writeCached({
             'pools': dict(((pool.name, pool.to_json()) for pool in pools))
         })
 
 
 class PoolResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self, poolName):
         try:
             pool = self.getDispatchTree().pools[poolName]
@@ -36,7 +38,7 @@ class PoolResource(DispatcherBaseResource):
             'pool': pool.to_json()
         })
 
-    #@queue
+    @queue
     def post(self, poolName):
         if poolName in self.getDispatchTree().pools:
             raise HttpConflict("Pool already registered")
@@ -46,7 +48,7 @@ class PoolResource(DispatcherBaseResource):
 
             self.writeCallback(json.dumps(tmpPool.to_json()))
 
-    #@queue
+    @queue
     def delete(self, poolName):
         try:
             # remove reference of the pool from all rendernodes
@@ -61,7 +63,7 @@ class PoolResource(DispatcherBaseResource):
 
 
 class PoolRenderNodesResource(DispatcherBaseResource):
-    #@queue
+    @queue
     def put(self, poolName):
         dct = self.getBodyAsJSON()
         if poolName not in self.getDispatchTree().pools:
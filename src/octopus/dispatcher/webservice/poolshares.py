@@ -9,7 +9,7 @@ except ImportError:
     import json
 
 from octopus.core.communication.http import Http404, Http400, HttpConflict
-from octopus.core.framework import queue
+from octopus.core.framework import queue, snapshot
 from octopus.dispatcher.model.pool import PoolShare, PoolShareCreationException
 from octopus.dispatcher.webservice import DispatcherBaseResource
 
@@ -22,13 +22,13 @@ LOGGER = logging.getLogger('main.poolshares')
 
 
 class PoolSharesResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self):
         """ Returns a dict of all poolshares as JSON """
         poolShares = self.getDispatchTree().poolShares.values()
         self.writeCallback({'poolshares': dict(((poolShare.id, poolShare.to_json()) for poolShare in poolShares))})
 
-    #@queue
+    @queue
     def put(self):
         dct = self.getBodyAsJSON()
 
@@ -39,7 +39,7 @@ class PoolSharesResource(DispatcherBaseResource):
                 poolShares.append(self.getDispatchTree().poolShares[int(psId)])
             self.writeCallback({'poolshares': dict(((poolShare.node.id, poolShare.to_json()) for poolShare in poolShares))})
 
-    #@queue
+    @queue
     def post(self):
         """
         Called when user changes the pool of a specific node (via pulback -> "Set job's pool").
@@ -74,7 +74,7 @@ class PoolSharesResource(DispatcherBaseResource):
 
 
 class PoolShareResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self, id):
         """ Returns a specific poolshare as JSON """
         try:
@@ -85,7 +85,7 @@ class PoolShareResource(DispatcherBaseResource):
             'poolshare': poolShare.to_json()
         })
 
-    #@queue
+    @queue
     def post(self, id):
         '''
         This request is sent when a user wants to update a poolshare's maxRN.
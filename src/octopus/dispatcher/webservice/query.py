@@ -54,13 +54,16 @@ try:
 except ImportError:
     import json
 
+import itertools
 import logging
 import time
 import types
 import re
 
+import tornado
 from tornado.web import HTTPError
 
+from octopus.core.framework import snapshot, iterJSONList
 from octopus.dispatcher.model.nodequery import IQueryNode
 
 from octopus.core.communication.http import Http404, Http400, Http500, HttpConflict
@@ -127,6 +130,8 @@ class QueryResource(DispatcherBaseResource, IQueryNode):
             currTask['items'] = childTasks
         return currTask
 
+    @tornado.web.asynchronous
+    @snapshot
     def get(self):
         """
         Handle user query request.
@@ -134,16 +139,20 @@ class QueryResource(DispatcherBaseResource, IQueryNode):
           2. check attributes to retrieve
           3. limit nodes list regarding the given query filters
           4. for each filtered node: add info in result
+        The items are sorted by id and streamed in small pieces. Optional pagination arguments "limit" and
+        "cursor" (@see CommandsResource.get), the cursor of the next page is given by summary.nextCursor.
         """
+        if self.answerFromCache():
+            return
         args = self.request.arguments
         if 'tree' in args:
             tree = bool(args['tree'])
         else:
             tree = False
+        limit, cursor = self.getPageArguments(args)
 
         try:
             start_time = time.time()
-            resultData = []
             filteredNodes = []
 
             nodes = self.getDispatchTree().nodes[1].children
@@ -160,10 +169,11 @@ class QueryResource(DispatcherBaseResource, IQueryNode):
                         'requestTime': time.time() - start_time,
                         'requestDate': time.ctime()
                     },
-                    'items': resultData
+                    'items': []
                 }
 
-                self.writeCallback(json.dumps(content))
+                self.writeCached(json.dumps(content))
+                self.finish()
                 return
 
             #
@@ -187,30 +197,29 @@ class QueryResource(DispatcherBaseResource, IQueryNode):
                 args['attr'] = QueryResource.DEFAULT_FIELDS
 
             #
-            # --- filtering
+            # --- filtering, using the indexes of the jobs maintained by the dispatch tree
             #
-            filteredNodes = self.filterNodes(args, nodes)
+            try:
+                filteredNodes, usedIndexes = self.getDispatchTree().jobIndex.filterNodes(args, self.getDispatchTree())
+            except ValueError:
+                logger.warning('Error: invalid constraint value, the format definition of dates is "YYYY-mm-dd HH:MM:SS"')
+                raise HTTPError(400, 'Invalid constraint value')
 
             #
-            # --- Prepare the result json object
+            # --- Select the requested page
             #
-            for currNode in filteredNodes:
-                currTask = self.createTaskRepr(currNode, args['attr'], tree)
-                resultData.append(currTask)
-
-            content = {
-                'summary': {
-                    'count': len(filteredNodes),
-                    'totalInDispatcher': totalNodes,
-                    'requestTime': time.time() - start_time,
-                    'requestDate': time.ctime()
-                },
-                'items': resultData
+            nodesById = dict((node.id, node) for node in filteredNodes)
+            ids, nextCursor = self.getPage(nodesById.keys(), limit, cursor)
+
+            summary = {
+                'count': len(filteredNodes),
+                'totalInDispatcher': totalNodes,
+                'requestTime': time.time() - start_time,
+                'requestDate': time.ctime(),
+                'indexes': usedIndexes,
+                'nextCursor': nextCursor
             }
 
-            # Create response and callback
-            self.writeCallback(json.dumps(content))
-
         except KeyError:
             raise Http404('Error unknown key')
 
@@ -221,6 +230,12 @@ class QueryResource(DispatcherBaseResource, IQueryNode):
             logger.warning('Impossible to retrieve result for query: %s', self.request.uri)
             raise HTTPError(500, "Internal error")
 
+        #
+        # --- Stream the result json object, the representation of each node is created when it is sent
+        #
+        items = iterJSONList([nodesById[id] for id in ids], lambda node: self.createTaskRepr(node, args['attr'], tree))
+        self.writeStream(itertools.chain(['{"summary": %s, "items": ' % json.dumps(summary)], items, ['}']))
+
 
 
     # def createJobRepr(self, pNode, recursive=True):
@@ -366,6 +381,7 @@ class RenderNodeQueryResource(DispatcherBaseResource, IQueryNode):
 
         return result
 
+    @snapshot
     def get(self):
         """
         Handle user query request.
@@ -505,6 +521,7 @@ class RenderNodeQuery2Resource(DispatcherBaseResource):
 
         return False
 
+    @snapshot
     def post(self):
         """
         Handle user query request.
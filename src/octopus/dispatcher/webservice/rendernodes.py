@@ -1,18 +1,20 @@
 from __future__ import with_statement
 
+import itertools
 import time
 try:
     import simplejson as json
 except ImportError:
     import json
 import logging
+import tornado
 from tornado.web import HTTPError
 
 from octopus.core.communication import HttpResponse, Http400, Http404, Http403, HttpConflict, Http500
 from octopus.core.enums.rendernode import *
 
 from octopus.core import enums, singletonstats, singletonconfig
-from octopus.core.framework import ResourceNotFoundError
+from octopus.core.framework import ResourceNotFoundError, queue, snapshot, iterJSONList
 
 from octopus.dispatcher.model import RenderNode
 from octopus.dispatcher.model.filter.rendernode import IFilterRenderNode
@@ -36,11 +38,28 @@ class RenderNodesResource(DispatcherBaseResource):
     :param: request the HTTP request
     """
 
+    @tornado.web.asynchronous
+    @snapshot
     def get(self):
-        rendernodes = self.getDispatchTree().renderNodes.values()
-        content = {'rendernodes': list(rendernode.to_json() for rendernode in rendernodes)}
-        content = json.dumps(content)
-        self.writeCallback(content)
+        """
+        Sends the render nodes sorted by id, streamed in small pieces.
+        Optional arguments (@see CommandsResource.get):
+          - limit: max number of render nodes sent, the cursor of the next page is sent in the X-Next-Cursor header
+          - cursor: only the render nodes with a greater id are sent
+          - fields: names of the fields sent for each render node
+        """
+        if self.answerFromCache():
+            return
+        args = self.request.arguments
+        limit, cursor = self.getPageArguments(args)
+        fields = self.getFieldsArgument(args)
+        rendernodes = dict((rendernode.id, rendernode) for rendernode in self.getDispatchTree().renderNodes.values())
+        ids, nextCursor = self.getPage(rendernodes.keys(), limit, cursor)
+        if nextCursor is not None:
+            self.setCachedHeader('X-Next-Cursor', str(nextCursor))
+        page = [rendernodes[id] for id in ids]
+        items = iterJSONList(page, lambda rendernode: self.projectFields(rendernode.to_json(), fields))
+        self.writeStream(itertools.chain(['{"rendernodes": '], items, ['}']))
 
 
 class RenderNodeResource(DispatcherBaseResource):
@@ -49,6 +68,7 @@ class RenderNodeResource(DispatcherBaseResource):
     # @param request the HTTP request object for this request
     # @param computerName the name of the requested render node
     #
+    @snapshot
     def get(self, computerName):
         computerName = computerName.lower()
         try:
@@ -59,6 +79,7 @@ class RenderNodeResource(DispatcherBaseResource):
         content = json.dumps(content)
         self.writeCallback(content)
 
+    @queue
     def post(self, computerName):
         """
         A worker send a request to get registered on the server.
@@ -129,7 +150,7 @@ class RenderNodeResource(DispatcherBaseResource):
             self.getDispatchTree().renderNodes[renderNode.name] = renderNode
             self.writeCallback(json.dumps(renderNode.to_json()))
 
-    #@queue
+    @queue
     def put(self, computerName):
         computerName = computerName.lower()
         try:
@@ -155,7 +176,7 @@ class RenderNodeResource(DispatcherBaseResource):
     # @param computerName the name of the requested render node
     #
     #@fqdn_request_decorator
-    #@queue
+    @queue
     def delete(self, computerName):
         computerName = computerName.lower()
 
@@ -172,13 +193,20 @@ class RenderNodeResource(DispatcherBaseResource):
 
 
 class RenderNodeCommandsResource(DispatcherBaseResource):
-    #@queue
     def put(self, computerName, commandId):
         '''Update command `commandId` running on rendernode `renderNodeId`.
 
         Returns "200 OK" on success, or "404 Bad Request" if the provided json data is not valid.
+        When the main loop runs in a scheduler thread, the update is checked while the model is handed over to the
+        IOLoop and applied afterwards: the worker does not wait for the end of the cycle (@see Dispatcher.updateCommands).
         '''
+        if self.framework.scheduler is None:
+            return self.updateCommand(computerName)
+        # the model is not modified while it is handed over
+        self.readOnly = True
+        self.runWithModel(self.updateCommand, computerName)
 
+    def updateCommand(self, computerName):
         if singletonconfig.get('CORE', 'GET_STATS'):
             singletonstats.theStats.cycleCounts['update_commands'] += 1
 
@@ -190,16 +218,15 @@ class RenderNodeCommandsResource(DispatcherBaseResource):
         updateDict = self.getBodyAsJSON()
         updateDict['renderNodeName'] = computerName
 
-        try:
-            self.framework.application.updateCommandApply(updateDict)
-        except (KeyError, IndexError) as e:
-            raise Http404(str(e))
-        except Exception, e:
+        error = self.framework.application.updateCommands([updateDict])[0]
+        if isinstance(error, (KeyError, IndexError)):
+            raise Http404(str(error))
+        elif error is not None:
             raise Http500("Exception during command update")
 
         self.writeCallback("Command updated")
 
-    #@queue
+    @queue
     def delete(self, computerName, commandId):
         computerName = computerName.lower()
         commandId = int(commandId)
@@ -228,8 +255,47 @@ class RenderNodeCommandsResource(DispatcherBaseResource):
                 return HTTPError(403, message)
 
 
+class RenderNodeCommandsBatchResource(DispatcherBaseResource):
+    def put(self, computerName):
+        '''Updates several commands running on rendernode `computerName`.
+
+        The body holds a "commands" list of update dicts, as sent to RenderNodeCommandsResource for one command.
+        Each update is applied separately, the answer holds a "results" list of {"id", "status"} dicts where the
+        status is the one the single command update would have returned (200, 404 or 500).
+        As for a single command, the worker does not wait for the end of the cycle (@see Dispatcher.updateCommands).
+        '''
+        if self.framework.scheduler is None:
+            return self.updateCommands(computerName)
+        # the model is not modified while it is handed over
+        self.readOnly = True
+        self.runWithModel(self.updateCommands, computerName)
+
+    def updateCommands(self, computerName):
+        computerName = computerName.lower()
+        updates = self.getBodyAsJSON()['commands']
+        if singletonconfig.get('CORE', 'GET_STATS'):
+            singletonstats.theStats.cycleCounts['update_commands'] += len(updates)
+
+        for updateDict in updates:
+            updateDict['renderNodeName'] = computerName
+        errors = self.framework.application.updateCommands(updates)
+
+        results = []
+        for (updateDict, error) in zip(updates, errors):
+            if isinstance(error, (KeyError, IndexError)):
+                logger.warning("Command update from %s refused: %s" % (computerName, error))
+                status = 404
+            elif error is not None:
+                status = 500
+            else:
+                status = 200
+            results.append({'id': updateDict.get('id'), 'status': status})
+
+        self.write({'results': results})
+
+
 class RenderNodeSysInfosResource(DispatcherBaseResource):
-    #@queue
+    @queue
     def put(self, computerName):
         computerName = computerName.lower()
         rns = self.getDispatchTree().renderNodes
@@ -277,7 +343,7 @@ class RenderNodesPerfResource(DispatcherBaseResource):
     Sets a performance index (float) for one or several given rendernode names
     TOFIX: might not be actually used, need to verify
     """
-    #@queue
+    @queue
     def put(self):
         dct = self.getBodyAsJSON()
         for computerName, perf in dct.items():
@@ -287,7 +353,7 @@ class RenderNodesPerfResource(DispatcherBaseResource):
 
 
 class RenderNodeResetResource(DispatcherBaseResource):
-    #@queue
+    @queue
     def put(self, computerName):
         computerName = computerName.lower()
         rns = self.getDispatchTree().renderNodes
@@ -301,6 +367,7 @@ class RenderNodeResetResource(DispatcherBaseResource):
 
 
 class RenderNodeQuarantineResource(DispatcherBaseResource):
+    @queue
     def put(self):
         """
         Used to set a quarantine on a list of rendernodes. Quarantine rns have a flag "excluded"
@@ -322,7 +389,7 @@ class RenderNodeQuarantineResource(DispatcherBaseResource):
             renderNode.excluded = quarantine
 
             if not quarantine:
-                renderNode.history.clear()
+                renderNode.clearHistory()
                 renderNode.tasksHistory.clear()
 
             logging.getLogger("main.dispatcher.webservice").info("Rendernode quarantine state changed: %s -> quarantine=%s" % (computerName, quarantine))
@@ -330,7 +397,7 @@ class RenderNodeQuarantineResource(DispatcherBaseResource):
 
 
 class RenderNodePausedResource(DispatcherBaseResource):
-    #@queue
+    @queue
     def put(self, computerName):
         dct = self.getBodyAsJSON()
         paused = dct['paused']
@@ -364,6 +431,7 @@ class RenderNodeQueryResource(DispatcherBaseResource, IFilterRenderNode):
         newData.createFromNode(pNode)
         return newData
 
+    @snapshot
     def post(self):
         """
         """
@@ -0,0 +1,60 @@
+"""
+Cache of the responses of the read-only resources of the dispatcher.
+
+A response is cached with the version of the model it was computed from (@see ChangeLog). The version is
+incremented when the changes recorded by the listeners of the dispatch tree are committed, so a cached
+response stays valid until the next commit and all the clients polling a resource meanwhile share a single
+computation. The version is also the ETag of the responses. The headers describing a response (e.g. the
+cursor of the next page) are cached with it, to be sent again with the cached body or with a 304.
+"""
+
+from __future__ import with_statement
+
+from threading import Lock
+
+# max number of responses kept
+MAX_ENTRIES = 256
+
+# responses bigger than this are not kept (in bytes)
+MAX_RESPONSE_SIZE = 4 * 1024 * 1024
+
+
+class ResponseCache(object):
+
+    def __init__(self, maxEntries=MAX_ENTRIES, maxResponseSize=MAX_RESPONSE_SIZE):
+        self.maxEntries = maxEntries
+        self.maxResponseSize = maxResponseSize
+        self.lock = Lock()
+        # key -> (version, body or None if it is too big, content type, headers)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    ## Returns the (body, content type, headers) tuple cached for the key and the version, None if there is none.
+    # The body is None if the response was too big to be kept.
+    #
+    def get(self, key, version):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1:]
+
+    def put(self, key, version, body, contentType=None, headers=None):
+        if body is not None and len(body) > self.maxResponseSize:
+            # only the headers are kept, to answer the conditional requests
+            body = None
+        with self.lock:
+            current = self.entries.get(key)
+            if current is not None and current[0] > version:
+                # computed from an older version than the cached one
+                return
+            if current is None and len(self.entries) >= self.maxEntries:
+                # the entries of the previous versions are useless, drop them first
+                for (cachedKey, entry) in self.entries.items():
+                    if entry[0] != version:
+                        del self.entries[cachedKey]
+                if len(self.entries) >= self.maxEntries:
+                    self.entries.clear()
+            self.entries[key] = (version, body, contentType, headers or {})
@@ -9,7 +9,7 @@ except ImportError:
 logger = logging.getLogger('main.dispatcher.webservice.TaskController')
 
 from tornado.web import HTTPError
-from octopus.core.framework import ResourceNotFoundError, BaseResource, queue
+from octopus.core.framework import ResourceNotFoundError, BaseResource, queue, snapshot
 from octopus.core.enums.node import *
 from octopus.dispatcher.model import TaskGroup, Task
 from octopus.dispatcher.webservice import DispatcherBaseResource
@@ -30,7 +30,7 @@ class TaskNotFoundError(ResourceNotFoundError):
 
 
 class TasksResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self):
         tasks = self.getDispatchTree().tasks
         tasks = [task.to_json() for task in tasks.values()]
@@ -40,7 +40,7 @@ class TasksResource(DispatcherBaseResource):
 
 
 class DeleteTasksResource(DispatcherBaseResource):
-    #@queue
+    @queue
     def post(self):
         data = self.getBodyAsJSON()
         try:
@@ -76,7 +76,7 @@ class DeleteTasksResource(DispatcherBaseResource):
 
 
 class TaskResource(DispatcherBaseResource):
-    #@queue
+    @snapshot
     def get(self, taskID):
         taskID = int(taskID)
         task = self._findTask(taskID)
@@ -93,7 +93,7 @@ class TaskResource(DispatcherBaseResource):
 
 
 class TaskCommentResource(TaskResource):
-    #@queue
+    @queue
     def put(self, taskId):
         '''
         Sets a comment on the task.
@@ -117,7 +117,7 @@ class TaskCommentResource(TaskResource):
 
 
 class TaskUserResource(TaskResource):
-    #@queue
+    @queue
     def put(self, taskId):
         '''
         Sets the user of a task.
@@ -135,7 +135,7 @@ class TaskUserResource(TaskResource):
 
 
 class TaskRamResource(TaskResource):
-    #@queue
+    @queue
     def put(self, taskId):
         '''
         Sets the min ram required for a task.
@@ -154,7 +154,7 @@ class TaskRamResource(TaskResource):
 
 
 class TaskTimerResource(TaskResource):
-    #@queue
+    @queue
     def put(self, taskId):
         '''
         Sets the timer for a task.
@@ -176,7 +176,7 @@ class TaskTimerResource(TaskResource):
 
 
 class TaskEnvResource(TaskResource):
-    #@queue
+    @queue
     def post(self, taskId):
         taskId = int(taskId)
         task = self._findTask(taskId)
@@ -187,7 +187,7 @@ class TaskEnvResource(TaskResource):
         message = "Environment of task %d has successfully been set." % taskId
         self.writeCallback(message)
 
-    #@queue
+    @queue
     def put(self, taskId):
         taskId = int(taskId)
         data = self.getBodyAsJSON()
@@ -202,7 +202,7 @@ class TaskEnvResource(TaskResource):
 
 
 class TaskArgumentResource(TaskResource):
-    #@queue
+    @queue
     def post(self, taskId):
         taskId = int(taskId)
         data = self.getBodyAsJSON()
@@ -218,7 +218,7 @@ class TaskArgumentResource(TaskResource):
         message = "Arguments of task %d have successfully been set." % taskId
         self.writeCallback(message)
 
-    #@queue
+    @queue
     def put(self, taskId):
         taskId = int(taskId)
         task = self._findTask(taskId)
@@ -230,7 +230,7 @@ class TaskArgumentResource(TaskResource):
 
 
 class TaskCommandResource(TaskResource):
-    #@queue
+    @snapshot
     def get(self, taskId):
         taskId = int(taskId)
         query = self.getBodyAsJSON()
@@ -264,7 +264,7 @@ class TaskCommandResource(TaskResource):
 
 
 class TaskTreeResource(TaskResource):
-    #@queue
+    @snapshot
     def get(self, taskId):
         taskId = int(taskId)
         try:
@@ -19,10 +19,11 @@ import tornado
 from tornado.web import Application
 
 from octopus.core.communication.http import Http500
+from octopus.core.framework import snapshot
 from octopus.dispatcher.webservice import commands, rendernodes, graphs, nodes,\
     tasks, poolshares, pools, licenses, \
     query, edit
-from octopus.dispatcher.webservice import job
+from octopus.dispatcher.webservice import job, changes
 
 from octopus.core.enums.command import *
 from octopus.dispatcher.webservice import DispatcherBaseResource
@@ -48,6 +49,7 @@ class WebServiceDispatcher(Application):
             (r'/rendernodes/quarantine/?$', rendernodes.RenderNodeQuarantineResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/?$', rendernodes.RenderNodeResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/commands/(\d+)/?$', rendernodes.RenderNodeCommandsResource, dict(framework=framework)),
+            (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/commands/?$', rendernodes.RenderNodeCommandsBatchResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/sysinfos/?$', rendernodes.RenderNodeSysInfosResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/paused/?$', rendernodes.RenderNodePausedResource, dict(framework=framework)),
             (r'/rendernodes/((?:\d+)|(?:[\w.-]+:\d+))/reset/?$', rendernodes.RenderNodeResetResource, dict(framework=framework)),
@@ -108,6 +110,9 @@ class WebServiceDispatcher(Application):
             (r'^/query/rendernode$', rendernodes.RenderNodeQueryResource, dict(framework=framework)),
             (r'^/query/command$', commands.CommandQueryResource, dict(framework=framework)),
 
+            # Change feed: elements modified since a given version of the model
+            (r'^/changes/?$', changes.ChangesResource, dict(framework=framework)),
+
             # System maintenance WS
             (r'^/system/?$', SystemResource, dict(framework=framework)),
             (r'^/mobile/?$', MobileResource, dict(framework=framework)),
@@ -124,46 +129,45 @@ class WebServiceDispatcher(Application):
 
 
 class StatsResource(DispatcherBaseResource):
+    @snapshot
     def get(self):
         from octopus.core.enums.rendernode import RN_UNKNOWN, RN_STATUS_NAMES
         from octopus.core.enums.node import NODE_STATUS_NAMES
 
+        if self.answerFromCache():
+            return
+
         tree = self.getDispatchTree()
+        # counters maintained by the listeners of the dispatch tree, no need to walk the model
+        counters = tree.farmCounters.getCounters(tree)
 
         #
         # Get info on commands
         #
         commandsByStatus = {}
-        for name in CMD_STATUS_NAME:
-            commandsByStatus[name] = 0
-        for command in tree.commands.values():
-            status = CMD_STATUS_NAME[command.status]
-            commandsByStatus[status] += 1
+        for (status, name) in enumerate(CMD_STATUS_NAME):
+            commandsByStatus[name] = counters['commands'].get(status, 0)
 
-        commandsByStatus['TOTAL'] = len(tree.commands)
+        commandsByStatus['TOTAL'] = sum(counters['commands'].values())
 
         #
         # Get info rendernodes
         #
-        renderNodeStats = {'totalCores': 0, 'idleCores': 0, 'missingRenderNodes': 0}
-        renderNodeByStatus = dict(((status, 0) for status in RN_STATUS_NAMES))
-
-        for node in tree.renderNodes.values():
-            if node.status != RN_UNKNOWN:
-                renderNodeStats['totalCores'] += node.coresNumber
-                renderNodeStats['idleCores'] += node.freeCoresNumber
-            else:
-                renderNodeStats['missingRenderNodes'] += 1
-            renderNodeByStatus[RN_STATUS_NAMES[node.status]] += 1
+        renderNodeStats = {'totalCores': counters['totalCores'],
+                           'idleCores': counters['idleCores'],
+                           'missingRenderNodes': counters['renderNodes'].get(RN_UNKNOWN, 0)}
+        renderNodeByStatus = {}
+        for (status, name) in enumerate(RN_STATUS_NAMES):
+            renderNodeByStatus[name] = counters['renderNodes'].get(status, 0)
         renderNodeStats['renderNodesByStatus'] = renderNodeByStatus
 
         #
         # Get info on jobs (first level of hierarchy)
         #
-        jobsByStatus = dict(((status, 0) for status in NODE_STATUS_NAMES))
-        for node in tree.nodes[1].children:
-            jobsByStatus[NODE_STATUS_NAMES[node.status]] += 1
-        jobsByStatus['TOTAL'] = len(tree.nodes[1].children)
+        jobsByStatus = {}
+        for (status, name) in enumerate(NODE_STATUS_NAMES):
+            jobsByStatus[name] = counters['jobs'].get(status, 0)
+        jobsByStatus['TOTAL'] = sum(counters['jobs'].values())
 
         #
         # Final recap
@@ -176,22 +180,21 @@ class StatsResource(DispatcherBaseResource):
             'licenses': repr(self.dispatcher.licenseManager),
             'licensesDict': self.dispatcher.licenseManager.stats()
         }
-        self.writeCallback(stats)
+        self.writeCached(stats)
 
 
 class MobileResource(DispatcherBaseResource):
+    @snapshot
     def get(self):
         from octopus.core.enums.rendernode import RN_STATUS_NAMES
         html = "<meta name = \"viewport\" content = \"width = device-width\">\n<meta name = \"viewport\" content = \"width = 320\">"
         tree = self.getDispatchTree()
+        counters = tree.farmCounters.getCounters(tree)
         commandsByStatus = {}
-        for name in CMD_STATUS_NAME:
-            commandsByStatus[name] = 0
-        for command in tree.commands.values():
-            status = CMD_STATUS_NAME[command.status]
-            commandsByStatus[status] += 1
+        for (status, name) in enumerate(CMD_STATUS_NAME):
+            commandsByStatus[name] = counters['commands'].get(status, 0)
         del commandsByStatus["FINISHING"]
-        commandsByStatus['TOTAL'] = len(tree.commands)
+        commandsByStatus['TOTAL'] = sum(counters['commands'].values())
 
         colors = {'BLOCKED': "white",
                   'IDLE': "rgb(190,186,138)",
@@ -218,10 +221,10 @@ class MobileResource(DispatcherBaseResource):
 
         html += "<div style=\"margin-left:160px;\">"
         html += "<b>Workers Status</b><br><br><table border=1 style=\"border-collapse:collapse;text-align:center;\">"
-        renderNodeByStatus = dict(((status, 0) for status in RN_STATUS_NAMES))
-        renderNodeByStatus['TOTAL'] = len(tree.renderNodes.values())
-        for node in tree.renderNodes.values():
-            renderNodeByStatus[RN_STATUS_NAMES[node.status]] += 1
+        renderNodeByStatus = {}
+        for (status, name) in enumerate(RN_STATUS_NAMES):
+            renderNodeByStatus[name] = counters['renderNodes'].get(status, 0)
+        renderNodeByStatus['TOTAL'] = sum(counters['renderNodes'].values())
         for key, value in renderNodeByStatus.items():
             html += "<tr style=\"background-color:" + colors[key.upper()] + "\"><td>" + key.upper() + "</td><td>" + str(value) + "</td></tr>"
         html += "</table>"
@@ -295,6 +298,7 @@ class ShutdownResource(DispatcherBaseResource):
         try:
             result = {'return_code': True}
             self.write(json.dumps(result))
+            tornado.ioloop.IOLoop.instance().add_callback(self.framework.stopScheduler)
             tornado.ioloop.IOLoop.instance().add_callback(self.framework.application.shutdown)
             tornado.ioloop.IOLoop.instance().add_callback(tornado.ioloop.IOLoop.instance().stop)
 
@@ -311,6 +315,7 @@ class RestartResource(DispatcherBaseResource):
 
             result = {'return_code': True}
             self.write(json.dumps(result))
+            tornado.ioloop.IOLoop.instance().add_callback(self.framework.stopScheduler)
             tornado.ioloop.IOLoop.instance().add_callback(self.framework.application.shutdown)
             tornado.ioloop.IOLoop.instance().add_callback(tornado.ioloop.IOLoop.instance().stop)
 
@@ -0,0 +1,296 @@
+"""
+HTTP client shared by every request sent by the dispatcher to the workers.
+
+Requests are sent by a fixed number of sender threads (the total concurrency limit) over keep-alive
+connections kept per worker, with at most a few requests in flight per worker. A failed request is not
+retried by a sleeping thread: it is scheduled again after a growing delay and the thread sends other
+requests meanwhile. After too many consecutive failures the circuit of a worker opens: its pending requests
+fail at once and new ones are refused until the quarantine delay has elapsed, the next request then probes
+the worker again.
+
+The callbacks of asynchronous requests are run by the thread calling poll() (i.e. the dispatcher main loop),
+never by the sender threads, so that they can safely modify the model.
+"""
+
+from __future__ import with_statement
+
+import errno
+import heapq
+import httplib as http
+import itertools
+import logging
+import socket
+import time
+from collections import deque
+from threading import Thread, Condition, Event, Lock
+
+from octopus.core import singletonconfig
+
+
+LOGGER = logging.getLogger('main.dispatcher.webservice')
+
+
+class RequestFailed(Exception):
+    '''
+    A request to a worker failed. If quarantine is set, the worker is considered unreachable.
+    '''
+
+    def __init__(self, cause=None, quarantine=False):
+        Exception.__init__(self, cause)
+        self.cause = cause
+        self.quarantine = quarantine
+
+
+class WorkerRequest(object):
+    '''
+    A request to a worker, completed with either a (HTTPResponse, data) result or a RequestFailed error.
+    The context is any object given by the sender for its callbacks.
+    '''
+
+    def __init__(self, renderNode, method, url, body, headers, onResponse, onError, synchronous, context=None):
+        self.renderNode = renderNode
+        self.key = (renderNode.host, int(renderNode.port))
+        self.method = method
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.onResponse = onResponse
+        self.onError = onError
+        self.synchronous = synchronous
+        self.context = context
+        self.attempt = 0
+        self.result = None
+        self.error = None
+        self.done = Event()
+
+    def wait(self, timeout=None):
+        '''
+        Waits for the request to complete, returns the (HTTPResponse, data) tuple or raises RequestFailed.
+        '''
+        self.done.wait(timeout)
+        if not self.done.isSet():
+            raise RequestFailed("no answer after %s s" % timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class WorkerState(object):
+    '''
+    Pending requests, idle connections and circuit breaker of one worker.
+    '''
+
+    def __init__(self, key):
+        self.key = key
+        self.pending = deque()
+        self.connections = []
+        self.active = 0
+        self.runnable = False
+        self.failures = 0
+        self.openUntil = 0
+
+
+class WorkerClient(object):
+
+    def __init__(self, maxConnections, maxConnectionsPerWorker, maxRetries, retryDelay, timeout,
+                 failureThreshold, quarantineDelay):
+        self.maxConnectionsPerWorker = maxConnectionsPerWorker
+        self.maxRetries = maxRetries
+        self.retryDelay = retryDelay
+        self.timeout = timeout
+        self.failureThreshold = failureThreshold
+        self.quarantineDelay = quarantineDelay
+        self.condition = Condition(Lock())
+        self.workers = {}
+        # workers having pending requests and a free connection slot
+        self.runnable = deque()
+        # (time, sequence, request) of the requests waiting before a retry
+        self.delayed = []
+        self.sequence = itertools.count()
+        self.completed = deque()
+        self.threads = []
+        for i in xrange(maxConnections):
+            thread = Thread(target=self.run, name='WorkerClient-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    ## Queues a request to the worker of the given render node.
+    # @param onResponse called with (request, response, data) by poll() if the request succeeds
+    # @param onError called with (request, error) by poll() if the request fails
+    # @param context stored in request.context for the callbacks, set before the request can complete
+    # @return the WorkerRequest
+    #
+    def send(self, renderNode, method, url, body=None, headers={}, onResponse=None, onError=None, synchronous=False,
+             context=None):
+        request = WorkerRequest(renderNode, method, url, body, headers, onResponse, onError, synchronous, context)
+        with self.condition:
+            state = self.workers.get(request.key)
+            if state is None:
+                state = self.workers[request.key] = WorkerState(request.key)
+            if state.openUntil > time.time():
+                self.complete(request, error=RequestFailed("worker %s:%d is in quarantine" % request.key, quarantine=True))
+                return request
+            state.pending.append(request)
+            self.schedule(state)
+        return request
+
+    ## Sends a request and waits for its completion.
+    # @return a (HTTPResponse, data) tuple
+    # @raise RequestFailed if the request fails
+    #
+    def call(self, renderNode, method, url, body=None, headers={}):
+        request = self.send(renderNode, method, url, body, headers, synchronous=True)
+        return request.wait()
+
+    ## Runs the callbacks of the asynchronous requests completed since the last call.
+    # @return the number of completed requests
+    #
+    def poll(self):
+        count = 0
+        while self.completed:
+            request = self.completed.popleft()
+            count += 1
+            try:
+                if request.error is not None:
+                    if request.error.quarantine:
+                        request.renderNode.quarantine()
+                    if request.onError is not None:
+                        request.onError(request, request.error)
+                elif request.onResponse is not None:
+                    response, data = request.result
+                    request.onResponse(request, response, data)
+            except Exception:
+                LOGGER.exception("error in the callback of request %s %s to %s:%d" % ((request.method, request.url) + request.key))
+        return count
+
+    def schedule(self, state):
+        # called with the condition held
+        if state.pending and not state.runnable and state.active < self.maxConnectionsPerWorker:
+            state.runnable = True
+            self.runnable.append(state)
+            self.condition.notify()
+
+    def complete(self, request, result=None, error=None):
+        request.result = result
+        request.error = error
+        if not request.synchronous:
+            self.completed.append(request)
+        request.done.set()
+
+    def openCircuit(self, state):
+        # called with the condition held, fails the pending and delayed requests of the worker
+        state.openUntil = time.time() + self.quarantineDelay
+        LOGGER.warning("Worker %s:%d does not answer, requests are refused for %s s" % (state.key + (self.quarantineDelay,)))
+        while state.pending:
+            self.complete(state.pending.popleft(), error=RequestFailed("worker %s:%d is in quarantine" % state.key, quarantine=True))
+        delayed = [item for item in self.delayed if item[2].key == state.key]
+        if delayed:
+            self.delayed = [item for item in self.delayed if item[2].key != state.key]
+            heapq.heapify(self.delayed)
+            for item in delayed:
+                self.complete(item[2], error=RequestFailed("worker %s:%d is in quarantine" % state.key, quarantine=True))
+
+    def take(self):
+        '''
+        Waits for a request to send, returns it with the worker state and an idle connection (or None).
+        '''
+        with self.condition:
+            while True:
+                now = time.time()
+                while self.delayed and self.delayed[0][0] <= now:
+                    request = heapq.heappop(self.delayed)[2]
+                    state = self.workers[request.key]
+                    state.pending.append(request)
+                    self.schedule(state)
+                if self.runnable:
+                    break
+                self.condition.wait(self.delayed[0][0] - now if self.delayed else None)
+            state = self.runnable.popleft()
+            state.runnable = False
+            request = state.pending.popleft()
+            state.active += 1
+            self.schedule(state)
+            connection = state.connections.pop() if state.connections else None
+            return request, state, connection
+
+    def run(self):
+        while True:
+            request, state, connection = self.take()
+            try:
+                result, connection, error = self.process(request, connection)
+            except Exception, e:
+                LOGGER.exception("unexpected error while sending request %s %s to %s:%d" % ((request.method, request.url) + request.key))
+                result, connection, error = None, None, e
+            with self.condition:
+                state.active -= 1
+                if connection is not None:
+                    state.connections.append(connection)
+                if error is None:
+                    state.failures = 0
+                    self.complete(request, result)
+                else:
+                    self.retry(state, request, error)
+                self.schedule(state)
+
+    def retry(self, state, request, error):
+        # called with the condition held
+        state.failures += 1
+        request.attempt += 1
+        LOGGER.warning("request %s %s to %s:%d failed (%d/%d), reason: %s" % ((request.method, request.url) + request.key + (request.attempt, self.maxRetries, error)))
+        if isinstance(error, socket.error) and error.errno in (errno.ECONNREFUSED, errno.ENETUNREACH):
+            # nothing listens on the worker port, no need to retry
+            self.complete(request, error=RequestFailed(error))
+        elif state.failures >= self.failureThreshold or request.attempt >= self.maxRetries:
+            self.complete(request, error=RequestFailed(error, quarantine=True))
+            self.openCircuit(state)
+        else:
+            delay = self.retryDelay * 2 ** (request.attempt - 1)
+            heapq.heappush(self.delayed, (time.time() + delay, next(self.sequence), request))
+            self.condition.notify()
+
+    def process(self, request, connection):
+        '''
+        Sends a request, returns a (result, connection to keep or None, error or None) tuple.
+        '''
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = http.HTTPConnection(request.key[0], request.key[1], timeout=self.timeout)
+            try:
+                connection.request(request.method, request.url, request.body, request.headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (socket.error, http.HTTPException), e:
+                connection.close()
+                connection = None
+                if reused:
+                    # the worker may have closed the idle connection, try once with a new one
+                    reused = False
+                    continue
+                return None, None, e
+            if response.will_close:
+                connection.close()
+                connection = None
+            return (response, data or None), connection, None
+
+
+_client = None
+_clientLock = Lock()
+
+
+## Returns the client shared by the dispatcher, created on first use from the COMMUNICATION settings.
+#
+def getClient():
+    global _client
+    with _clientLock:
+        if _client is None:
+            maxRetries = singletonconfig.get('COMMUNICATION', 'RENDERNODE_REQUEST_MAX_RETRY_COUNT')
+            _client = WorkerClient(singletonconfig.get('COMMUNICATION', 'RENDERNODE_MAX_CONNECTIONS', 32),
+                                   singletonconfig.get('COMMUNICATION', 'RENDERNODE_MAX_CONNECTIONS_PER_WORKER', 2),
+                                   maxRetries,
+                                   singletonconfig.get('COMMUNICATION', 'RENDERNODE_REQUEST_DELAY_AFTER_REQUEST_FAILURE'),
+                                   singletonconfig.get('COMMUNICATION', 'RENDERNODE_REQUEST_TIMEOUT', 5),
+                                   singletonconfig.get('COMMUNICATION', 'RENDERNODE_FAILURE_THRESHOLD', maxRetries),
+                                   singletonconfig.get('COMMUNICATION', 'RENDERNODE_QUARANTINE_DELAY', 60))
+        return _client
@@ -171,12 +171,18 @@ def main():
     server = make_dispatcher()
 
     # Define a periodic callback to process DB/COMPLETION/ASSIGNMENT updates
-    periodic = tornado.ioloop.PeriodicCallback(server.loop, singletonconfig.get('CORE', 'MASTER_UPDATE_INTERVAL'))
-    periodic.start()
+    # either in a dedicated thread or directly in the tornado IOLoop
+    if singletonconfig.get('CORE', 'SCHEDULER_THREAD', False):
+        logging.getLogger('main').warning("starting scheduler thread")
+        server.startScheduler(singletonconfig.get('CORE', 'MASTER_UPDATE_INTERVAL'))
+    else:
+        periodic = tornado.ioloop.PeriodicCallback(server.loop, singletonconfig.get('CORE', 'MASTER_UPDATE_INTERVAL'))
+        periodic.start()
     try:
         logging.getLogger('main').warning("starting tornado main loop")
         tornado.ioloop.IOLoop.instance().start()
     except (KeyboardInterrupt, SystemExit):
+        server.stopScheduler()
         server.application.shutdown()
 
     # If restart flag is set (via /restart webservice)
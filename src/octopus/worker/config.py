@@ -27,6 +27,8 @@ WORKER_REGISTER_DELAY_AFTER_FAILURE = 15           # wait 15s before retrying to
 
 WORKER_REQUEST_MAX_RETRY_COUNT = 8                 # nb of retry for a failed request
 WORKER_REQUEST_DELAY_AFTER_REQUEST_FAILURE = .5    # wait 500ms before resending a request in case of failure (each retry will have a 2 x longer delay)
+WORKER_REQUEST_TIMEOUT = 5                         # timeout of the requests sending the command updates (in seconds)
+WORKER_STATUS_REPORT_DELAY = .5                    # interval between 2 batches of command updates, a status change is sent at once
 
 #
 # Indicate the log file size in bytes and number of file backups --> 2Mo x 10
@@ -0,0 +1,156 @@
+"""
+Background reporting of the command updates of the worker to the dispatcher.
+
+The main loop posts the update dict of each modified command, the updates of a command are coalesced until
+they are sent. A thread sends the pending updates in a single request (PUT /rendernodes/<rn>/commands/)
+every WORKER_STATUS_REPORT_DELAY seconds, or at once when the status of a command changes. Failed requests
+are retried with a growing delay by the thread, the main loop never waits for the dispatcher.
+"""
+
+from __future__ import with_statement
+
+import httplib
+import logging
+import socket
+from threading import Thread, Lock, Event
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from octopus.worker import config
+
+
+LOGGER = logging.getLogger("worker")
+
+# max delay between two retries of a failed request (in seconds)
+MAX_RETRY_DELAY = 30
+
+
+class StatusReporter(Thread):
+
+    def __init__(self, computerName, address, port):
+        Thread.__init__(self, name='StatusReporter')
+        self.daemon = True
+        self.computerName = computerName
+        self.address = address
+        self.port = port
+        self.lock = Lock()
+        self.wakeup = Event()
+        # commandId -> update dict not acknowledged by the dispatcher yet
+        self.pending = {}
+        # ids of the commands unknown to the dispatcher, removed by the main loop
+        self.staleCommands = []
+        # cleared if the dispatcher does not handle batch updates, the commands are then updated one by one
+        self.batch = True
+        self.connection = None
+
+    def post(self, commandId, updateDict, urgent=False):
+        '''
+        Queues the update of a command, merged with its pending update if any.
+        If urgent is set (i.e. the status changed), the pending updates are sent at once.
+        '''
+        with self.lock:
+            previous = self.pending.get(commandId)
+            if previous is not None:
+                merged = dict(previous)
+                if updateDict.get('stats') is None and 'stats' in merged:
+                    # stats are only sent when they change, keep the last ones not sent yet
+                    updateDict = dict(updateDict)
+                    del updateDict['stats']
+                merged.update(updateDict)
+                updateDict = merged
+            self.pending[commandId] = updateDict
+        if urgent:
+            self.wakeup.set()
+
+    def isPending(self, commandId):
+        return commandId in self.pending
+
+    def popStaleCommands(self):
+        with self.lock:
+            staleCommands, self.staleCommands = self.staleCommands, []
+        return staleCommands
+
+    def run(self):
+        failures = 0
+        while True:
+            if failures:
+                delay = min(config.WORKER_REQUEST_DELAY_AFTER_REQUEST_FAILURE * 2 ** (failures - 1), MAX_RETRY_DELAY)
+                LOGGER.warning('Next retry of the command updates will occur in %.2f s' % delay)
+            else:
+                delay = config.WORKER_STATUS_REPORT_DELAY
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+            with self.lock:
+                updates = self.pending.values()
+            if not updates:
+                continue
+            try:
+                if self.batch:
+                    results = self.sendBatch(updates)
+                else:
+                    results = [(updateDict, self.sendUpdate(updateDict)) for updateDict in updates]
+            except (httplib.HTTPException, socket.error), e:
+                LOGGER.error('Update of %d commands failed (error:%r)', len(updates), e)
+                self.close()
+                failures += 1
+                continue
+            except Exception:
+                LOGGER.exception('Update of %d commands failed', len(updates))
+                self.close()
+                failures += 1
+                continue
+
+            failures = 0
+            with self.lock:
+                for (updateDict, status) in results:
+                    commandId = updateDict['id']
+                    if status in (200, 404) and self.pending.get(commandId) is updateDict:
+                        # a newer update posted meanwhile stays pending
+                        del self.pending[commandId]
+                    if status == 404:
+                        self.staleCommands.append(commandId)
+                    elif status != 200:
+                        failures = 1
+
+    def request(self, url, body):
+        if self.connection is None:
+            self.connection = httplib.HTTPConnection(self.address, self.port, timeout=config.WORKER_REQUEST_TIMEOUT)
+        self.connection.request('PUT', url, body, {'Content-Length': len(body)})
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.will_close:
+            self.close()
+        return response, data
+
+    def sendBatch(self, updates):
+        '''
+        Sends the updates in a single request, returns a list of (update dict, status) tuples.
+        '''
+        url = "/rendernodes/%s/commands/" % self.computerName
+        response, data = self.request(url, json.dumps({'commands': updates}))
+        if response.status == 404 or response.status == 405:
+            LOGGER.warning('The dispatcher does not handle batch updates, commands will be updated one by one')
+            self.batch = False
+            return [(updateDict, self.sendUpdate(updateDict)) for updateDict in updates]
+        if response.status != 200:
+            LOGGER.warning("unexpected status %d: %s %s" % (response.status, response.reason, data))
+            return [(updateDict, response.status) for updateDict in updates]
+        statuses = dict((result['id'], result['status']) for result in json.loads(data)['results'])
+        return [(updateDict, statuses.get(updateDict['id'], 500)) for updateDict in updates]
+
+    def sendUpdate(self, updateDict):
+        '''
+        Sends the update of a single command, returns the http status.
+        '''
+        url = "/rendernodes/%s/commands/%d/" % (self.computerName, updateDict['id'])
+        response, data = self.request(url, json.dumps(updateDict))
+        if response.status not in (200, 404):
+            LOGGER.warning("unexpected status %d: %s %s" % (response.status, response.reason, data))
+        return response.status
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
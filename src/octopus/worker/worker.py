@@ -30,6 +30,7 @@ from octopus.worker import settings
 from octopus.worker import config
 
 from octopus.worker.model.command import Command
+from octopus.worker.statusreporter import StatusReporter
 from octopus.worker.process import spawnCommandWatcher
 from octopus.worker.process import spawnRezManagedCommandWatcher
 
@@ -70,6 +71,7 @@ class Worker(MainLoopApplication):
             self.command = None
             self.modified = True
             self.finished = False
+            self.reportedStatus = None
 
         def __repr__(self):
             return str(
@@ -96,7 +98,7 @@ class Worker(MainLoopApplication):
         Property of the Worker class. An iterable list of the finished command watchers
         :rtype: list of CommandWatcher
         """
-        return (watcher for watcher in self.commandWatchers.values() if watcher.finished and not watcher.modified)
+        return (watcher for watcher in self.commandWatchers.values() if watcher.finished and not watcher.modified and not self.statusReporter.isPending(watcher.commandId))
 
     def __init__(self, framework):
         super(Worker, self).__init__(self)
@@ -120,6 +122,7 @@ class Worker(MainLoopApplication):
         self.registerDate = 0
 
         self.httpconn = httplib.HTTPConnection(settings.DISPATCHER_ADDRESS, settings.DISPATCHER_PORT)
+        self.statusReporter = StatusReporter(self.computerName, settings.DISPATCHER_ADDRESS, settings.DISPATCHER_PORT)
         self.PID_DIR = os.path.dirname(settings.PIDFILE)
         if not os.path.isdir(self.PID_DIR):
             LOGGER.warning("Worker pid directory %s does not exist, creating..." % self.PID_DIR)
@@ -147,6 +150,7 @@ class Worker(MainLoopApplication):
         for name in (name for name in dir(settings) if name.isupper()):
             LOGGER.info("settings.%s = %r", name, getattr(settings, name))
         self.registerWorker()
+        self.statusReporter.start()
 
     def getNbCores(self):
         import multiprocessing
@@ -413,58 +417,18 @@ class Worker(MainLoopApplication):
 
     def updateCommandWatcher(self, commandWatcher):
         """
-        | Send info to the dispatcher about currently running command watcher.
+        | Queues an update of the currently running command watcher for the dispatcher.
         | Called from the mainloop every time a command has been tagged "modified"
-        | req: PUT /rendernodes/<currentRN>/commands/<commandId>/
+        | The update is sent in background by the status reporter, at once if the status has changed
+        | req: PUT /rendernodes/<currentRN>/commands/
 
         :param commandWatcher: the commandWatcher object we will send an update about
         """
-
-        maxRetry = max(1, config.WORKER_REQUEST_MAX_RETRY_COUNT)
-        delayRetry = config.WORKER_REQUEST_DELAY_AFTER_REQUEST_FAILURE
-        i = 0
-
-        while i < maxRetry:
-            url = "/rendernodes/%s/commands/%d/" % (self.computerName, commandWatcher.commandId)
-            body = json.dumps(self.buildUpdateDict(commandWatcher.command))
-            headers = {'Content-Length': len(body)}
-
-            try:
-                self.httpconn.request('PUT', url, body, headers)
-                response = self.httpconn.getresponse()
-            except httplib.HTTPException, e:
-                LOGGER.error('"PUT %s" failed (error:%r)', url, e)
-            except socket.error, e:
-                LOGGER.error('"PUT %s" failed (error:%r)', url, e)
-            except Exception, e:
-                LOGGER.info('"PUT %s" failed (unhandled exception: %r', url, e)
-            else:
-                if response.status == 200:
-                    response = response.read()
-                    commandWatcher.modified = False
-                    break
-                elif response.status == 404:
-                    LOGGER.warning('removing stale command %d', commandWatcher.commandId)
-                    response = response.read()
-                    self.removeCommandWatcher(commandWatcher)
-                    break
-                else:
-                    data = response.read()
-                    LOGGER.warning("unexpected status %d: %s %s" % (response.status, response.reason, data))
-            finally:
-                self.httpconn.close()
-
-            LOGGER.warning('Update of command %d failed (attempt %d of %d)', commandWatcher.commandId, i, maxRetry)
-            LOGGER.warning('Next retry will occur in %.2f s' % delayRetry)
-            time.sleep(delayRetry)
-            i += 1
-            delayRetry *= 1.5
-
-        # Request error encountered "maxRetry" times, removing the command watcher to avoid
-        # recalling this update in next main loop iter
-        # if i == maxRetry:
-        #     LOGGER.exception('Update of command %d failed repeatedly, removing watcher.', commandWatcher.commandId )
-        #     self.removeCommandWatcher(commandWatcher)
+        dct = self.buildUpdateDict(commandWatcher.command)
+        urgent = dct.get("status") != commandWatcher.reportedStatus
+        commandWatcher.reportedStatus = dct.get("status")
+        self.statusReporter.post(commandWatcher.commandId, dct, urgent)
+        commandWatcher.modified = False
 
     def pauseWorker(self, paused, killproc):
         """
@@ -728,6 +692,11 @@ class Worker(MainLoopApplication):
         for commandWatcher in self.modifiedCommandWatchers:
             self.updateCommandWatcher(commandWatcher)
 
+        for commandId in self.statusReporter.popStaleCommands():
+            if commandId in self.commandWatchers:
+                LOGGER.warning('removing stale command %d', commandId)
+                self.removeCommandWatcher(self.commandWatchers[commandId])
+
         #
         # Attempt to remove finished command watchers
         #
@@ -16,6 +16,7 @@ from tornado.web import Application, RequestHandler
 
 # /commands/ [GET] { commands: [ { id, status, completion } ] }
 # /commands/ [POST] { id, jobtype, arguments }
+# /commands/batch/ [POST] { commands: [ { id, jobtype, arguments } ] } -> { results: [ { id, status } ] }
 # /commands/{id}/ [GET] { id, status, completion, jobtype, arguments }
 # /commands/{id}/ [DELETE] stops the job
 # /online/ [GET] { online }
@@ -29,6 +30,7 @@ class WorkerWebService(Application):
     '''A tornado application that will communicate with the dispatcher via webservices
     Services are:
     /commands
+    /commands/batch
     /commands/<id command>
     /log
     /log/command/<path>
@@ -40,6 +42,7 @@ class WorkerWebService(Application):
     def __init__(self, framework, port):
         super(WorkerWebService, self).__init__([
             (r'/commands/?$', CommandsResource, dict(framework=framework)),
+            (r'/commands/batch/?$', CommandBatchResource, dict(framework=framework)),
             (r'/commands/(?P<id>\d+)/?$', CommandResource, dict(framework=framework)),
             (r'/commands/(?P<id>\d+)/done?$', CommandDoneResource, dict(framework=framework)),
             (r'/debug/?$', DebugResource, dict(framework=framework)),
@@ -139,7 +142,10 @@ class CommandsResource(BaseResource):
     def post(self):
         # @todo this setRnId call may be just in doOnline necessary
         self.setRnId(self.request)
-        data = self.getBodyAsJSON()
+        self.set_status(self.addCommand(self.getBodyAsJSON()))
+
+    def addCommand(self, data):
+        '''Adds a command described by a dict received from the dispatcher, returns the http status of the operation.'''
         dct = {}
         for key, value in data.items():
             dct[str(key)] = value
@@ -169,12 +175,28 @@ class CommandsResource(BaseResource):
                                                              )
         except WorkerInternalException, e:
             LOGGER.error("Impossible to add command %r, the RN status is 'paused' (%r)" % (dct['commandId'], e))
-            self.set_status(500)
+            return 500
         except Exception, e:
             LOGGER.error("Impossible to add command %r (%r)" % (dct['commandId'], e))
-            self.set_status(500)
+            return 500
         else:
-            self.set_status(202)
+            return 202
+
+
+class CommandBatchResource(CommandsResource):
+    def post(self):
+        '''
+        | Adds several commands sent by the dispatcher in a single request.
+        | Each command is acknowledged separately with the status a POST on /commands would have returned.
+        |
+        | URL: POST http://host:port/commands/batch
+        '''
+        self.setRnId(self.request)
+        data = self.getBodyAsJSON()
+        results = []
+        for commandData in data['commands']:
+            results.append({'id': int(commandData['id']), 'status': self.addCommand(commandData)})
+        self.write({'results': results})
 
 
 class CommandDoneResource(BaseResource):